@@ -0,0 +1,262 @@
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from test_harness.ParallelPointEncoder import ParallelPointEncoder
+from test_harness.PmacSimulator import PmacSimulator
+from test_harness.PmacTestHarness import PmacTestHarness
+from test_harness.PointSet import PointSet
+from test_harness.TrajectoryScanGenerator import TrajectoryScanGenerator as ScanGen
+
+from pkg_resources import require
+require('numpy')
+import numpy
+
+AXES = ['a', 'b', 'c', 'u', 'v', 'w', 'x', 'y', 'z']
+
+
+def time_function(function, repeats):
+    """
+    Time repeated calls of function
+
+    Args:
+        function(function): Function to call with no arguments
+        repeats(int): Number of times to call function
+
+    Returns:
+        dict: Minimum, median and mean time of a call in seconds
+
+    """
+
+    times = []
+    for _ in range(repeats):
+        start_time = time.time()
+        function()
+        times.append(time.time() - start_time)
+
+    return {'min': min(times), 'median': float(numpy.median(times)),
+            'mean': sum(times)/len(times), 'repeats': repeats}
+
+
+def make_point_set(num_axes, num_points):
+    """
+    Make a readable point set with sine points for the given number of axes
+
+    Args:
+        num_axes(int): Number of axes
+        num_points(int): Number of points
+
+    Returns:
+        dict: Point set
+
+    """
+
+    points = ScanGen._generate_sine_points(num_points)
+    point_set = {'time': [{'time_val': 400, 'subroutine': 0, 'vel_mode': 0}]*num_points}
+    for axis in AXES[:num_axes]:
+        point_set[axis] = points[:]
+
+    return point_set
+
+
+def format_points(point_set):
+    """
+    Format a readable point set
+
+    Args:
+        point_set(dict): Point set to format
+
+    Returns:
+        dict: Formatted point set
+
+    """
+
+    scan = ScanGen()
+    scan.point_set = dict(point_set)
+    scan.format_point_set()
+
+    return scan.point_set
+
+
+def encoding_benchmarks(num_points, repeats, processes):
+    """
+    Benchmark conversion of points to PMAC format
+
+    Args:
+        num_points(int): Number of points to convert
+        repeats(int): Number of repeats for each benchmark
+        processes(int): Number of processes for parallel encoding
+
+    Returns:
+        list(dict): Benchmark results
+
+    """
+
+    values = numpy.random.uniform(-1000.0, 1000.0, num_points)
+    time_vals = numpy.full(num_points, 400)
+    vel_modes = numpy.random.randint(0, 3, num_points)
+    subroutines = numpy.random.randint(0, 15, num_points)
+    value_list = values.tolist()
+    point_set = make_point_set(1, num_points)
+    columns = PointSet(time_vals, vel_modes, subroutines, a=values)
+    encoder = ParallelPointEncoder(processes, shard_size=max(num_points/processes, 1))
+    formatted = format_points(point_set)
+
+    return [
+        dict(name='encode/double_to_pmac_float', points=num_points,
+             **time_function(lambda: [ScanGen.double_to_pmac_float(value)
+                                      for value in value_list], repeats)),
+        dict(name='encode/doubles_to_pmac_floats', points=num_points,
+             **time_function(lambda: ScanGen.doubles_to_pmac_floats(values), repeats)),
+        dict(name='encode/pack_time_words', points=num_points,
+             **time_function(lambda: ScanGen.pack_time_words(time_vals, vel_modes,
+                                                             subroutines), repeats)),
+        dict(name='encode/format_point_set', points=num_points,
+             **time_function(lambda: format_points(point_set), repeats)),
+        dict(name='encode/point_set_to_pmac_format', points=num_points,
+             **time_function(columns.to_pmac_format, repeats)),
+        dict(name='encode/parallel_format_point_set', points=num_points,
+             processes=processes,
+             **time_function(lambda: encoder.format_point_set(columns), repeats)),
+        dict(name='chunk/construct_write_commands', points=num_points,
+             **time_function(lambda: list(PmacTestHarness._construct_write_commands(
+                 'L', 0x30000, formatted['a'])), repeats))]
+
+
+def harness_benchmarks(pmac, sim, buffer_lengths, max_axes, repeats):
+    """
+    Benchmark buffer fills, readback and status polling against the simulator
+
+    Args:
+        pmac(PmacTestHarness): Harness connected to `sim`
+        sim(PmacSimulator): Simulated pmac
+        buffer_lengths(list(int)): Buffer lengths to fill
+        max_axes(int): Fill buffers for 1 to `max_axes` axes
+        repeats(int): Number of repeats for each benchmark
+
+    Returns:
+        list(dict): Benchmark results
+
+    """
+
+    results = []
+    for buffer_length in buffer_lengths:
+        pmac.set_buffer_layout(buffer_length, 0x30000, 0x30000 + 10*buffer_length)
+
+        for num_axes in range(1, max_axes + 1):
+            points = format_points(make_point_set(num_axes, buffer_length))
+            sim.packets_received = 0
+            result = time_function(lambda: pmac.fill_current_buffer(points), repeats)
+            results.append(dict(name='fill/{axes}_axes'.format(axes=num_axes),
+                                points=buffer_length,
+                                packets=sim.packets_received / repeats, **result))
+
+        sim.packets_received = 0
+        result = time_function(
+            lambda: pmac.read_points(buffer_length, num_axes=max_axes), repeats)
+        results.append(dict(name='readback/{axes}_axes'.format(axes=max_axes),
+                            points=buffer_length,
+                            packets=sim.packets_received / repeats, **result))
+
+    results.append(dict(name='status/update_status_variables', points=0,
+                        **time_function(pmac.update_status_variables, repeats)))
+
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance, min_difference):
+    """
+    Compare the median times of results to a baseline run
+
+    Args:
+        results(list(dict)): Benchmark results
+        baseline(list(dict)): Results of a previous run
+        tolerance(float): Allowed ratio of new to baseline time before a result is
+        counted as a regression
+        min_difference(float): Slowdowns of less than this many seconds are not
+        counted as regressions, as millisecond timings vary by more than `tolerance`
+
+    Returns:
+        list(dict): Results that have regressed
+
+    """
+
+    baseline_times = {}
+    for result in baseline:
+        baseline_times[(result['name'], result['points'])] = result.get('median',
+                                                                        result['min'])
+
+    regressions = []
+    for result in results:
+        baseline_time = baseline_times.get((result['name'], result['points']))
+        if baseline_time:
+            result['baseline'] = baseline_time
+            result['ratio'] = result['median'] / baseline_time
+            if result['ratio'] > tolerance and \
+                    result['median'] - baseline_time >= min_difference:
+                regressions.append(result)
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark point encoding, buffer fills, readback and status "
+                    "polling against a simulated PMAC")
+    parser.add_argument("--points", type=int, default=100000,
+                        help="Number of points to encode")
+    parser.add_argument("--buffer-lengths", type=int, nargs="+", default=[100, 1000],
+                        help="Buffer lengths to fill")
+    parser.add_argument("--max-axes", type=int, default=9,
+                        help="Fill buffers for 1 up to this number of axes")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of processes for parallel encoding")
+    parser.add_argument("--repeats", type=int, default=11,
+                        help="Number of repeats for each benchmark")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Simulated latency per packet in seconds")
+    parser.add_argument("--output", help="File to write JSON results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare to")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Allowed ratio of new to baseline median time")
+    parser.add_argument("--min-difference", type=float, default=0.001,
+                        help="Ignore slowdowns of less than this many seconds")
+    args = parser.parse_args()
+
+    sim = PmacSimulator(port=0, latency=args.latency)
+    sim.load_trajectory_scan(buffer_length=max(args.buffer_lengths))
+    port = sim.start()
+    pmac = PmacTestHarness("127.0.0.1", port=port)
+
+    try:
+        results = encoding_benchmarks(args.points, args.repeats, args.processes)
+        results += harness_benchmarks(pmac, sim, args.buffer_lengths, args.max_axes,
+                                      args.repeats)
+    finally:
+        pmac.disconnect()
+        sim.stop()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file),
+                                              args.tolerance, args.min_difference)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    for result in regressions:
+        sys.stderr.write("Regression: {name} ({points} points) {median:.6f}s vs "
+                         "{baseline:.6f}s baseline\n".format(**result))
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@
 import sys, re, socket, select, random, struct
 import threading, time
 import telnetlib
+import logging
+import asyncore, collections
 
 
 def counted(fn):
@@ -16,12 +18,135 @@ def counted(fn):
 class IOPmacSentNullError(IOError):
         pass
 
+# Raised with the response when the PMAC replies with an ERRxxx code, so that the output of any
+# commands it executed before the error can still be recovered
+class IOPmacErrorResponse(IOError):
+        pass
+
+class PmacMetrics(object):
+	'''Collects wire-level statistics for a RemotePmacInterface: a latency histogram per
+	   command type, bytes sent and received, VR_PMAC_GETBUFFER continuations, time spent
+	   waiting for the connection semaphore and error counts. Enable it on an interface
+	   with RemotePmacInterface.enableMetrics().'''
+
+	# Upper bounds (in seconds) of the latency histogram buckets; the last bucket is unbounded
+	LATENCY_BUCKETS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self._logThread = None
+		self._stopLogging = threading.Event()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.commandTypes = {}
+			self.bytesSent = 0
+			self.bytesReceived = 0
+			self.continuations = 0
+			self.semaphoreWaits = 0
+			self.semaphoreWaitTime = 0.0
+			self.errors = 0
+			self.startTime = time.time()
+
+	# The type of a command is its leading letters (e.g. 'WL', 'RHL', 'P') or '#'/'&' for
+	# motor and coordinate system commands. Packed lines are counted as the type of their first command.
+	@staticmethod
+	def commandType(command):
+		mo = re.match(r'[#&]|[A-Z]+', command.strip().upper())
+		if mo:
+			return mo.group(0)
+		return '?'
+
+	def recordSemaphoreWait(self, waitTime):
+		with self.lock:
+			self.semaphoreWaits += 1
+			self.semaphoreWaitTime += waitTime
+
+	def recordCommand(self, command, latency, bytesSent, bytesReceived, continuations, wasSuccessful):
+		commandType = self.commandType(command)
+		bucket = len(self.LATENCY_BUCKETS)
+		for i, bound in enumerate(self.LATENCY_BUCKETS):
+			if latency <= bound:
+				bucket = i
+				break
+
+		with self.lock:
+			if commandType not in self.commandTypes:
+				self.commandTypes[commandType] = {'count': 0, 'errors': 0, 'totalLatency': 0.0,
+					'maxLatency': 0.0, 'histogram': [0] * (len(self.LATENCY_BUCKETS) + 1)}
+			stats = self.commandTypes[commandType]
+			stats['count'] += 1
+			stats['totalLatency'] += latency
+			stats['maxLatency'] = max(stats['maxLatency'], latency)
+			stats['histogram'][bucket] += 1
+			if not wasSuccessful:
+				stats['errors'] += 1
+				self.errors += 1
+			self.bytesSent += bytesSent
+			self.bytesReceived += bytesReceived
+			self.continuations += continuations
+
+	# Returns: a dict of all the statistics collected since the last reset
+	def snapshot(self):
+		with self.lock:
+			commandTypes = {}
+			for commandType, stats in self.commandTypes.items():
+				stats = dict(stats)
+				stats['histogram'] = list(stats['histogram'])
+				stats['meanLatency'] = stats['totalLatency'] / stats['count']
+				commandTypes[commandType] = stats
+			return {'elapsed': time.time() - self.startTime,
+				'latencyBuckets': list(self.LATENCY_BUCKETS),
+				'commandTypes': commandTypes,
+				'bytesSent': self.bytesSent,
+				'bytesReceived': self.bytesReceived,
+				'continuations': self.continuations,
+				'semaphoreWaits': self.semaphoreWaits,
+				'semaphoreWaitTime': self.semaphoreWaitTime,
+				'errors': self.errors}
+
+	# Returns: a one line summary of the statistics, e.g. for periodic logging
+	def logLine(self):
+		snapshot = self.snapshot()
+		commands = ' '.join('%s=%d/%.1fms' % (commandType, stats['count'], stats['meanLatency'] * 1000)
+			for commandType, stats in sorted(snapshot['commandTypes'].items()))
+		return ('PMAC metrics: %.1fs sent=%dB received=%dB continuations=%d semaphoreWait=%.1fms errors=%d commands(count/mean): %s'
+			% (snapshot['elapsed'], snapshot['bytesSent'], snapshot['bytesReceived'], snapshot['continuations'],
+			   snapshot['semaphoreWaitTime'] * 1000, snapshot['errors'], commands))
+
+	# Log logLine() every period seconds on a background thread, with the given logger
+	# (defaults to the 'dls_pmacremote' logger at INFO level)
+	def startLogging(self, period, logger = None):
+		if logger is None:
+			logger = logging.getLogger('dls_pmacremote')
+		self.stopLogging()
+		self._stopLogging.clear()
+
+		def logPeriodically():
+			while not self._stopLogging.wait(period):
+				logger.info(self.logLine())
+
+		self._logThread = threading.Thread(target = logPeriodically)
+		self._logThread.daemon = True
+		self._logThread.start()
+
+	def stopLogging(self):
+		if self._logThread is not None:
+			self._stopLogging.set()
+			self._logThread.join()
+			self._logThread = None
+
 class RemotePmacInterface(object):
 	'''This class provides a common interface to a remote PMAC. It provides methods
            to connect to the PMAC (e.g. via a Telnet terminal server
 	   session or Ethernet), to disconnect, and to issue commands. It provides
            methods for some basic axis commands (e.g. move/jog axis etc.).  It is
            a base class that should not be instantiated directly.'''
+	# Maximum number of characters that can be sent to the PMAC in a single command line.
+	# Child classes should override this with the limit of their transport.
+	maxCommandLength = 255
+
 	def __init__(self, parent = None, verbose = False, numAxes = None, timeout = 3.0):
 		# Basic connection settings
 		self.verboseMode = verbose
@@ -44,8 +169,23 @@ class RemotePmacInterface(object):
 		else:
 			self._numAxes = None
 
+		# Wire-level statistics, None unless enabled with enableMetrics()
+		self.metrics = None
+
 		self.MACRO_STATION_LOOKUP_TABLE = [0,1,4,5,8,9,12,13,16,17,20,21,24,25,28,29,32,33,36,37,40,41,44,45,48,49,52,53,56,57,60,61,64,65]
 
+	# Start collecting wire-level statistics for commands sent on this interface.
+	# Returns: the PmacMetrics instance; read it with snapshot() or logLine()
+	def enableMetrics(self):
+		if self.metrics is None:
+			self.metrics = PmacMetrics()
+		return self.metrics
+
+	def disableMetrics(self):
+		if self.metrics is not None:
+			self.metrics.stopLogging()
+		self.metrics = None
+
 	def setConnectionParams(self, host = "localhost", port = None):
 
 		# Check if IP Address is valid
@@ -84,6 +224,13 @@ class RemotePmacInterface(object):
 	#		  * response (str): is either a string returned by the PMAC (on success), or an error message (on failure)
 	@counted
 	def sendCommand(self, command, shouldWait = True):
+		try:
+			return self._sendCommandRaisingErrorResponse(command, shouldWait = shouldWait)
+		except IOPmacErrorResponse, (e, responseError):
+			return ('I/O error during comm with PMAC: %s' % str(e), False)
+
+	# As sendCommand(), but raises IOPmacErrorResponse if the PMAC replies with an ERRxxx code
+	def _sendCommandRaisingErrorResponse(self, command, shouldWait = True):
 		# Submit the command to the low level function _sendCommand().
 		# If I/O with the PMAC fails, return as a failure case.
 		command = str(command)
@@ -103,6 +250,8 @@ class RemotePmacInterface(object):
                                 response = ""
                         else:
                                 return ('I/O error during comm with PMAC: %s' % str(e), failure, responseError)
+		except IOPmacErrorResponse:
+			raise
 		except IOError, e:
 			return ('I/O error during comm with PMAC: %s' % str(e), failure)
 		return (response, success)
@@ -312,6 +461,91 @@ class RemotePmacInterface(object):
         def commandNeedsDoubleTimeout(self, command):
                 return 'SAVE' in command.upper()
 
+	# Number of lines of output the PMAC is expected to return for a single command.
+	# Writes and assignments (e.g. "WL$30000,$0" or "P4002=1") produce no output; anything else
+	# is assumed to be a query returning one line. Multi-line queries (e.g. "P4001..4005") must
+	# have their line counts passed to sendCommands() explicitly.
+	def expectedResponseLines(self, command):
+		command = command.strip().upper()
+		if command.startswith('W') or '=' in command:
+			return 0
+		return 1
+
+	# Pack a list of independent commands into as few requests as possible and send them,
+	# demultiplexing the responses back per command.
+	# Commands are joined with spaces until the next one would exceed self.maxCommandLength
+	# characters, so each packed line is sent with a single sendCommand() round trip.
+	# Arguments: * commands (list(str)): the commands to send, in order
+	#			* responseLines (list(int), optional): the number of lines of output expected from
+	#			  each command. Defaults to self.expectedResponseLines() for each command.
+	# Returns: A list with one (response, wasSuccessful) tuple per command, in the same format as
+	#		  sendCommand(). If the PMAC reports an error part way through a packed line, the failing
+	#		  command gets the error message and the commands after it (which the PMAC did not
+	#		  execute) are marked as unsuccessful.
+	def sendCommands(self, commands, responseLines = None):
+		commands = [str(command) for command in commands]
+		if responseLines is None:
+			responseLines = [self.expectedResponseLines(command) for command in commands]
+		elif len(responseLines) != len(commands):
+			raise ValueError('Must give one response line count per command')
+
+		# Group the commands into packed lines of command indices
+		packets = []
+		packetLength = 0
+		for index, command in enumerate(commands):
+			if len(command) > self.maxCommandLength:
+				raise ValueError('Command longer than %d characters: %r' % (self.maxCommandLength, command))
+			if packets and packetLength + 1 + len(command) <= self.maxCommandLength:
+				packets[-1].append(index)
+				packetLength += 1 + len(command)
+			else:
+				packets.append([index])
+				packetLength = len(command)
+
+		results = []
+		for packet in packets:
+			packedCommand = ' '.join(commands[index] for index in packet)
+			try:
+				(response, wasSuccessful) = self._sendCommandRaisingErrorResponse(packedCommand)[:2]
+			except IOPmacErrorResponse, (e, responseError):
+				# The PMAC stops at the first failing command, so its response up to and including
+				# the error identifies which command failed
+				(response, wasSuccessful) = (responseError, True)
+			if not wasSuccessful:
+				results.extend([(response, False)] * len(packet))
+				continue
+			results.extend(self._demultiplexResponse(
+				response, [responseLines[index] for index in packet]))
+
+		return results
+
+	# Split the response to a packed line into one response per command.
+	# Arguments: * response (str): the full response returned by sendCommand()
+	#			* responseLines (list(int)): the number of lines of output expected from each command
+	# Returns: a list of (response, wasSuccessful) tuples, one per command
+	def _demultiplexResponse(self, response, responseLines):
+		errRegExp = re.compile(r'ERR\d{3}')
+		lines = response.rstrip('\x06').split('\r')[:-1]
+
+		results = []
+		position = 0
+		for count in responseLines:
+			if position < len(lines) and errRegExp.search(lines[position]):
+				# The PMAC stops processing the rest of the line after an error
+				results.append((lines[position].lstrip('\x07') + '\r\x06', False))
+				notExecuted = len(responseLines) - len(results)
+				results.extend([('Not executed due to previous error', False)] * notExecuted)
+				return results
+			commandLines = lines[position:position + count]
+			results.append((''.join(line + '\r' for line in commandLines) + '\x06', True))
+			position += count
+
+		if position != len(lines):
+			failure = ('Could not demultiplex response: %r' % response, False)
+			return [failure] * len(responseLines)
+
+		return results
+
 	# Jog incrementally
 	# \motor the motor number to jog.
 	# \direction string either "pos" or "neg"
@@ -406,9 +640,25 @@ class RemotePmacInterface(object):
 	# 	self.testIsMacroStationAxis()
 	# 	self.testGetAxisMacroStationNumber()
 
+# Add a TCP/IP header to the packet. This header is described in the "VR_PMAC_GETRESPONSE" section on page 26
+# of "Accessory 54E Ethernet Protocol User Manual":
+# S:/Technical/Controls/Delta Tau/DLS Motor Controller (Geobrick LV-IMS)/Manuals/acc-54e rev2.pdf
+def getresponseRequest(command):
+	assert type(command) == str
+	headerStr = struct.pack('>2B3H',0x40,0xBF,0x0,0x0,len(command)) # wLength is big-endian
+	wrappedCommand = headerStr + command
+	return wrappedCommand
+
+def getbufferRequest():
+	request = struct.pack('8B',0xC0,0xC5,0x0,0x0,0x0,0x0,0x08,0x0) # 0x08,0x0 for a length of 2048; 1400 would be 0x05,0x78
+	return request
+
 class PmacEthernetInterface(RemotePmacInterface):
 	'''Allows connection to a PMAC over an Ethernet interface.'''
 
+	# VR_PMAC_GETRESPONSE packets can carry up to 1400 bytes of command data
+	maxCommandLength = 1400
+
 	# Attempts to open a connection to a remote PMAC.
 	# Returns None on success, or an error message string on failure.
 	def connect(self):
@@ -465,33 +715,31 @@ class PmacEthernetInterface(RemotePmacInterface):
 				print 'Disconnected from ' + self.hostname
 
 	def _sendCommand(self, command, shouldWait = True, doubleTimeout = False):
-		# Add a TCP/IP header to the packet. This header is described in the "VR_PMAC_GETRESPONSE" section on page 26
-		# of "Accessory 54E Ethernet Protocol User Manual":
-		# S:/Technical/Controls/Delta Tau/DLS Motor Controller (Geobrick LV-IMS)/Manuals/acc-54e rev2.pdf
-		def getresponseRequest(command):
-			assert type(command) == str
-			headerStr = struct.pack('8B',0x40,0xBF,0x0,0x0,0x0,0x0,0x0,len(command))
-			wrappedCommand = headerStr + command
-			return wrappedCommand
-
-		def getbufferRequest():
-			request = struct.pack('8B',0xC0,0xC5,0x0,0x0,0x0,0x0,0x08,0x0) # 0x08,0x0 for a length of 2048; 1400 would be 0x05,0x78
-			return request
-
+		metrics = self.metrics
+		bytesSent = bytesReceived = continuations = 0
+		wasSuccessful = False
+		startTime = time.time()
 		try:
 			try:
                                 if shouldWait:
+					waitStart = time.time()
 					self.semaphore.acquire()
+					if metrics is not None:
+						metrics.recordSemaphoreWait(time.time() - waitStart)
+				startTime = time.time()
                                 if doubleTimeout:
                                         self.sock.settimeout(self.timeout*2)
                                 else:
                                         self.sock.settimeout(self.timeout)
 
-				self.sock.sendall(getresponseRequest(command)) # attept to send the whole packet
+				request = getresponseRequest(command)
+				self.sock.sendall(request) # attept to send the whole packet
+				bytesSent += len(request)
 				if self.verboseMode:
 					print 'Sent out: %r' % command
                         
 				returnStr = self.sock.recv(2048) # wait for and read the response from PMAC (will be at most 1400 chars)
+				bytesReceived += len(returnStr)
 
                                 if self.verboseMode:
                                         print 'Received: %r' % returnStr
@@ -499,13 +747,15 @@ class PmacEthernetInterface(RemotePmacInterface):
 				short_response = len(returnStr) < 1400
 
 				if short_response and (returnStr[len(returnStr) - 1] == '\x0D'):
-					raise IOError('PMAC communication error') # timeout or error
+					self._raiseCommunicationError(returnStr) # timeout or error
 
 				if short_response and (returnStr[len(returnStr) - 1] == '\x00'):
                                         raise IOPmacSentNullError('Did not respond - PMAC busy or connection lost') # connection lost or PMAC busy
 
-				if short_response and (returnStr[len(returnStr) - 1] != '\x06'):
-					raise IOError('Malformed response') # weird error
+				# A short packet without a terminator is the first of a response split into packets of
+				# less than 1400 bytes, e.g. by PmacSimulator with a lower max_response_length; the rest
+				# is requested with VR_PMAC_GETBUFFER below
+				short_response = short_response and (returnStr[len(returnStr) - 1] == '\x06')
 
 				short_response = short_response and (len(returnStr) > 1)
 				if short_response and (returnStr[len(returnStr) - 2] != '\r'):
@@ -513,27 +763,33 @@ class PmacEthernetInterface(RemotePmacInterface):
 
 				# Possible return cases after self.sock.recv(bufsize):
 				# 	returnStr[len(returnStr) - 1] == 0x06 (CTRL_F) => DONE.
-				# 	returnStr[len(returnStr) - 1] == 0x0D (CTRL_M, '\r') => timeout or error
-				# 	neither => continue receiving data
+				# 	returnStr[len(returnStr) - 1] == 0x0D (CTRL_M, '\r') in a short packet => timeout or error
+				# 	neither => continue receiving data, including a full packet split at the end of a line
 				enterLoop = (returnStr[len(returnStr) - 1] != '\x06')
-                                enterLoop = enterLoop and (returnStr[len(returnStr) - 1] != '\x0D')
+                                enterLoop = enterLoop and (len(returnStr) >= 1400 or returnStr[len(returnStr) - 1] != '\x0D')
 				while enterLoop:
 					self.sock.sendall(getbufferRequest())
                                         tmp = self.sock.recv(2048)
+					continuations += 1
+					bytesSent += 8
+					bytesReceived += len(tmp)
                                         if len(tmp) < 1400 and tmp[len(tmp) - 1] == '\x00':
 						raise IOPmacSentNullError('Connection to PMAC lost', returnStr)
 					returnStr = returnStr + tmp
 					enterLoop = (returnStr[len(returnStr) - 1] != '\x06')
-                                        enterLoop = enterLoop and (returnStr[len(returnStr) - 1] != '\x0D')
+                                        enterLoop = enterLoop and (len(tmp) >= 1400 or returnStr[len(returnStr) - 1] != '\x0D')
 
 				if returnStr[len(returnStr) - 1] == '\x0D': # stopped looping because of either timeout or error
-					raise IOError('PMAC communication error')
+					self._raiseCommunicationError(returnStr)
 
 				if (len(returnStr) > 1) and (returnStr[len(returnStr) - 2] != '\r'): # truncation error in multi-buffer response
 					returnStr = returnStr[:len(returnStr) - 1] + ' WARNING: response truncated.' + returnStr[len(returnStr) - 1]
 
+				wasSuccessful = True
 				return returnStr
 			finally:
+				if metrics is not None:
+					metrics.recordCommand(command, time.time() - startTime, bytesSent, bytesReceived, continuations, wasSuccessful)
                                 if doubleTimeout:
                                         self.sock.settimeout(self.timeout)
 				if shouldWait:
@@ -542,6 +798,249 @@ class PmacEthernetInterface(RemotePmacInterface):
 			# Interpret any socket-related error as an I/O error
 			raise IOError('Socket communication error')
 
+	# A response ending in '\r' rather than '\x06' means a timeout or an error reported by the PMAC
+	def _raiseCommunicationError(self, returnStr):
+		if re.search(r'\x07ERR\d{3}\r$', returnStr):
+			raise IOPmacErrorResponse('PMAC communication error', returnStr)
+		raise IOError('PMAC communication error')
+
+
+
+class PmacRequest(object):
+	'''A command queued on an AsyncPmacEthernetInterface. Check isDone() while the
+	   PmacEventLoop runs, or pass a callback to sendCommand() to be called with the
+	   request once the response has arrived.'''
+
+	def __init__(self, command, callback = None):
+		self.command = command
+		self.callback = callback
+		self.response = None
+		self.error = None
+		self._isDone = False
+
+	def isDone(self):
+		return self._isDone
+
+	# Returns: a tuple (response, wasSuccessful) in the same form as RemotePmacInterface.sendCommand()
+	def result(self):
+		if not self._isDone:
+			return ('Request not complete', False)
+		if self.error is not None:
+			return ('I/O error during comm with PMAC: %s' % str(self.error), False)
+		return (self.response, True)
+
+	def _finish(self, response = None, error = None):
+		self.response = response
+		self.error = error
+		self._isDone = True
+		if self.callback is not None:
+			self.callback(self)
+
+
+class AsyncPmacEthernetInterface(asyncore.dispatcher):
+	'''A non-blocking connection to a PMAC over Ethernet, driven by a PmacEventLoop so that
+	   a single thread can talk to many PMACs at once. Commands are queued and sent one at a
+	   time, with the same VR_PMAC_GETBUFFER continuation and terminator handling as
+	   PmacEthernetInterface._sendCommand(). Create instances with PmacEventLoop.connect().'''
+
+	maxCommandLength = 1400
+
+	def __init__(self, host, port = 1025, timeout = 3.0, socketMap = None, verbose = False):
+		asyncore.dispatcher.__init__(self, map = socketMap)
+		self.hostname = str(host)
+		self.port = int(port)
+		self.timeout = timeout
+		self.verboseMode = verbose
+
+		self.requests = collections.deque() # Requests waiting to be sent
+		self.currentRequest = None
+		self.outBuffer = ''
+		self.packet = '' # Data received so far for the current packet
+		self.response = '' # Data received so far for the current request
+		self.isContinuing = False # True once VR_PMAC_GETBUFFER requests are being sent
+		self.deadline = None
+		self.isConnectionOpen = False
+
+	# Start connecting to the PMAC. As PmacEthernetInterface.connect() does, the first command
+	# sets up the response format and checks a PMAC is responding; the connection is closed if not.
+	# Returns: the PmacRequest for that first command
+	def open(self):
+		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.isConnectionOpen = True
+		self.deadline = time.time() + self.timeout
+		try:
+			self.connect((self.hostname, self.port))
+		except socket.error:
+			self.close()
+		return self.sendCommand('i6=1 i3=2 ver', self._checkVersion)
+
+	def _checkVersion(self, request):
+		if request.error is None and not re.match('^\d+\.\d+\s*\r\x06$', request.response):
+			request.error = IOError('Device did not respond correctly to a "ver" command')
+		if request.error is not None:
+			self.close()
+
+	# Queue a command to be sent to the PMAC.
+	# Arguments: * command (str): is the command to be sent
+	#			* callback (function, optional): called with the PmacRequest when it is done
+	# Returns: the PmacRequest, which holds the response once it is done
+	def sendCommand(self, command, callback = None):
+		request = PmacRequest(str(command), callback)
+		if not self.isConnectionOpen:
+			request._finish(error = IOError('Socket communication error'))
+			return request
+		self.requests.append(request)
+		if self.currentRequest is None and self.connected:
+			self._sendNextRequest()
+		return request
+
+	def _sendNextRequest(self):
+		if len(self.requests) == 0:
+			self.deadline = None
+			return
+		self.currentRequest = self.requests.popleft()
+		self.packet = ''
+		self.response = ''
+		self.isContinuing = False
+		timeout = self.timeout
+		if 'SAVE' in self.currentRequest.command.upper():
+			timeout *= 2
+		self.deadline = time.time() + timeout
+		self.outBuffer += getresponseRequest(self.currentRequest.command)
+		if self.verboseMode:
+			print 'Sent out: %r' % self.currentRequest.command
+
+	def _finishRequest(self, response = None, error = None):
+		request = self.currentRequest
+		self.currentRequest = None
+		if self.verboseMode and error is None:
+			print 'Received: %r' % response
+		self._sendNextRequest()
+		request._finish(response, error)
+
+	# Fail the current and all queued requests if the connection has been waiting too long
+	def checkTimeout(self, now):
+		if self.deadline is not None and now > self.deadline:
+			self.close()
+
+	def writable(self):
+		return not self.connected or len(self.outBuffer) > 0
+
+	def readable(self):
+		return True
+
+	def handle_connect(self):
+		if self.currentRequest is None:
+			self._sendNextRequest()
+
+	def handle_write(self):
+		sent = self.send(self.outBuffer)
+		self.outBuffer = self.outBuffer[sent:]
+
+	def handle_read(self):
+		data = self.recv(2048)
+		if not data or self.currentRequest is None:
+			return
+		self.packet += data
+		try:
+			self._handlePacket()
+		except IOError, e:
+			self._finishRequest(error = e)
+
+	# Mirrors the checks on each recv() in PmacEthernetInterface._sendCommand(), except that a short
+	# packet without a terminator is assumed to be split by TCP and waited on rather than rejected
+	def _handlePacket(self):
+		packet = self.packet
+		shortPacket = len(packet) < 1400
+		if shortPacket and packet[-1] not in '\x06\r\x00':
+			return
+		self.packet = ''
+
+		if shortPacket and packet[-1] == '\x00':
+			if self.isContinuing:
+				raise IOPmacSentNullError('Connection to PMAC lost', self.response)
+			raise IOPmacSentNullError('Did not respond - PMAC busy or connection lost', '')
+		if not self.isContinuing and shortPacket and packet[-1] == '\r':
+			raise IOError('PMAC communication error') # timeout or error
+		if not self.isContinuing and shortPacket and len(packet) > 1 and packet[-2] != '\r':
+			raise IOError('Truncated short response') # truncation error in short response
+
+		self.response += packet
+		if shortPacket and self.response[-1] == '\r': # stopped because of either timeout or error
+			raise IOError('PMAC communication error')
+		elif self.response[-1] == '\x06':
+			response = self.response
+			if (len(response) > 1) and (response[-2] != '\r'): # truncation error in multi-buffer response
+				response = response[:-1] + ' WARNING: response truncated.' + response[-1]
+			self._finishRequest(response)
+		else:
+			self.isContinuing = True
+			self.outBuffer += getbufferRequest()
+
+	def handle_close(self):
+		self.close()
+
+	def handle_error(self):
+		self.close()
+
+	# Close the connection, failing the current and all queued requests
+	def close(self):
+		asyncore.dispatcher.close(self)
+		self.isConnectionOpen = False
+		self.outBuffer = ''
+		self.deadline = None
+		requests = list(self.requests)
+		self.requests.clear()
+		if self.currentRequest is not None:
+			requests.insert(0, self.currentRequest)
+			self.currentRequest = None
+		for request in requests:
+			request._finish(error = IOError('Socket communication error'))
+
+	def disconnect(self):
+		self.close()
+
+
+class PmacEventLoop(object):
+	'''Runs AsyncPmacEthernetInterface connections to any number of PMACs from a single thread.
+	   Python 2 has no asyncio, so this is built on asyncore with a private socket map.'''
+
+	def __init__(self):
+		self.socketMap = {}
+
+	# Open a connection to a PMAC in this loop.
+	# Returns: the AsyncPmacEthernetInterface; its first request checks the PMAC is responding
+	def connect(self, host, port = 1025, timeout = 3.0, verbose = False):
+		connection = AsyncPmacEthernetInterface(host, port, timeout, self.socketMap, verbose)
+		connection.open()
+		return connection
+
+	# Handle any socket events, waiting at most timeout seconds for one, then time out stalled requests
+	def poll(self, timeout = 0.0):
+		if self.socketMap:
+			asyncore.loop(timeout, map = self.socketMap, count = 1)
+		now = time.time()
+		for connection in self.socketMap.values():
+			connection.checkTimeout(now)
+
+	# Run the loop until all the given requests are done
+	# Returns: True if they all finished, False if the timeout expired first
+	def runUntilDone(self, requests, timeout = None):
+		if timeout is not None:
+			deadline = time.time() + timeout
+		while not all(request.isDone() for request in requests):
+			if not self.socketMap:
+				# Requests on closed connections are failed when they are closed, so this is only
+				# reached for requests that do not belong to this loop
+				return False
+			if timeout is not None and time.time() > deadline:
+				return False
+			self.poll(0.01)
+		return True
+
+	def close(self):
+		for connection in self.socketMap.values():
+			connection.close()
 
 
 class PmacTelnetInterface(RemotePmacInterface):
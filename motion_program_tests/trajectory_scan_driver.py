@@ -1,6 +1,7 @@
 import time
 from test_harness.PmacTestHarness import PmacTestHarness
 from test_harness.TrajectoryScanGenerator import TrajectoryScanGenerator as ScanGen
+from test_harness.TrajectoryStreamer import TrajectoryStreamer
 
 from pkg_resources import require
 require('numpy')
@@ -17,7 +18,7 @@ def make_status_message(pmac, start_time, sleep_time):
 
     time.sleep(sleep_time)
 
-    pmac.update_status_variables()
+    snapshot = pmac.update_status_variables()
 
     if pmac.current_buffer == 0:
         status_message = "Buffer: A"
@@ -29,8 +30,8 @@ def make_status_message(pmac, start_time, sleep_time):
     status_message += (" - Status: " + str(pmac.status) +
                        " - Error: " + str(pmac.error) +
                        " - Index: " + str(pmac.current_index) +
-                       " - VelMode: " + pmac.read_variable("M4011") +
-                       " - Trigger State: " + pmac.read_variable("M32") +
+                       " - VelMode: " + str(snapshot.vel_mode) +
+                       " - Trigger State: " + str(snapshot.trigger) +
                        " - Total Points: " + str(pmac.total_points) +
                        " - Scan Time: " + scan_time)
 
@@ -45,8 +46,8 @@ def snake_trajectory_scan():
     pmac.force_abort()
     pmac.assign_cs_motors([(1, "X", 1), (2, "Y", 1)], cs_number)
     pmac.home_cs_motors(cs_number)
-    pmac.reset_buffers()
     pmac.set_axes(['X', 'Y'])
+    pmac.reset_buffers()
 
     width = 11
     length = 5
@@ -93,50 +94,33 @@ def circle_trajectory_scan():
     pmac.force_abort()
     pmac.assign_cs_motors([(1, "X", 100), (2, "Y", 100)], cs_number)
     pmac.home_cs_motors(cs_number)
-    pmac.reset_buffers()
     pmac.set_axes(['X', 'Y'])
+    pmac.reset_buffers()
+    pmac.enable_command_cache()
 
     circle_scan = ScanGen()
     circle_scan.generate_circle_points(400, 360)
     print(circle_scan.point_set)
-    circle_scan.format_point_set()
-
-    buffer_length = pmac.buffer_length
-    current_start = 0
-    current_points, end = circle_scan.generate_buffer_of_points(current_start, buffer_length)
-    current_start = end + 1
-
-    pmac.fill_current_buffer(current_points)
-    pmac.set_current_buffer_fill(buffer_length)
-    pmac.prev_buffer_write = 0
-
-    start_time = time.time()
-    pmac.run_motion_program(PROG_NUM, cs_number)
-    time.sleep(1)
-
-    pmac.update_status_variables()
-    print("Status: " + str(pmac.status))
-
-    while int(pmac.status) == 1:
-
-        if pmac.prev_buffer_write == 1 and int(pmac.current_buffer) == 1:
-            current_points, end = circle_scan.generate_buffer_of_points(current_start, buffer_length)
-            current_start = end + 1
 
-            pmac.fill_idle_buffer(current_points)
-            pmac.set_idle_buffer_fill(buffer_length)
-            pmac.prev_buffer_write = 0
+    def circle_chunks():
+        current_start = 0
+        while True:
+            current_points, current_start = circle_scan.generate_buffer_of_points(
+                current_start, pmac.buffer_length)
+            yield current_points
 
-        elif pmac.prev_buffer_write == 0 and int(pmac.current_buffer) == 0:
-            current_points, end = circle_scan.generate_buffer_of_points(current_start, buffer_length)
-            current_start = end + 1
+    def print_swap(report):
+        print("Buffer " + report['buffer'] + " written" +
+              " - Write Time: " + str(numpy.round(report['write_time'], 3)) +
+              " - Margin: " + str(report['margin_points']) + " points, " +
+              str(numpy.round(report['margin_time'], 3)) + "s" +
+              " - Underrun: " + str(report['underrun']) +
+              " - Deadline Missed: " + str(report['deadline_missed']))
 
-            pmac.fill_idle_buffer(current_points)
-            pmac.set_idle_buffer_fill(buffer_length)
-            pmac.prev_buffer_write = 1
+    streamer = TrajectoryStreamer(pmac, circle_chunks(), swap_callback=print_swap)
+    streamer.run(PROG_NUM, cs_number)
 
-        status_message = make_status_message(pmac, start_time, 0.1)
-        print(status_message)
+    print("Status: " + str(pmac.status) + " - Error: " + str(pmac.error))
 
 
 def blade_slit_scan():
@@ -147,8 +131,9 @@ def blade_slit_scan():
     pmac.force_abort()
     pmac.assign_cs_motors_to_kinematics([1, 2], cs_number)
     pmac.home_cs_motors(cs_number)
-    pmac.reset_buffers()
     pmac.set_axes(['A', 'B'])
+    pmac.enable_delta_writes()
+    pmac.reset_buffers()
 
     num_points = 5
     step = 100
@@ -161,43 +146,46 @@ def blade_slit_scan():
     print(blade_scan.point_set)
     blade_scan.format_point_set()
 
-    pmac.set_cs_initial_kinematic_coordinates(1)
+    pmac.setup_cs_for_scan(cs_number, kinematic=True)
     pmac.fill_current_buffer(blade_scan.point_set)
     pmac.set_current_buffer_fill(num_points)
     pmac.set_idle_buffer_fill(0)
     pmac.prev_buffer_write = 0
 
-    start_time = time.time()
-    pmac.run_motion_program(PROG_NUM, cs_number)
-    time.sleep(0.01)
-
-    pmac.update_status_variables()
-    print("Status: " + str(pmac.status))
-
-    a_pos = []
-    b_pos = []
-    a_vel = []
-    b_vel = []
-    kinematics = []
-    while int(pmac.status) == 1:
-
-        status_message = make_status_message(pmac, start_time, move_time/4000)
-        print(status_message)
-
-        a_pos.append(pmac.read_multiple_variables(
-            ["P4101", "P4111", "M4001"]))
-        b_pos.append(pmac.read_multiple_variables(
-            ["P4102", "P4112", "M4002"]))
-        a_vel.append(pmac.read_variable("P4131"))
-        b_vel.append(pmac.read_variable("P4132"))
-        kinematics.append((pmac.read_multiple_variables(
-            ["P1", "P101", "P2", "P102", "Q1", "Q11", "Q2", "Q12"])))
-
-    print("A Positions", a_pos)
-    print("B Positions", b_pos)
-    print("A Velocities", a_vel)
-    print("B Velocities", b_vel)
-    print("Kinematic values", kinematics)
+    # Gather the motor positions and the trajectory and kinematic variables every
+    # 10 servo cycles (~4.4 ms at the default servo period) for the length of the scan
+    signals = {"A Positions": ["P4101", "P4111", "M4001"],
+               "B Positions": ["P4102", "P4112", "M4002"],
+               "A Velocities": ["P4131"],
+               "B Velocities": ["P4132"],
+               "Kinematic values": ["P1", "P101", "P2", "P102", "Q1", "Q11", "Q2", "Q12"]}
+    variables = [variable for name in sorted(signals) for variable in signals[name]]
+    pmac.configure_gather(pmac.motor_gather_sources(1) + pmac.motor_gather_sources(2) +
+                          pmac.variable_gather_sources(variables),
+                          period=10, num_samples=num_points*move_time/16)
+
+    with pmac.gathering():
+        start_time = time.time()
+        pmac.run_motion_program(PROG_NUM, cs_number)
+        time.sleep(0.01)
+
+        pmac.update_status_variables()
+        print("Status: " + str(pmac.status))
+
+        while int(pmac.status) == 1:
+
+            status_message = make_status_message(pmac, start_time, move_time/4000)
+            print(status_message)
+
+    gathered = pmac.read_gather()
+    for motor in [1, 2]:
+        following_error = gathered["motor{}_commanded".format(motor)] - \
+            gathered["motor{}_actual".format(motor)]
+        print("Motor {} max following error: {}".format(
+            motor, numpy.abs(following_error).max()))
+
+    for name in sorted(signals):
+        print(name, numpy.column_stack([gathered[variable] for variable in signals[name]]))
 
 
 def main():
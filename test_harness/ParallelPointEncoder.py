@@ -0,0 +1,167 @@
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+from PointSet import PointSet
+from TrajectoryScanGenerator import TrajectoryScanGenerator
+
+from pkg_resources import require
+require('numpy')
+import numpy
+
+# Negative floats are the longest formatted words e.g. $ffaffffffff803, as values too
+# large for a PMAC float are rejected
+WORD_DTYPE = 'S%d' % len(TrajectoryScanGenerator.double_to_pmac_float(
+    -numpy.nextafter(TrajectoryScanGenerator.max_pmac_float, 0)))
+
+_shared = {}  # Shared columns of the point set being encoded, set in each worker
+
+
+def _init_worker(shared):
+    """
+    Store the shared input and output columns in a worker process
+
+    Args:
+        shared(dict): Shared arrays for each input and output column
+
+    """
+
+    _shared.clear()
+    _shared.update(shared)
+
+
+def _shared_array(name, dtype):
+    """
+    View a shared column as a numpy array
+
+    Args:
+        name(str): Name of column
+        dtype(str/type): Type of column elements
+
+    Returns:
+        numpy.ndarray: View of shared column
+
+    """
+
+    return numpy.frombuffer(_shared[name], dtype=dtype)
+
+
+def _encode_shard(task):
+    """
+    Encode a shard of one column into its shared output column
+
+    Args:
+        task(tuple(str, int, int)): Column to encode and start and end of shard
+
+    """
+
+    column, start, end = task
+    if column == 'time':
+        words = TrajectoryScanGenerator.pack_time_words(
+            _shared_array('time_val', numpy.int64)[start:end],
+            _shared_array('vel_mode', numpy.int64)[start:end],
+            _shared_array('subroutine', numpy.int64)[start:end])
+        formatted = ["$%x" % word for word in words.tolist()]
+    else:
+        formatted = TrajectoryScanGenerator.doubles_to_pmac_floats(
+            _shared_array(column, numpy.float64)[start:end])
+
+    # numpy would silently truncate longer words
+    if formatted and max(len(word) for word in formatted) > numpy.dtype(WORD_DTYPE).itemsize:
+        raise ValueError("Formatted word longer than {length} characters".format(
+            length=numpy.dtype(WORD_DTYPE).itemsize))
+
+    _shared_array('formatted_' + column, WORD_DTYPE)[start:end] = formatted
+
+
+class ParallelPointEncoder(object):
+    """
+    Formats large point sets into Pmac required format on a pool of processes. The
+    point set is copied once into shared memory and split into shards; each worker
+    writes the formatted words of its shard straight into a shared output buffer,
+    which is read back in order once all shards are done.
+
+    """
+
+    def __init__(self, processes=None, shard_size=100000):
+        """
+        Args:
+            processes(int): Number of worker processes; defaults to the number of CPUs
+            shard_size(int): Number of points of one column encoded per task; point
+            sets no longer than this are encoded in this process
+
+        """
+
+        self.processes = processes or multiprocessing.cpu_count()
+        self.shard_size = shard_size
+
+    def format_point_set(self, point_set):
+        """
+        Format a point set into Pmac required format, giving the same result as
+        PointSet.to_pmac_format
+
+        Args:
+            point_set(dict/PointSet): Readable point set, or PointSet, to format
+
+        Returns:
+            dict: Formatted point set with the time sub-buffer and each axis
+
+        Raises:
+            ValueError: Time value, velocity mode or subroutine out of range, or
+            positions not finite or too large for a PMAC float
+
+        """
+
+        if isinstance(point_set, dict):
+            point_set = PointSet.from_point_set(point_set)
+
+        num_points = len(point_set)
+        if num_points <= self.shard_size or self.processes == 1:
+            return point_set.to_pmac_format()
+
+        columns = ['time'] + sorted(point_set.axes)
+        shared = {'time_val': self._share(point_set.time_val, numpy.int64),
+                  'vel_mode': self._share(point_set.vel_mode, numpy.int64),
+                  'subroutine': self._share(point_set.subroutine, numpy.int64)}
+        for axis, positions in point_set.axes.iteritems():
+            shared[axis] = self._share(positions, numpy.float64)
+        for column in columns:
+            shared['formatted_' + column] = RawArray(
+                ctypes.c_char, num_points*numpy.dtype(WORD_DTYPE).itemsize)
+
+        tasks = [(column, start, min(start + self.shard_size, num_points))
+                 for column in columns
+                 for start in range(0, num_points, self.shard_size)]
+
+        pool = multiprocessing.Pool(self.processes, _init_worker, (shared,))
+        try:
+            pool.map(_encode_shard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        formatted_points = {}
+        for column in columns:
+            formatted_points[column] = numpy.frombuffer(
+                shared['formatted_' + column], dtype=WORD_DTYPE).tolist()
+
+        return formatted_points
+
+    @staticmethod
+    def _share(values, dtype):
+        """
+        Copy values into a new shared memory array
+
+        Args:
+            values(numpy.ndarray): Values to copy
+            dtype(type): numpy type to store values as
+
+        Returns:
+            RawArray: Shared array
+
+        """
+
+        shared = RawArray(ctypes.c_char, len(values)*numpy.dtype(dtype).itemsize)
+        numpy.frombuffer(shared, dtype=dtype)[:] = values
+
+        return shared
@@ -0,0 +1,112 @@
+import collections
+import hashlib
+import operator
+
+from pkg_resources import require
+require('numpy')
+import numpy
+
+
+class PmacCommandCache(object):
+    """
+    A cache of the write commands for filling a half-buffer with a point set, keyed by
+    the content of the point set, before it is formatted, and where it is written.
+    Scans that loop the same short point set, such as the circle and sine scans, fill
+    the buffers with the same few point sets over and over; once cached, a fill sends
+    the stored commands without formatting the points or building the commands again.
+
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        Args:
+            max_entries(int): Number of fills to keep; the least recently used is
+            dropped when full
+
+        """
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def content_key(points):
+        """
+        Get a digest of the content of a point set
+
+        Args:
+            points(dict/PointSet): Readable or formatted point set, or a PointSet
+
+        Returns:
+            str: Digest that is equal for point sets with equal content
+
+        """
+
+        digest = hashlib.sha1()
+        if isinstance(points, dict):
+            time_fields = operator.itemgetter('time_val', 'vel_mode', 'subroutine')
+            for axis in sorted(points.iterkeys()):
+                axis_points = points[axis]
+                if axis_points and isinstance(axis_points[0], dict):
+                    axis_points = map(time_fields, axis_points)
+                column = numpy.array(axis_points)
+                digest.update("{axis}:{dtype}:{shape};".format(
+                    axis=axis, dtype=column.dtype, shape=column.shape))
+                digest.update(column.tobytes())
+        else:
+            digest.update(type(points).__name__)
+            for column in [points.time_val, points.vel_mode, points.subroutine]:
+                digest.update(numpy.ascontiguousarray(column).tobytes())
+            for axis in sorted(points.axes.iterkeys()):
+                digest.update(axis + ':')
+                digest.update(numpy.ascontiguousarray(points.axes[axis]).tobytes())
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Get the commands stored for a key
+
+        Args:
+            key(tuple): Key from `content_key` and the buffer written to
+
+        Returns:
+            list(str): Stored commands, or None if there are none
+
+        """
+
+        commands = self._entries.pop(key, None)
+        if commands is None:
+            self.misses += 1
+            return None
+
+        self._entries[key] = commands
+        self.hits += 1
+        return commands
+
+    def put(self, key, commands):
+        """
+        Store the commands for a key
+
+        Args:
+            key(tuple): Key from `content_key` and the buffer written to
+            commands(list(str)): Commands that fill the buffer
+
+        """
+
+        self._entries.pop(key, None)
+        self._entries[key] = commands
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all stored commands
+
+        """
+
+        self._entries.clear()
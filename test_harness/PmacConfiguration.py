@@ -0,0 +1,122 @@
+import threading
+
+
+class PmacConfiguration(object):
+    """
+    A memoised view of the configuration of one pmac - buffer layout, motor limits
+    and coordinate system motor assignments - shared by every PmacTestHarness for
+    the same host and port. Each value is read from the pmac the first time it is
+    needed and kept until it is invalidated. PmacTestHarness invalidates it when it
+    opens the first connection to the pmac.
+
+    """
+
+    _configurations = {}  # Shared configurations by (host, port)
+    _configurations_lock = threading.Lock()
+
+    def __init__(self):
+        self._version = 0  # Increased by each change, so reads that overlap one are not cached
+        self.pool = None  # PmacConnectionPool the values were read through
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_shared(cls, host, port):
+        """
+        Get the configuration for a host and port, creating an empty one if there
+        is none
+
+        Args:
+            host(str): The IP address of the pmac
+            port(int): The port of the pmac
+
+        Returns:
+            PmacConfiguration: Shared configuration
+
+        """
+
+        with cls._configurations_lock:
+            configuration = cls._configurations.get((host, port))
+            if configuration is None:
+                configuration = cls()
+                cls._configurations[(host, port)] = configuration
+
+        return configuration
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values
+
+    def keys(self):
+        """
+        Get the keys of the cached values
+
+        Returns:
+            list: Cached keys
+
+        """
+
+        with self._lock:
+            return self._values.keys()
+
+    def get(self, key, read=None):
+        """
+        Get a cached value, calling `read` to get it from the pmac if it is not
+        cached
+
+        Args:
+            key(str/tuple): Key of value e.g. 'buffer_layout'
+            read(function): Called with no arguments to read the value
+
+        Returns:
+            Cached value, or None if it is not cached and there is no `read`
+
+        """
+
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            version = self._version
+
+        if read is None:
+            return None
+        value = read()
+
+        with self._lock:
+            # Only cache the value if nothing was changed or invalidated while reading it
+            if self._version == version:
+                self._values[key] = value
+
+        return value
+
+    def set(self, key, value):
+        """
+        Cache a value
+
+        Args:
+            key(str/tuple): Key of value
+            value: Value to cache
+
+        """
+
+        with self._lock:
+            if key not in self._values or self._values[key] != value:
+                self._values[key] = value
+                self._version += 1
+
+    def invalidate(self, *keys):
+        """
+        Remove cached values so they are read again when next needed
+
+        Args:
+            keys(str/tuple): Keys of values to remove; all values if none are given
+
+        """
+
+        with self._lock:
+            if keys:
+                for key in keys:
+                    self._values.pop(key, None)
+            else:
+                self._values.clear()
+            self._version += 1
@@ -0,0 +1,173 @@
+import re
+import threading
+import Queue
+
+from dls_pmacremote import PmacEthernetInterface
+
+
+class PmacConnectionPool(object):
+    """
+    A set of connections to one pmac, shared by every PmacTestHarness for the same
+    host and port. One connection (the status lane) is reserved for short status,
+    variable and abort commands, so they never queue behind memory transfers, which
+    are sent on the data lanes.
+
+    """
+
+    _pools = {}  # Shared pools by (host, port)
+    _pools_lock = threading.Lock()
+
+    # Memory writes and bulk hex reads are sent on the data lanes
+    bulk_command = re.compile(r'\s*(W[LXYD]|RH[LXYD])', re.IGNORECASE)
+
+    def __init__(self, host, port=1025, data_lanes=1, timeout=3.0):
+        """
+        Open the status lane and data lanes
+
+        Args:
+            host(str): The IP address of the pmac to connect to
+            port(int): The port of the pmac to connect to
+            data_lanes(int): Number of connections for memory transfers
+            timeout(float): Socket timeout in seconds
+
+        Raises:
+            IOError: Connection failed
+
+        """
+
+        self.host = host
+        self.port = port
+        self.references = 0
+        self.metrics = None  # PmacMetrics shared by every lane, if enabled
+
+        self.status_lane = None
+        self.data_lanes = []
+        self._free_data_lanes = Queue.Queue()
+
+        try:
+            self.status_lane = self._open_lane(timeout)
+            for _ in range(data_lanes):
+                lane = self._open_lane(timeout)
+                self.data_lanes.append(lane)
+                self._free_data_lanes.put(lane)
+        except IOError:
+            self.close()
+            raise
+
+    @classmethod
+    def get_pool(cls, host, port=1025, data_lanes=1, timeout=3.0):
+        """
+        Get the pool for a host and port, opening it if there is no open pool. Each
+        call must be matched by a call to `release`.
+
+        Args:
+            host(str): The IP address of the pmac to connect to
+            port(int): The port of the pmac to connect to
+            data_lanes(int): Number of data lanes if a new pool is opened
+            timeout(float): Socket timeout in seconds if a new pool is opened
+
+        Returns:
+            PmacConnectionPool: Shared pool
+
+        Raises:
+            IOError: Connection failed
+
+        """
+
+        with cls._pools_lock:
+            pool = cls._pools.get((host, port))
+            if pool is None:
+                pool = cls(host, port, data_lanes, timeout)
+                cls._pools[(host, port)] = pool
+            pool.references += 1
+
+        return pool
+
+    def release(self):
+        """
+        Release a reference from `get_pool`, closing the pool when none are left
+
+        """
+
+        with self._pools_lock:
+            self.references -= 1
+            if self.references > 0:
+                return
+            if self._pools.get((self.host, self.port)) is self:
+                del self._pools[(self.host, self.port)]
+
+        self.close()
+
+    def _open_lane(self, timeout):
+        """
+        Open a connection to the pmac
+
+        Args:
+            timeout(float): Socket timeout in seconds
+
+        Returns:
+            PmacEthernetInterface: Open connection
+
+        Raises:
+            IOError: Connection failed
+
+        """
+
+        lane = PmacEthernetInterface(parent=None, verbose=False, numAxes=None,
+                                     timeout=timeout)
+        lane.setConnectionParams(host=self.host, port=self.port)
+        error = lane.connect()
+        if error is not None:
+            raise IOError(error)
+
+        return lane
+
+    def set_metrics(self, metrics):
+        """
+        Record the commands sent on every lane in `metrics`
+
+        Args:
+            metrics(PmacMetrics): Metrics to record in, or None to stop recording
+
+        """
+
+        self.metrics = metrics
+        for lane in [self.status_lane] + self.data_lanes:
+            if lane is not None:
+                lane.metrics = metrics
+
+    def send_command(self, command, double_timeout=False):
+        """
+        Send a command on the status lane, or on a free data lane if it is a memory
+        transfer
+
+        Args:
+            command(str): Command to send
+            double_timeout(bool): Wait twice the timeout for a response
+
+        Returns:
+            str: Response from the pmac
+
+        Raises:
+            IOError: Communication failed
+
+        """
+
+        if not self.bulk_command.match(command):
+            return self.status_lane._sendCommand(command, doubleTimeout=double_timeout)
+
+        lane = self._free_data_lanes.get()
+        try:
+            return lane._sendCommand(command, doubleTimeout=double_timeout)
+        finally:
+            self._free_data_lanes.put(lane)
+
+    def close(self):
+        """
+        Close all connections
+
+        """
+
+        for lane in [self.status_lane] + self.data_lanes:
+            if lane is not None:
+                lane.disconnect()
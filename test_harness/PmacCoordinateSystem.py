@@ -17,6 +17,10 @@ class PmacCoordinateSystem(object):
         self.max_velocities = {'x': 0, 'y': 0, 'z': 0,
                                'u': 0, 'v': 0, 'w': 0,
                                'a': 0, 'b': 0, 'c': 0}
+        # Zero for axes without a limit read from the PMAC
+        self.max_accelerations = {'x': 0, 'y': 0, 'z': 0,
+                                  'u': 0, 'v': 0, 'w': 0,
+                                  'a': 0, 'b': 0, 'c': 0}
 
     def add_motor_assignment(self, motor, axis, scaling):
         """
@@ -44,3 +48,17 @@ class PmacCoordinateSystem(object):
         # Assign motor max_velocities to corresponding axes
         for motor_num, (axis, scaling) in self.motor_map.iteritems():
             self.max_velocities[axis.lower()] = float(velocities[int(motor_num) - 1]) / scaling
+
+    def set_max_accelerations(self, accelerations):
+        """
+        Set the maximum accelerations in EGUs for the axes in the coordinate system
+
+        Args:
+            accelerations(list(int)): Max accelerations in cts, read from PMAC
+
+        """
+
+        # Assign motor max_accelerations to corresponding axes
+        for motor_num, (axis, scaling) in self.motor_map.iteritems():
+            self.max_accelerations[axis.lower()] = \
+                float(accelerations[int(motor_num) - 1]) / scaling
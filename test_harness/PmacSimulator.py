@@ -0,0 +1,517 @@
+import re
+import socket
+import struct
+import threading
+import time
+import SocketServer
+
+from PmacTestHarness import PmacTestHarness
+from TrajectoryScanGenerator import TrajectoryScanGenerator
+
+WORD_MASK = 0xFFFFFFFFFFFF  # Memory words are 48 bits wide
+
+VALUE = r'\$[0-9A-F]+|-?\d*\.?\d+(?:E[+-]?\d+)?'
+
+
+class PmacCommandError(Exception):
+    """
+    Raised when the simulator cannot process a command; reported as ERR003
+
+    """
+    pass
+
+
+class PmacSimulator(object):
+    """
+    A local TCP server that speaks the PMAC Ethernet protocol used by
+    PmacEthernetInterface, so PmacTestHarness can be run without a PMAC. It models
+    P, Q, M and I variables, motor positions and L, X, Y and D user memory; it does
+    not run motion programs. Data gathering is modelled by `gather_sample`, which
+    stands in for a servo cycle.
+
+    """
+
+    command_patterns = [
+        ('define_gather', re.compile(r'DEFINE\s+GATHER(?:\s+(\d+))?')),
+        ('delete_gather', re.compile(r'DELETE\s+GATHER')),
+        ('list_gather', re.compile(r'LIST\s+GATHER(?:\s*(\d+)(?:\s*,\s*(\d+))?)?')),
+        ('end_gather', re.compile(r'ENDG')),
+        ('gather', re.compile(r'GAT')),
+        ('list_program', re.compile(r'LIST\s+PROGRAM\s+(\d+)')),
+        ('identity', re.compile(r'(CID|VER|SAVE)')),
+        ('write', re.compile(r'W([LXYD])\s*\$([0-9A-F]+)((?:[\s,]+(?:' + VALUE + '))+)')),
+        ('read_hex', re.compile(r'RH([LXYD]):\$([0-9A-F]+)(?:,(\d+))?')),
+        ('read', re.compile(r'R([LXYD])\s*\$([0-9A-F]+)')),
+        ('definition', re.compile(r'([PQMI])(\d+)->(\S*)')),
+        ('variable', re.compile(r'([PQMI])(\d+)(?:\.\.(\d+))?(?:=(' + VALUE + '))?')),
+        ('motor_assignment', re.compile(r'#(\d+)->([^\s#]*)')),
+        ('motor', re.compile(r'#(\d+)')),
+        ('motor_query', re.compile(r'([PVF])(?![0-9])')),
+        ('jog', re.compile(r'J(/|=(' + VALUE + ')|\^(' + VALUE + ')|\+|-)')),
+        ('home', re.compile(r'HMZ?')),
+        ('coordinate_system', re.compile(r'&(\d+)')),
+        ('run', re.compile(r'B(\d+)R?|R(?![LXYDH])')),
+        ('abort', re.compile(r'A(?![A-Z])'))]
+
+    def __init__(self, host="127.0.0.1", port=1025, latency=0.0,
+                 max_response_length=1400, max_command_length=1400):
+        """
+        Args:
+            host(str): IP address to listen on
+            port(int): Port to listen on; 0 to pick a free port
+            latency(float): Delay in seconds before sending each response packet
+            max_response_length(int): Bytes of response data per packet; any more is
+            returned by following VR_PMAC_GETBUFFER requests. Below 1400 the packets
+            are shorter than the PMAC sends, which PmacEthernetInterface reads as
+            continued but PmacEventLoop cannot tell from a packet split by TCP.
+            max_command_length(int): Maximum length of a command
+
+        """
+
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.max_response_length = max_response_length
+        self.max_command_length = max_command_length
+
+        self.variables = {}
+        self.definitions = {}
+        self.motor_positions = {}
+        self.memory = {}
+        self.gather_buffer = []  # Words of each gathered sample
+        self.gather_length = 0  # Size of the gather buffer in words
+        self.gathering = False
+        self.firmware_version = "1.947"
+        self.card_id = "603382"  # Geo Brick
+
+        self.packets_received = 0
+        self.commands_received = 0
+
+        self.lock = threading.Lock()
+        self._selected_motor = 1
+        self._server = None
+        self._thread = None
+
+    def load_trajectory_scan(self, buffer_length=1000, buffer_address=0x30000):
+        """
+        Set the variables the `trajectory_scan` motion program sets on start up
+
+        Args:
+            buffer_length(int): Number of points in each sub-buffer
+            buffer_address(int): Root address of half-buffer A
+
+        """
+
+        self.set_variable("P4001", 0)
+        self.set_variable("P4004", buffer_length)
+        self.set_variable("P4008", buffer_address)
+        self.set_variable("P4009", buffer_address + 10*buffer_length)
+        self.set_variable("P4015", 0)
+        self.set_variable("P4020", 1)
+
+    def set_variable(self, variable, value):
+        """
+        Set a variable e.g. P4001
+
+        Args:
+            variable(str): Variable to set
+            value(int/float): Value to set variable to
+
+        """
+
+        self.variables[variable.upper()] = value
+
+    def get_variable(self, variable):
+        """
+        Get the value of a variable e.g. P4001; unset variables are zero
+
+        Args:
+            variable(str): Variable to get
+
+        Returns:
+            int/float: Value of variable
+
+        """
+
+        return self.variables.get(variable.upper(), 0)
+
+    def gather_sample(self):
+        """
+        Gather one sample of the sources set by I5001-I5048 and enabled by I5050 and
+        I5051, as the PMAC does each gather period, if gathering is on. Gathering
+        stops when the gather buffer is full.
+
+        """
+
+        with self.lock:
+            if not self.gathering:
+                return
+
+            mask = (self.get_variable("I5051") << 24) | self.get_variable("I5050")
+            sample = []
+            for source_num in range(48):
+                if mask & (1 << source_num):
+                    source = self.get_variable("I{ivar}".format(ivar=5001 + source_num))
+                    mode = "YXDL"[source >> 22 & 0x3]
+                    sample.append((mode, self._read_word(mode, source & 0x3FFFFF)))
+
+            sample_words = sum(2 if mode in "LD" else 1 for mode, _ in sample)
+            used_words = sum(2 if mode in "LD" else 1
+                             for gathered in self.gather_buffer for mode, _ in gathered)
+            if used_words + sample_words > self.gather_length:
+                self.gathering = False
+                return
+
+            self.gather_buffer.append(sample)
+
+    def start(self):
+        """
+        Start serving connections on a background thread
+
+        Returns:
+            int: The port being listened on
+
+        """
+
+        simulator = self
+
+        class Handler(SocketServer.BaseRequestHandler):
+
+            def handle(self):
+                simulator._handle_connection(self.request)
+
+        SocketServer.ThreadingTCPServer.allow_reuse_address = True
+        self._server = SocketServer.ThreadingTCPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self.port
+
+    def stop(self):
+        """
+        Stop serving connections
+
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _handle_connection(self, sock):
+        """
+        Respond to VR_PMAC_GETRESPONSE and VR_PMAC_GETBUFFER requests until the
+        client disconnects
+
+        Args:
+            sock(socket.socket): Connection to client
+
+        """
+
+        try:
+            self._serve_requests(sock)
+        except socket.error:
+            pass  # Client disconnected
+
+    def _serve_requests(self, sock):
+        """
+        Serve requests on a connection
+
+        Args:
+            sock(socket.socket): Connection to client
+
+        """
+
+        pending = ""
+        while True:
+            header = self._receive(sock, 8)
+            if header is None:
+                return
+            request_type, request, _, _, length = struct.unpack('>2B3H', header)
+
+            if (request_type, request) == (0x40, 0xBF):  # VR_PMAC_GETRESPONSE
+                command = self._receive(sock, length)
+                if command is None:
+                    return
+                pending = self.process_command(command)
+            elif (request_type, request) != (0xC0, 0xC5):  # VR_PMAC_GETBUFFER
+                return
+
+            if self.latency > 0:
+                time.sleep(self.latency)
+            length = self.max_response_length
+            if length < min(len(pending), 1400) and pending[length - 1] == "\r":
+                # A short packet ending in CR reads as an error, so split after the next
+                # byte
+                length += 1
+            response = pending[:length]
+            pending = pending[length:]
+            sock.sendall(response if response else "\x00")
+
+    @staticmethod
+    def _receive(sock, length):
+        """
+        Receive exactly `length` bytes
+
+        Args:
+            sock(socket.socket): Connection to receive from
+            length(int): Number of bytes to receive
+
+        Returns:
+            str: Bytes received, or None if the connection closed
+
+        """
+
+        data = ""
+        while len(data) < length:
+            chunk = sock.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+
+        return data
+
+    def process_command(self, command):
+        """
+        Process a command line and build the response the PMAC would send
+
+        Args:
+            command(str): Command line, possibly containing several commands
+
+        Returns:
+            str: Response lines terminated with ACK, or output up to an error
+            followed by ERR003
+
+        """
+
+        with self.lock:
+            self.packets_received += 1
+            if len(command) > self.max_command_length:
+                return "\x07ERR003\r"
+
+            command = command.upper()
+            output = []
+            position = 0
+            try:
+                while True:
+                    while position < len(command) and command[position] in " \t\r\n":
+                        position += 1
+                    if position == len(command):
+                        break
+
+                    for name, pattern in self.command_patterns:
+                        match = pattern.match(command, position)
+                        if match:
+                            break
+                    else:
+                        raise PmacCommandError(command[position:])
+
+                    self.commands_received += 1
+                    output.extend(getattr(self, "_" + name)(*match.groups()))
+                    position = match.end()
+            except PmacCommandError:
+                return "".join(line + "\r" for line in output) + "\x07ERR003\r"
+
+            return "".join(line + "\r" for line in output) + "\x06"
+
+    @staticmethod
+    def _parse_value(value):
+        """
+        Parse a decimal or $ prefixed hex value
+
+        Args:
+            value(str): Value to parse
+
+        Returns:
+            int/float: Parsed value
+
+        """
+
+        if value.startswith("$"):
+            return int(value[1:], 16)
+        elif re.match(r'^-?\d+$', value):
+            return int(value)
+        else:
+            return float(value)
+
+    @staticmethod
+    def _format_value(value):
+        """
+        Format a value as the PMAC reports it
+
+        Args:
+            value(int/float): Value to format
+
+        Returns:
+            str: Formatted value
+
+        """
+
+        if float(value) == int(value):
+            return str(int(value))
+        else:
+            return "%.12g" % value
+
+    def _read_word(self, mode, address):
+        """
+        Read a memory word in the given mode
+
+        Args:
+            mode(str): L, X, Y or D
+            address(int): Address to read
+
+        Returns:
+            int: Value of word
+
+        """
+
+        word = self.memory.get(address, 0)
+        if mode == "X":
+            return word >> 24
+        elif mode == "Y":
+            return word & 0xFFFFFF
+        return word
+
+    def _write_word(self, mode, address, value):
+        """
+        Write a memory word in the given mode
+
+        Args:
+            mode(str): L, X, Y or D
+            address(int): Address to write
+            value(int/float): Value to write
+
+        """
+
+        if isinstance(value, float):
+            if mode == "L":
+                value = int(TrajectoryScanGenerator.double_to_pmac_float(value)[1:], 16)
+            else:
+                value = int(value)
+
+        word = self.memory.get(address, 0)
+        if mode == "X":
+            word = ((value & 0xFFFFFF) << 24) | (word & 0xFFFFFF)
+        elif mode == "Y":
+            word = (word & ~0xFFFFFF) | (value & 0xFFFFFF)
+        else:
+            word = value
+        self.memory[address] = word & WORD_MASK
+
+    def _write(self, mode, address, values):
+        address = int(address, 16)
+        for i, value in enumerate(re.split(r'[\s,]+', values.strip(" \t,"))):
+            self._write_word(mode, address + i, self._parse_value(value))
+        return []
+
+    def _read_hex(self, mode, address, num_words):
+        address = int(address, 16)
+        digits = 12 if mode in "LD" else 6
+        words = [self._read_word(mode, address + i) for i in range(int(num_words or 1))]
+        return [" ".join("%0*X" % (digits, word) for word in words)]
+
+    def _read(self, mode, address):
+        word = self._read_word(mode, int(address, 16))
+        if mode == "L":
+            return [self._format_value(PmacTestHarness.pmac_float_to_double(word))]
+        return [str(word)]
+
+    def _definition(self, variable_type, number, definition):
+        if not definition:
+            return [self.definitions.get(variable_type + number, "*")]
+        self.definitions[variable_type + number] = definition
+        return []
+
+    def _variable(self, variable_type, first, last, value):
+        if value is not None:
+            self.set_variable(variable_type + first, self._parse_value(value))
+            return []
+
+        last = int(last) if last is not None else int(first)
+        return [self._format_value(self.get_variable(variable_type + str(number)))
+                for number in range(int(first), last + 1)]
+
+    def _motor_assignment(self, motor, definition):
+        self._selected_motor = int(motor)
+        return []
+
+    def _motor(self, motor):
+        self._selected_motor = int(motor)
+        return []
+
+    def _motor_query(self, query):
+        if query == "P":
+            return [self._format_value(self.motor_positions.get(self._selected_motor, 0))]
+        return ["0"]
+
+    def _jog(self, jog, position, distance):
+        current = self.motor_positions.get(self._selected_motor, 0)
+        if position is not None:
+            self.motor_positions[self._selected_motor] = self._parse_value(position)
+        elif distance is not None:
+            self.motor_positions[self._selected_motor] = current + self._parse_value(distance)
+        return []
+
+    def _home(self):
+        self.motor_positions[self._selected_motor] = 0
+        return []
+
+    def _coordinate_system(self, cs_number):
+        return []
+
+    def _run(self, program_num):
+        return []
+
+    def _abort(self):
+        return []
+
+    def _define_gather(self, num_words):
+        self.gather_length = int(num_words or 0)
+        self.gather_buffer = []
+        return []
+
+    def _delete_gather(self):
+        self.gather_length = 0
+        self.gather_buffer = []
+        self.gathering = False
+        return []
+
+    def _gather(self):
+        self.gather_buffer = []
+        self.gathering = True
+        return []
+
+    def _end_gather(self):
+        self.gathering = False
+        return []
+
+    def _list_gather(self, start, length):
+        # Sources take one word per sample in X and Y and two in L and D
+        start = int(start or 0)
+        end = start + int(length) if length is not None else None
+        lines = []
+        word = 0
+        for sample in self.gather_buffer:
+            tokens = []
+            for mode, value in sample:
+                if word >= start and (end is None or word < end):
+                    tokens.append("%0*X" % (12 if mode in "LD" else 6, value))
+                word += 2 if mode in "LD" else 1
+            if tokens:
+                lines.append(" ".join(tokens))
+        return lines
+
+    def _list_program(self, program_num):
+        raise PmacCommandError(program_num)
+
+    def _identity(self, command):
+        if command == "CID":
+            return [self.card_id]
+        elif command == "VER":
+            return [self.firmware_version]
+        return []
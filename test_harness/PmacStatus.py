@@ -0,0 +1,103 @@
+class PmacStatus(object):
+    """
+    A snapshot of the `trajectory_scan` status variables, read from the pmac in a
+    single packed command. It can also estimate how long is left until the next
+    buffer swap, to poll quickly around swaps and slowly in between.
+
+    """
+
+    # Attribute name and pmac variable of each status value
+    variables = [('status', "P4001"),
+                 ('error', "P4015"),
+                 ('total_points', "P4005"),
+                 ('current_index', "P4006"),
+                 ('current_buffer', "P4007"),
+                 ('buffer_fill_A', "P4011"),
+                 ('buffer_fill_B', "P4012"),
+                 ('vel_mode', "M4011"),
+                 ('trigger', "M32")]
+
+    def __init__(self, values, timestamp=None):
+        """
+        Args:
+            values(list(str)): Value of each of `variables`, in order
+            timestamp(float): Time the values were read
+
+        Raises:
+            ValueError: Wrong number of values
+
+        """
+
+        if len(values) != len(self.variables):
+            raise ValueError("Expected {num} status values".format(
+                num=len(self.variables)))
+
+        for (name, _), value in zip(self.variables, values):
+            setattr(self, name, int(value))
+        self.timestamp = timestamp
+
+    @classmethod
+    def variable_names(cls):
+        """
+        Get the pmac variables to read for a snapshot
+
+        Returns:
+            list(str): Pmac variables e.g. P4001
+
+        """
+
+        return [variable for _, variable in cls.variables]
+
+    def seconds_to_swap(self, time_vals):
+        """
+        Estimate the time until the pmac reaches the end of the current half-buffer
+
+        Args:
+            time_vals(list(int)): Time value of each point in the current half-buffer,
+            in 1/4s of a ms
+
+        Returns:
+            float: Time in seconds
+
+        """
+
+        # Divide by 4000 to convert time values from 1/4s of a ms to s
+        return sum(time_vals[self.current_index:]) / 4000.0
+
+    def poll_delay(self, time_vals, min_delay=0.001, max_delay=0.1):
+        """
+        Get the time to wait before the next poll, so polls get closer together as
+        the next buffer swap approaches
+
+        Args:
+            time_vals(list(int)): Time value of each point in the current half-buffer,
+            or None if unknown
+            min_delay(float): Shortest time to wait in seconds
+            max_delay(float): Longest time to wait in seconds
+
+        Returns:
+            float: Time to wait in seconds
+
+        """
+
+        if time_vals is None:
+            return max_delay
+
+        return self.adaptive_delay(self.seconds_to_swap(time_vals), min_delay, max_delay)
+
+    @staticmethod
+    def adaptive_delay(seconds_to_swap, min_delay=0.001, max_delay=0.1):
+        """
+        Wait half of the time left until the swap, within the given limits
+
+        Args:
+            seconds_to_swap(float): Estimated time until the buffer swap
+            min_delay(float): Shortest time to wait in seconds
+            max_delay(float): Longest time to wait in seconds
+
+        Returns:
+            float: Time to wait in seconds
+
+        """
+
+        return min(max(seconds_to_swap / 2.0, min_delay), max_delay)
@@ -1,5 +1,17 @@
-from dls_pmacremote import PmacEthernetInterface
+import contextlib
+import re
+import time
+
+from dls_pmacremote import PmacEthernetInterface, PmacMetrics
 from PmacCoordinateSystem import PmacCoordinateSystem as PmacCS
+from PmacConfiguration import PmacConfiguration
+from PmacConnectionPool import PmacConnectionPool
+from PmacCommandCache import PmacCommandCache
+from PmacStatus import PmacStatus
+
+from pkg_resources import require
+require('numpy')
+import numpy
 
 
 class PmacTestHarness(PmacEthernetInterface):
@@ -9,20 +21,35 @@ class PmacTestHarness(PmacEthernetInterface):
 
     """
 
-    def __init__(self, ip_address):
+    # Variables holding configuration cached in `config`
+    config_variables = [(re.compile(r'i[1-9]16$', re.IGNORECASE), 'max_velocities'),
+                        (re.compile(r'i[1-9]17$', re.IGNORECASE), 'max_accelerations'),
+                        (re.compile(r'P400[489]$', re.IGNORECASE), 'buffer_layout')]
+
+    # Gather source address type bits for each memory mode
+    gather_modes = {'Y': 0x000000, 'X': 0x400000, 'D': 0x800000, 'L': 0xC00000}
+    # L memory address of P0 and of Q0 of coordinate system 1
+    variable_addresses = {'P': 0x6000, 'Q': 0x8000}
+
+    def __init__(self, ip_address, port=1025, data_lanes=1):
         """
         Set up the connection to the given pmac and retrieve the required variables
         for any functions.
 
         Args:
             ip_address(str): The IP address of the pmac to connect to
+            port(int): The port of the pmac to connect to
+            data_lanes(int): Number of connections for memory transfers, if this is
+            the first harness for the pmac
 
         """
         super(PmacTestHarness, self).__init__(
             parent=None, verbose=False, numAxes=None, timeout=3.0)
 
-        # Connection initialisation
-        self.setConnectionParams(host=ip_address, port=1025)
+        # Connection initialisation; connections are shared by harnesses for one pmac
+        self.pool = None
+        self.data_lanes = data_lanes
+        self.setConnectionParams(host=ip_address, port=port)
         self.connect()
 
         # Variables read directly from PMAC
@@ -40,66 +67,272 @@ class PmacTestHarness(PmacEthernetInterface):
                             'error': "P4015",
                             'version': "P4020"}
 
-        self.status = int(self.read_variable(self.P_variables['status']))
-        self.error = int(self.read_variable(self.P_variables['error']))
-        self.total_points = 0
-        self.current_index = 0
-        self.current_buffer = 0
+        self.status_snapshot = None  # PmacStatus from the last update_status_variables
+        self.update_status_variables()
 
-        # Fixed values
-        self.buffer_length = int(
-            self.read_variable(self.P_variables['buffer_length']))
-        self.buffer_address_A = hex(int(
-            self.read_variable(self.P_variables['buffer_address_A'])))[2:]
-        self.buffer_address_B = hex(int(
-            self.read_variable(self.P_variables['buffer_address_B'])))[2:]
+        # Fixed values, read once and shared by harnesses for the same pmac
+        self.config = PmacConfiguration.get_shared(self.hostname, self.port)
+        self.set_buffer_layout(*self.config.get('buffer_layout', self._read_buffer_layout))
 
         # Other PMAC information
         self.addresses = {}  # Addresses for each sub-buffer, set based on current buffer
         self.prev_buffer_write = 1  # Specifier for the most recent buffer write
+        self.active_axes = None  # Axes sent by set_axes; None to write all sub-buffers
+        self.command_cache = None  # Cache of buffer write commands, if enabled
+        self.write_shadow = None  # Last word written to each L address, if enabled
+        self.gather_sources = []  # (name, mode, address) of each gathered source
+        self.gather_samples = 0  # Number of samples the gather buffer holds
 
-        # PMAC CS Set Up
+        # PMAC CS Set Up, with any motor assignments already made for the pmac
         self.coordinate_system = {'1': PmacCS(1)}
+        for key in self.config.keys():
+            if isinstance(key, tuple) and key[0] == 'cs_motors':
+                self._restore_cs_motors(key[1])
         self.read_cs_max_velocities(1)
 
+    def connect(self):
+        """
+        Get the connection pool for the pmac
+
+        Returns:
+            str: None on success, or an error message on failure
+
+        """
+
+        if self.isConnectionOpen:
+            return 'Socket is already open'
+        if self.hostname in (None, '') or self.port in (None, 0):
+            return 'ERROR: hostname or port number not set'
+
+        try:
+            self.pool = PmacConnectionPool.get_pool(
+                self.hostname, self.port, self.data_lanes, self.timeout)
+        except IOError as error:
+            return str(error)
+        config = PmacConfiguration.get_shared(self.hostname, self.port)
+        if config.pool is not self.pool:
+            # A new pool means nothing was connected, so the pmac may have been
+            # reconfigured or restarted since the configuration was read
+            config.invalidate()
+            config.pool = self.pool
+        if self.metrics is not None:
+            self.pool.set_metrics(self.metrics)
+        self.isConnectionOpen = True
+
+    def disconnect(self):
+        """
+        Release the connection pool, closing it if no other harness is using it
+
+        """
+
+        if self.isConnectionOpen:
+            self.pool.release()
+            self.pool = None
+            self.isConnectionOpen = False
+
+    def enableMetrics(self):
+        """
+        Record wire-level statistics of the commands sent on every connection in the
+        pool. The pool is shared, so the metrics also count commands sent by other
+        harnesses for the same pmac, and a harness enabling metrics on a pool that
+        already has them gets the same PmacMetrics.
+
+        Returns:
+            PmacMetrics: Metrics being recorded
+
+        """
+
+        if self.metrics is None:
+            if self.pool is not None and self.pool.metrics is not None:
+                self.metrics = self.pool.metrics
+            else:
+                self.metrics = PmacMetrics()
+        if self.pool is not None:
+            self.pool.set_metrics(self.metrics)
+
+        return self.metrics
+
+    def disableMetrics(self):
+        """
+        Stop recording statistics on the connections in the pool
+
+        """
+
+        if self.pool is not None and self.pool.metrics is self.metrics:
+            self.pool.set_metrics(None)
+        super(PmacTestHarness, self).disableMetrics()
+
+    def _sendCommand(self, command, shouldWait=True, doubleTimeout=False):
+        """
+        Send a command through the connection pool, so status and abort commands are
+        not held up by memory transfers
+
+        Args:
+            command(str): Command to send
+            shouldWait(bool): Unused; each connection in the pool has its own lock
+            doubleTimeout(bool): Wait twice the timeout for a response
+
+        Returns:
+            str: Response from the pmac
+
+        Raises:
+            IOError: Communication failed
+
+        """
+
+        if self.pool is None:
+            raise IOError('Not connected')
+
+        return self.pool.send_command(command, double_timeout=doubleTimeout)
+
+    def read_status(self):
+        """
+        Read every status variable in one command
+
+        Returns:
+            PmacStatus: Snapshot of the status variables
+
+        Raises:
+            IOError: Read failed
+
+        """
+
+        values = self.read_multiple_variables(PmacStatus.variable_names())
+
+        return PmacStatus(values, time.time())
+
     def update_status_variables(self):
         """
         Update status, error, total points scanned, current index and current buffer
-        specifier from the pmac
+        specifier from a status snapshot, which is kept in `status_snapshot`
+
+        Returns:
+            PmacStatus: Snapshot of the status variables
+
+        """
+
+        snapshot = self.read_status()
+
+        self.status = snapshot.status
+        self.error = snapshot.error
+        self.total_points = snapshot.total_points
+        self.current_index = snapshot.current_index
+        self.current_buffer = snapshot.current_buffer
+        self.status_snapshot = snapshot
+
+        return snapshot
+
+    def poll_status(self, time_vals=None, min_delay=0.001, max_delay=0.1):
+        """
+        Wait and then update the status variables. The wait is half the estimated
+        time to the next buffer swap, within the given limits, so polls are close
+        together around swaps and far apart in between.
+
+        Args:
+            time_vals(list(int)): Time value of each point in the current half-buffer,
+            or None to wait `max_delay`
+            min_delay(float): Shortest time to wait in seconds
+            max_delay(float): Longest time to wait in seconds
+
+        Returns:
+            PmacStatus: Snapshot of the status variables
 
         """
 
-        status, error, total_points, current_index, current_buffer = \
-            self.read_multiple_variables([self.P_variables['status'], self.P_variables['error'],
-                                          self.P_variables['total_points'],
-                                          self.P_variables['current_index'],
-                                          self.P_variables['current_buffer']])
+        if self.status_snapshot is None:
+            delay = max_delay if time_vals is None else min_delay
+        else:
+            delay = self.status_snapshot.poll_delay(time_vals, min_delay, max_delay)
+        time.sleep(delay)
+
+        return self.update_status_variables()
 
-        self.status = int(status)
-        self.error = int(error)
-        self.total_points = int(total_points)
-        self.current_index = int(current_index)
-        self.current_buffer = int(current_buffer)
+    def set_buffer_layout(self, buffer_length, buffer_address_A, buffer_address_B):
+        """
+        Set the buffer length and half-buffer root addresses and calculate the offset
+        of each sub-buffer from the root of its half-buffer
+
+        Args:
+            buffer_length(int): Number of points in each sub-buffer
+            buffer_address_A(int): Root address of half-buffer A
+            buffer_address_B(int): Root address of half-buffer B
+
+        """
+
+        self.buffer_length = buffer_length
+        self.buffer_address_A = buffer_address_A
+        self.buffer_address_B = buffer_address_B
+
+        self.sub_buffer_offsets = {}
+        for i, axis in enumerate(['time', 'a', 'b', 'c', 'u', 'v', 'w', 'x', 'y', 'z']):
+            self.sub_buffer_offsets[axis] = i*buffer_length
 
     def update_address_dict(self, root_address):
         """
         Update the addresses of each sub-buffer based on the current half buffer
 
         Args:
-            root_address(str): Root address of current half-buffer
+            root_address(int): Root address of current half-buffer
+
+        """
+
+        self.addresses = {}
+        for axis, offset in self.sub_buffer_offsets.iteritems():
+            self.addresses[axis] = root_address + offset
 
+    def _read_buffer_layout(self):
         """
+        Read the buffer length and half-buffer root addresses in one command
+
+        Returns:
+            tuple(int, int, int): Buffer length and addresses of half-buffers A and B
+
+        Raises:
+            IOError: Read failed
+
+        """
+
+        values = self.read_multiple_variables([self.P_variables['buffer_length'],
+                                               self.P_variables['buffer_address_A'],
+                                               self.P_variables['buffer_address_B']])
+        if len(values) != 3:
+            raise IOError("Read failed")
+
+        return tuple(int(value) for value in values)
+
+    def _restore_cs_motors(self, cs_number):
+        """
+        Set the motor assignments of a coordinate system from the shared
+        configuration, creating the coordinate system if needed
+
+        Args:
+            cs_number(int/str): Coordinate system to restore
+
+        """
+
+        assignments = self.config.get(('cs_motors', str(cs_number)))
+        if assignments is None:
+            return
+
+        cs = self.coordinate_system.setdefault(str(cs_number), PmacCS(int(cs_number)))
+        for motor, axis, scaling in assignments:
+            cs.add_motor_assignment(motor, axis, scaling)
+
+    def _store_cs_motors(self, cs_number):
+        """
+        Store the motor assignments of a coordinate system in the shared
+        configuration, replacing the old assignments
+
+        Args:
+            cs_number(int): Coordinate system to store
+
+        """
+
+        motor_map = self.coordinate_system[str(cs_number)].motor_map
+        assignments = sorted((motor, axis, scaling)
+                             for motor, (axis, scaling) in motor_map.iteritems())
 
-        self.addresses = {'time': root_address,
-                          'a': self.add_dechex(root_address, int(self.buffer_length)),
-                          'b': self.add_dechex(root_address, 2*int(self.buffer_length)),
-                          'c': self.add_dechex(root_address, 3*int(self.buffer_length)),
-                          'u': self.add_dechex(root_address, 4*int(self.buffer_length)),
-                          'v': self.add_dechex(root_address, 5*int(self.buffer_length)),
-                          'w': self.add_dechex(root_address, 6*int(self.buffer_length)),
-                          'x': self.add_dechex(root_address, 7*int(self.buffer_length)),
-                          'y': self.add_dechex(root_address, 8*int(self.buffer_length)),
-                          'z': self.add_dechex(root_address, 9*int(self.buffer_length))}
+        self.config.set(('cs_motors', str(cs_number)), assignments)
 
     def add_coordinate_system(self, cs_instance, cs_number):
         """
@@ -116,61 +349,185 @@ class PmacTestHarness(PmacEthernetInterface):
     def read_cs_max_velocities(self, cs_number):
         """
         Read the maximum allowed velocities from variables ix16 on the PMAC for
-        given coordinate system
+        given coordinate system, in one command; the values are cached in `config`
 
         Args:
             cs_number: Coordinate system to read for
 
         """
 
-        velocities = []
-        for i in range(1, 10):
-            velocities.append(self.read_variable("i{axis}16".format(axis=i)))
+        velocities = self.config.get('max_velocities', lambda: list(
+            self.read_multiple_variables(["i{axis}16".format(axis=i) for i in range(1, 10)])))
 
         self.coordinate_system[str(cs_number)].set_max_velocities(velocities)
 
+    def read_cs_max_accelerations(self, cs_number):
+        """
+        Read the maximum allowed accelerations from variables ix17 on the PMAC for
+        given coordinate system, in one command; the values are cached in `config`
+
+        Args:
+            cs_number: Coordinate system to read for
+
+        """
+
+        accelerations = self.config.get('max_accelerations', lambda: list(
+            self.read_multiple_variables(["i{axis}17".format(axis=i) for i in range(1, 10)])))
+
+        self.coordinate_system[str(cs_number)].set_max_accelerations(accelerations)
+
     def set_cs_initial_coordinates(self, cs_number):
         """
         Set Current_* and Next_* values for required axes to be the actual
         motor positions; these act as the start positions for the motion
-        program
+        program. Positions are read in one command and set in one packed write.
+
+        Args:
+            cs_number(int): Coordinate system to set coordinates for
+
+        Raises:
+            IOError: Read or write failed
+
+        """
+
+        motors = self._initial_coordinate_motors(cs_number, kinematic=False)
+        positions = self._read_motor_positions(motors)
+        self._write_initial_coordinates(motors, positions)
+
+    def set_cs_initial_kinematic_coordinates(self, cs_number):
+        """
+        Set Current_* and Next_* values for required kinematic axes to be the
+        actual axis positions; these act as the start positions for the motion
+        program. Positions are read in one command and set in one packed write.
 
         Args:
             cs_number(int): Coordinate system to set coordinates for
 
+        Raises:
+            IOError: Read or write failed
+
+        """
+
+        motors = self._initial_coordinate_motors(cs_number, kinematic=True)
+        positions = self._read_motor_positions(motors)
+        self._write_initial_coordinates(motors, positions)
+
+    def setup_cs_for_scan(self, cs_number, kinematic=False):
+        """
+        Read the maximum velocities and accelerations of the coordinate system and
+        set its initial coordinates, in one read command and one packed write.
+        Equivalent to read_cs_max_velocities, read_cs_max_accelerations and then
+        set_cs_initial_coordinates, or set_cs_initial_kinematic_coordinates. Limits
+        cached in `config` are not read again.
+
+        Args:
+            cs_number(int): Coordinate system to set up
+            kinematic(bool): Set the initial coordinates of kinematic axes
+
+        Raises:
+            IOError: Read or write failed
+
+        """
+
+        motors = self._initial_coordinate_motors(cs_number, kinematic)
+        velocities = self.config.get('max_velocities')
+        accelerations = self.config.get('max_accelerations')
+
+        if velocities is None or accelerations is None:
+            limits = ["i{axis}16".format(axis=i) for i in range(1, 10)] + \
+                     ["i{axis}17".format(axis=i) for i in range(1, 10)]
+            variables = limits + ["#{motor}P".format(motor=motor) for motor, _ in motors]
+
+            values = self.read_multiple_variables(variables)
+            if len(values) != len(variables):
+                raise IOError("Read failed")
+
+            velocities = list(values[:9])
+            accelerations = list(values[9:18])
+            positions = values[18:]
+            self.config.set('max_velocities', velocities)
+            self.config.set('max_accelerations', accelerations)
+        else:
+            positions = self._read_motor_positions(motors)
+
+        self.coordinate_system[str(cs_number)].set_max_velocities(velocities)
+        self.coordinate_system[str(cs_number)].set_max_accelerations(accelerations)
+        self._write_initial_coordinates(motors, positions)
+
+    def _initial_coordinate_motors(self, cs_number, kinematic):
         """
+        Get the motors whose positions are the initial coordinates of the required
+        axes. Current_* and Next_* of the axis with the same number are set for each.
+
+        Args:
+            cs_number(int): Coordinate system to get motors for
+            kinematic(bool): Get motors of kinematic axes
+
+        Returns:
+            list(tuple(int, int)): Motor number and EGU scaling of each axis; scaling
+            is None for kinematic axes, whose positions are set unscaled
+
+        """
+
+        if kinematic:
+            return [(int(motor), None)
+                    for motor in self.coordinate_system[str(cs_number)].axis_map['I']]
 
         axis_assignments = {'A': 1, 'B': 2, 'C': 3,
                             'U': 4, 'V': 5, 'W': 6,
                             'X': 7, 'Y': 8, 'Z': 9}
 
-        motor_map = self.coordinate_system[str(cs_number)].motor_map
+        return [(axis_assignments[axis], egu_scaling) for axis, egu_scaling
+                in self.coordinate_system[str(cs_number)].motor_map.itervalues()]
 
-        for axis, egu_scaling in motor_map.itervalues():
-            current_position = str(float(
-                self.read_motor_position(axis_assignments[axis])) *
-                                   egu_scaling)
+    def _read_motor_positions(self, motors):
+        """
+        Read the positions of motors in one command
 
-            self.set_variable("P411" + str(axis_assignments[axis]),
-                              current_position)
-            self.set_variable("M400" + str(axis_assignments[axis]),
-                              current_position)
+        Args:
+            motors(list(tuple(int, int))): Motor number and scaling of each axis
+
+        Returns:
+            list(str): Position of each motor
+
+        Raises:
+            IOError: Read failed
 
-    def set_cs_initial_kinematic_coordinates(self, cs_number):
         """
-        Set Current_* and Next_* values for required kinematic axes to be the
-        actual axis positions; these act as the start positions for the motion
-        program
+
+        if not motors:
+            return []
+
+        positions = self.read_multiple_variables(
+            ["#{motor}P".format(motor=motor) for motor, _ in motors])
+        if len(positions) != len(motors):
+            raise IOError("Read failed")
+
+        return list(positions)
+
+    def _write_initial_coordinates(self, motors, positions):
+        """
+        Set Current_* (P411x) and Next_* (M400x) values for axes in one packed write
 
         Args:
-            cs_number(int): Coordinate system to set coordinates for
+            motors(list(tuple(int, int))): Motor number and scaling of each axis
+            positions(list(str)): Position of each motor
+
+        Raises:
+            IOError: Write failed
 
         """
 
-        for motor in self.coordinate_system[str(cs_number)].axis_map['I']:
-            current_position = self.read_motor_position(motor)
-            self.set_variable("P411" + str(motor), current_position)
-            self.set_variable("M400" + str(motor), current_position)
+        commands = []
+        for (motor, egu_scaling), position in zip(motors, positions):
+            if egu_scaling is not None:
+                position = str(float(position) * egu_scaling)
+            commands.append("P411{axis}={value}".format(axis=motor, value=position))
+            commands.append("M400{axis}={value}".format(axis=motor, value=position))
+
+        for _, success in self.sendCommands(commands):
+            if not success:
+                raise IOError("Write failed")
 
     def assign_cs_motors(self, axis_map, cs_number):
         """
@@ -196,6 +553,7 @@ class PmacTestHarness(PmacEthernetInterface):
                     motor_num=motor, scaling=scaling, axis=axis)
 
         self.sendCommand(command)
+        self._store_cs_motors(cs_number)
 
     def assign_cs_motors_to_kinematics(self, motors, cs_number):
         """
@@ -216,6 +574,7 @@ class PmacTestHarness(PmacEthernetInterface):
             command += " #{motor_num}->I".format(motor_num=motor)
 
         self.sendCommand(command)
+        self._store_cs_motors(cs_number)
 
     def home_cs_motors(self, cs_number):
         """
@@ -250,6 +609,213 @@ class PmacTestHarness(PmacEthernetInterface):
 
         self.sendCommand(command)
 
+    def configure_gather(self, sources, period=1, num_samples=1000):
+        """
+        Set the sources and period of data gathering and define a gather buffer
+        that holds `num_samples` samples; gathering stops when it is full
+
+        Args:
+            sources(list(tuple(str, str, int))): Name, memory mode (X, Y, D or L)
+            and address of each source to gather e.g. ('motor1_actual', 'D', 0x8B)
+            period(int): Number of servo cycles between samples
+            num_samples(int): Number of samples to gather
+
+        Raises:
+            ValueError: Too many sources or invalid memory mode
+            IOError: Write failed
+
+        """
+
+        if len(sources) > 48:
+            raise ValueError("Cannot gather more than 48 sources")
+
+        mask = 0
+        words_per_sample = 0
+        commands = ["ENDG", "DELETE GATHER", "I5000=0", "I5049={period}".format(period=period)]
+        for source_num, (_, mode, address) in enumerate(sources):
+            if mode not in self.gather_modes:
+                raise ValueError("Invalid gather mode {mode}".format(mode=mode))
+            commands.append("I{ivar}=${address:06x}".format(
+                ivar=5001 + source_num, address=self.gather_modes[mode] | address))
+            mask |= 1 << source_num
+            words_per_sample += 2 if mode in ['D', 'L'] else 1
+        commands.append("I5050=${mask:x}".format(mask=mask & 0xFFFFFF))
+        commands.append("I5051=${mask:x}".format(mask=mask >> 24))
+        commands.append("DEFINE GATHER {words}".format(words=num_samples*words_per_sample))
+
+        for _, success in self.sendCommands(commands, [0]*len(commands)):
+            if not success:
+                raise IOError("Write failed")
+
+        self.gather_sources = list(sources)
+        self.gather_samples = num_samples
+
+    @staticmethod
+    def motor_gather_sources(motor_num):
+        """
+        Get the gather sources for the commanded and actual position of a motor.
+        Their difference is the following error in 1/(Ixx08*32) counts.
+
+        Args:
+            motor_num(int): Motor to gather positions for
+
+        Returns:
+            list(tuple(str, str, int)): Gather sources
+
+        """
+
+        base = 0x80*motor_num
+        return [("motor{motor}_commanded".format(motor=motor_num), 'D', base + 0x08),
+                ("motor{motor}_actual".format(motor=motor_num), 'D', base + 0x0B)]
+
+    def variable_gather_sources(self, variables):
+        """
+        Get gather sources for P, Q and M variables, named by variable. P and Q
+        variables are gathered as their L memory words, and M variables as the word
+        their definition points to, read from the pmac in one packed command.
+
+        Args:
+            variables(list(str)): Variables to gather e.g. P4101, Q1, M4001
+
+        Returns:
+            list(tuple(str, str, int)): Gather sources
+
+        Raises:
+            ValueError: Unsupported variable or M variable definition
+            IOError: Read failed
+
+        """
+
+        m_variables = [variable for variable in variables if variable[0].upper() == 'M']
+        definitions = {}
+        responses = self.sendCommands([variable + "->" for variable in m_variables])
+        for variable, (value, success) in zip(m_variables, responses):
+            if not success:
+                raise IOError("Read failed")
+            match = re.match(r'([XYLD]):\$([0-9A-F]+)', value.strip().upper())
+            if match is None:
+                raise ValueError("Cannot gather {variable}->{definition}".format(
+                    variable=variable, definition=value.rstrip('\r\x06')))
+            definitions[variable] = (match.group(1), int(match.group(2), base=16))
+
+        sources = []
+        for variable in variables:
+            variable_type = variable[0].upper()
+            if variable_type == 'M':
+                mode, address = definitions[variable]
+            elif variable_type in self.variable_addresses:
+                mode, address = 'L', self.variable_addresses[variable_type] + int(variable[1:])
+            else:
+                raise ValueError("Cannot gather {variable}".format(variable=variable))
+            sources.append((variable, mode, address))
+
+        return sources
+
+    def start_gather(self):
+        """
+        Start data gathering into the gather buffer
+
+        Raises:
+            IOError: Command failed
+
+        """
+
+        _, success = self.sendCommand("GAT")
+        if not success:
+            raise IOError("Gather failed")
+
+    def stop_gather(self):
+        """
+        Stop data gathering
+
+        Raises:
+            IOError: Command failed
+
+        """
+
+        _, success = self.sendCommand("ENDG")
+        if not success:
+            raise IOError("Gather failed")
+
+    @contextlib.contextmanager
+    def gathering(self):
+        """
+        Gather data while the body of a with statement runs, e.g. around
+        run_motion_program and waiting for the scan to finish
+
+        """
+
+        self.start_gather()
+        try:
+            yield
+        finally:
+            self.stop_gather()
+
+    def read_gather(self, num_samples=None, samples_per_read=100):
+        """
+        Read the gathered samples back a block of samples per command and decode
+        each source: X and Y words as signed 24-bit integers, D words as signed
+        48-bit integers and L words as PMAC floats.
+
+        LIST GATHER addresses the gather buffer in words, as DEFINE GATHER sizes it;
+        X and Y sources take one word per sample and D and L sources take two, and
+        are listed as 6 and 12 hex digits. The pmac only lists samples it has
+        gathered, so reading stops at the first short block.
+
+        Args:
+            num_samples(int): Maximum number of samples to read; defaults to the
+            number the gather buffer holds
+            samples_per_read(int): Number of samples to read in each command
+
+        Returns:
+            dict: Decoded numpy array of the gathered samples for each source name
+
+        Raises:
+            IOError: Read failed
+
+        """
+
+        if num_samples is None:
+            num_samples = self.gather_samples
+        num_sources = len(self.gather_sources)
+        words_per_sample = sum(2 if mode in ['D', 'L'] else 1
+                               for _, mode, _ in self.gather_sources)
+
+        tokens = []
+        for start in range(0, num_samples, samples_per_read):
+            samples = min(samples_per_read, num_samples - start)
+            value, success = self.sendCommand("LIST GATHER {start},{length}".format(
+                start=start*words_per_sample, length=samples*words_per_sample))
+            if not success:
+                raise IOError("Read failed")
+
+            block = value.rstrip('\x06').split()
+            block_samples = len(block) // num_sources
+            # Each 6 hex digits of a listed value is one word of the gather buffer
+            words = sum(len(token) // 6 for token in block)
+            if block_samples > samples or len(block) != block_samples*num_sources or \
+                    words != block_samples*words_per_sample:
+                raise IOError("Read failed")
+            tokens.extend(block)
+            if block_samples < samples:
+                break
+
+        words = [int(token.lstrip('$'), base=16) for token in tokens]
+        columns = numpy.array(words, dtype=numpy.uint64).reshape(-1, num_sources)
+
+        gathered = {}
+        for source_num, (name, mode, _) in enumerate(self.gather_sources):
+            column = columns[:, source_num]
+            if mode == 'L':
+                gathered[name] = self.pmac_floats_to_doubles(column)
+            else:
+                bits = 48 if mode == 'D' else 24
+                values = column.astype(numpy.int64)
+                values[values >= 1 << (bits - 1)] -= 1 << bits
+                gathered[name] = values
+
+        return gathered
+
     def check_program_exists(self, program_number):
 
         response = self.sendCommand("List Program " + str(program_number))
@@ -295,6 +861,22 @@ class PmacTestHarness(PmacEthernetInterface):
             axes_val += axis_definitions[axis.upper()]
 
         self.set_variable(self.P_variables['axes'], str(axes_val))
+        self.active_axes = set(axis.lower() for axis in axes)
+
+    def is_axis_active(self, axis):
+        """
+        Check if the sub-buffer for an axis is used by the motion program; the time
+        sub-buffer is always used and all axes are used until set_axes is called
+
+        Args:
+            axis(str): Sub-buffer name e.g. time, x
+
+        Returns:
+            bool: True if the sub-buffer should be written
+
+        """
+
+        return self.active_axes is None or axis == 'time' or axis in self.active_axes
 
     def read_address(self, mode, address):
         """
@@ -318,9 +900,74 @@ class PmacTestHarness(PmacEthernetInterface):
         else:
             raise IOError("Read failed")
 
+    def read_address_range(self, mode, address, num_words):
+        """
+        Read a contiguous range of memory words with one command, starting at the
+        location specified by address, e.g. RHL:$30000,50
+
+        Args:
+            mode(str): The memory type to read e.g. X, Y, L
+            address(int): The address of the first memory location to access
+            num_words(int): Number of consecutive words to read
+
+        Returns:
+            numpy.ndarray: Raw value of each word as an unsigned integer
+
+        Raises:
+            IOError: Read failed
+
+        """
+
+        return self.read_address_ranges(mode, [(address, num_words)])[0]
+
+    def read_address_ranges(self, mode, ranges):
+        """
+        Read several ranges of memory words with one command per range, packed into
+        as few packets as possible. Responses longer than a packet are returned over
+        VR_PMAC_GETBUFFER continuations, so ranges are not split.
+
+        Args:
+            mode(str): The memory type to read e.g. X, Y, L
+            ranges(list(tuple(int, int))): Address of the first word and number of
+            words of each range
+
+        Returns:
+            list(numpy.ndarray): Raw value of each word of each range as unsigned
+            integers
+
+        Raises:
+            IOError: Read failed
+
+        """
+
+        read_ranges = [(address, num_words) for address, num_words in ranges if num_words > 0]
+        commands = ["RH{mode}:${address:x},{num_words}".format(
+            mode=mode, address=address, num_words=num_words)
+            for address, num_words in read_ranges]
+
+        words = []
+        for (value, success), (_, num_words) in zip(self.sendCommands(commands), read_ranges):
+            if not success:
+                raise IOError("Read failed")
+            command_words = value.rstrip('\x06').split()
+            if len(command_words) != num_words:
+                raise IOError("Read failed")
+            words.extend(int(word.lstrip('$'), base=16) for word in command_words)
+
+        words = numpy.array(words, dtype=numpy.uint64)
+
+        range_words = []
+        start = 0
+        for _, num_words in ranges:
+            range_words.append(words[start:start + num_words])
+            start += num_words
+
+        return range_words
+
     def read_points(self, num_points, buffer_num=0, num_axes=1):
         """
-        Read points stored in pmac memory buffer
+        Read points stored in pmac memory buffer. Only the first `num_points` words of
+        the time and axis sub-buffers are read.
 
         Args:
             num_points(int): Number of sets of points to read
@@ -328,7 +975,8 @@ class PmacTestHarness(PmacEthernetInterface):
             num_axes(int): Number of axes to read
 
         Returns:
-            list(str): Points stored in pmac memory
+            list(numpy.ndarray): Raw words stored in pmac memory; one array for
+            the time sub-buffer followed by one for each axis
 
         Raises:
             IOError: Read failed
@@ -336,23 +984,51 @@ class PmacTestHarness(PmacEthernetInterface):
         """
 
         if buffer_num == 0:
-            start = "30000"
+            start = self.buffer_address_A
         else:
-            start = self.add_dechex("30000", int(self.buffer_length)*10)
-
-        pmac_buffer = []
-        current_address = start
-        for _ in range(0, num_points):
-            pmac_buffer.append(self.read_address("L", current_address))
-            current_address = self.inc_hex(current_address)
-        for i in range(1, num_axes + 1):
-            current_address = self.add_dechex(start, int(self.buffer_length)*i)
-            # print(current_address)
-            for _ in range(0, num_points):
-                pmac_buffer.append(self.read_address("L", current_address))
-                current_address = self.inc_hex(current_address)
-
-        return pmac_buffer
+            start = self.buffer_address_B
+
+        return self.read_address_ranges(
+            "L", [(start + i*self.buffer_length, num_points) for i in range(num_axes + 1)])
+
+    def read_decoded_points(self, num_points, buffer_num=0, axes=None):
+        """
+        Read points stored in pmac memory buffer and decode them. The result can be
+        passed straight to PointSet e.g. PointSet(**pmac.read_decoded_points(10)).
+
+        Args:
+            num_points(int): Number of sets of points to read
+            buffer_num(int): Specifier for buffer A (0) or B (1)
+            axes(list(str)): Axes to read; defaults to the axes sent by set_axes, or
+            all axes if set_axes has not been called
+
+        Returns:
+            dict: Arrays of time_val, vel_mode and subroutine, and of positions for
+            each axis
+
+        Raises:
+            IOError: Read failed
+
+        """
+
+        sub_buffers = sorted(self.sub_buffer_offsets,
+                             key=lambda sub_buffer: self.sub_buffer_offsets[sub_buffer])
+        if axes is None:
+            axes = [axis for axis in sub_buffers[1:] if self.is_axis_active(axis)]
+        else:
+            axes = [axis.lower() for axis in axes]
+
+        num_axes = max([sub_buffers.index(axis) for axis in axes] + [0])
+        pmac_buffer = self.read_points(num_points, buffer_num, num_axes)
+
+        time_words = pmac_buffer[0]
+        points = {'time_val': time_words & numpy.uint64(0xFFFFFF),
+                  'subroutine': (time_words >> numpy.uint64(24)) & numpy.uint64(0xF),
+                  'vel_mode': (time_words >> numpy.uint64(28)) & numpy.uint64(0xF)}
+        for axis in axes:
+            points[axis] = self.pmac_floats_to_doubles(pmac_buffer[sub_buffers.index(axis)])
+
+        return points
 
     def write_to_address(self, mode, address, value):
         """
@@ -373,6 +1049,9 @@ class PmacTestHarness(PmacEthernetInterface):
 
         response, success = self.sendCommand("W" + mode + " $" + address + " " + value)
 
+        if self.write_shadow is not None:
+            self.write_shadow.pop(int(address, 16), None)
+
         if success:
             return response, success
         else:
@@ -441,6 +1120,11 @@ class PmacTestHarness(PmacEthernetInterface):
 
         response, success = self.sendCommand(variable + "=" + value)
 
+        # Drop cached configuration that the write may have changed
+        for pattern, key in self.config_variables:
+            if pattern.match(variable):
+                self.config.invalidate(key)
+
         if success:
             return response, success
         else:
@@ -448,24 +1132,24 @@ class PmacTestHarness(PmacEthernetInterface):
 
     def reset_buffers(self):
         """
-        Reset all memory in buffers to 0
+        Reset all memory in buffers of active axes to 0
 
         Raises:
             IOError: Write failed
 
         """
 
-        zeroes = ['$0']*int(self.buffer_length)
-        reset_points = {'time': zeroes[:],
-                        'a': zeroes[:], 'b': zeroes[:], 'c': zeroes[:],
-                        'u': zeroes[:], 'v': zeroes[:], 'w': zeroes[:],
-                        'x': zeroes[:], 'y': zeroes[:], 'z': zeroes[:]}
+        zeroes = ['$0']*self.buffer_length
+        reset_points = {}
+        for axis in self.sub_buffer_offsets.iterkeys():
+            if self.is_axis_active(axis):
+                reset_points[axis] = zeroes[:]
         self.fill_current_buffer(reset_points)
 
-        reset_points = {'time': zeroes[:],
-                        'a': zeroes[:], 'b': zeroes[:], 'c': zeroes[:],
-                        'u': zeroes[:], 'v': zeroes[:], 'w': zeroes[:],
-                        'x': zeroes[:], 'y': zeroes[:], 'z': zeroes[:]}
+        reset_points = {}
+        for axis in self.sub_buffer_offsets.iterkeys():
+            if self.is_axis_active(axis):
+                reset_points[axis] = zeroes[:]
         self.fill_idle_buffer(reset_points)
 
     def read_motor_position(self, motor_num):
@@ -500,12 +1184,13 @@ class PmacTestHarness(PmacEthernetInterface):
 
         return position
 
-    def fill_idle_buffer(self, points):
+    def fill_idle_buffer(self, points, content_key=None):
         """
         Update the address dictionary to fill idle buffer and then call _fill_buffer()
 
         Args:
             points(dict): Point set to fill with
+            content_key(str): Key of the content of `points` for the command cache
 
         """
 
@@ -514,14 +1199,15 @@ class PmacTestHarness(PmacEthernetInterface):
         else:
             self.update_address_dict(self.buffer_address_A)
 
-        self._fill_buffer(points)
+        self._fill_buffer(points, content_key)
 
-    def fill_current_buffer(self, points):
+    def fill_current_buffer(self, points, content_key=None):
         """
         Update the address dictionary to fill current buffer and then call _fill_buffer()
 
         Args:
             points(dict): Point set to fill with
+            content_key(str): Key of the content of `points` for the command cache
 
         """
 
@@ -530,60 +1216,253 @@ class PmacTestHarness(PmacEthernetInterface):
         else:
             self.update_address_dict(self.buffer_address_B)
 
-        self._fill_buffer(points)
+        self._fill_buffer(points, content_key)
 
-    def _fill_buffer(self, points):
+    def enable_command_cache(self, max_entries=256):
         """
-        Fill buffer specified by `self.addresses` with `points`
+        Cache the write commands of each buffer fill, so filling a half-buffer with a
+        point set it has been filled with before sends the stored commands
 
         Args:
-            points(dict): Point set to fill with
+            max_entries(int): Number of fills to keep
+
+        Returns:
+            PmacCommandCache: The cache
 
         """
 
+        if self.command_cache is None:
+            self.command_cache = PmacCommandCache(max_entries)
+
+        return self.command_cache
+
+    def disable_command_cache(self):
+        """
+        Stop caching buffer write commands and drop any stored commands
+
+        """
+
+        self.command_cache = None
+
+    def enable_delta_writes(self):
+        """
+        Keep a shadow copy of the words written to the buffers, so each fill only
+        writes the words that differ from what is already in pmac memory
+
+        """
+
+        if self.write_shadow is None:
+            self.write_shadow = {}
+
+    def disable_delta_writes(self):
+        """
+        Write every word on each fill and drop the shadow copy
+
+        """
+
+        self.write_shadow = None
+
+    def _fill_buffer(self, points, content_key=None):
+        """
+        Fill buffer specified by `self.addresses` with `points`, skipping axes not
+        sent by set_axes. With delta writes enabled only changed words are written,
+        and the command cache is not used.
+
+        Args:
+            points(dict/PointSet): Formatted point set, or a PointSet to format, to
+            fill with
+            content_key(str): Key of the content of `points` for the command cache,
+            e.g. from the readable point set they were formatted from; defaults to
+            the key of `points`
+
+        Raises:
+            IOError: Write failed
+
+        """
+
+        shadow = {}
+        if self.write_shadow is not None:
+            commands, shadow = self._delta_write_commands(points)
+        elif self.command_cache is None:
+            commands = self._buffer_write_commands(points)
+        else:
+            if content_key is None:
+                content_key = PmacCommandCache.content_key(points)
+            key = (content_key,
+                   tuple(sorted(self.addresses.iteritems())),
+                   None if self.active_axes is None else tuple(sorted(self.active_axes)))
+            commands = self.command_cache.get(key)
+            if commands is None:
+                commands = self._buffer_write_commands(points)
+                self.command_cache.put(key, commands)
+
+        # Pack the write commands into as few packets as possible
+        for _, success in self.sendCommands(commands):
+            if not success:
+                # Memory is unknown wherever this fill wrote
+                for address in shadow.iterkeys():
+                    self.write_shadow.pop(address, None)
+                raise IOError("Write failed")
+
+        if self.write_shadow is not None:
+            self.write_shadow.update(shadow)
+
+    def _buffer_write_commands(self, points):
+        """
+        Construct the commands to fill buffer specified by `self.addresses` with
+        `points`, skipping axes not sent by set_axes
+
+        Args:
+            points(dict/PointSet): Formatted point set, or a PointSet to format
+
+        Returns:
+            list(str): Write commands
+
+        Raises:
+            ValueError: Point set longer than buffer or axes of different lengths
+
+        """
+
+        commands = []
+        for axis_num, axis_points in self._active_buffer_points(points).iteritems():
+            commands.extend(self._construct_write_commands(
+                'L', self.addresses[axis_num], axis_points))
+
+        return commands
+
+    def _delta_write_commands(self, points):
+        """
+        Construct the commands to write the words of `points` that differ from
+        `self.write_shadow` into buffer specified by `self.addresses`, skipping axes
+        not sent by set_axes
+
+        Args:
+            points(dict/PointSet): Formatted point set, or a PointSet to format
+
+        Returns:
+            list(str): Write commands
+            dict: Word for each address written by the commands
+
+        Raises:
+            ValueError: Point set longer than buffer or axes of different lengths
+
+        """
+
+        commands = []
+        shadow = {}
+        for axis_num, axis_points in self._active_buffer_points(points).iteritems():
+            address = self.addresses[axis_num]
+            previous = [self.write_shadow.get(address + index)
+                        for index in range(len(axis_points))]
+            for start, end in self._changed_runs(previous, axis_points):
+                commands.extend(self._construct_write_commands(
+                    'L', address + start, axis_points[start:end]))
+                for index in range(start, end):
+                    shadow[address + index] = axis_points[index]
+
+        return commands, shadow
+
+    @staticmethod
+    def _changed_runs(previous, words, merge_length=9):
+        """
+        Find the runs of words that differ from the previous words. Runs separated by
+        unchanged words that take no more than `merge_length` characters to resend
+        are joined, as that is no longer than starting a new write command.
+
+        Args:
+            previous(list(str)): Previous word at each index, or None if unknown
+            words(list(str)): New words
+            merge_length(int): Characters of unchanged words to resend to join runs
+
+        Returns:
+            list(tuple(int, int)): Start and end index of each run to write
+
+        """
+
+        runs = []
+        gap = 0
+        for index, word in enumerate(words):
+            if previous[index] == word:
+                gap += 1 + len(word)
+            elif runs and gap <= merge_length:
+                runs[-1] = (runs[-1][0], index + 1)
+                gap = 0
+            else:
+                runs.append((index, index + 1))
+                gap = 0
+
+        return runs
+
+    def _active_buffer_points(self, points):
+        """
+        Format and check a point set and select the axes sent by set_axes
+
+        Args:
+            points(dict/PointSet): Formatted point set, or a PointSet to format
+
+        Returns:
+            dict: Formatted points of each active axis
+
+        Raises:
+            ValueError: Point set longer than buffer or axes of different lengths
+
+        """
+
+        if not isinstance(points, dict):
+            points = points.to_pmac_format()
+
         num_points = len(points['time'])
-        if num_points > int(self.buffer_length):
+        if num_points > self.buffer_length:
             raise ValueError("Point set cannot be longer than PMAC buffer length")
         for axis in points.itervalues():
             if axis and len(axis) != num_points:
                 raise ValueError("Point set must have equal points in all axes")
 
+        active_points = {}
         for axis_num, axis_points in points.iteritems():
-            address = self.addresses[axis_num]
-            while len(axis_points) > 0:
-                command_details = {'mode': 'L', 'address': address, 'points': axis_points}
-                response = self._construct_write_command_and_remove_used_points(
-                    command_details)
-
-                self.sendCommand(response['command'])
+            if self.is_axis_active(axis_num):
+                active_points[axis_num] = axis_points
 
-                address = self.add_dechex(address, response['num_sent'])
-                axis_points = response['points']
+        return active_points
 
     @staticmethod
-    def _construct_write_command_and_remove_used_points(command_details):
+    def _construct_write_commands(mode, address, points, max_length=255):
         """
-        Construct a command to send as many points as possible from the given set.
-        Length must be less than 255 characters
+        Construct commands to write `points` to consecutive addresses starting at
+        `address`, each sending as many points as possible without exceeding
+        `max_length` characters. `points` is not modified.
 
         Args:
-            command_details(dict): The write mode, address and point set to send
+            mode(str): The mode to write the data with e.g. X, Y, L
+            address(int): The address to write the first point to
+            points(list(str)): The formatted points to write
+            max_length(int): Maximum length of a command
+
+        Yields:
+            str: Write command e.g. WL$30000,$0,$0
+
+        Raises:
+            ValueError: A single point cannot fit in a command
 
-        Returns:
-            dict: The resulting command, the remaining point set and the number of
-            points sent
         """
 
-        command = 'W' + command_details['mode'] + '$' + command_details['address']
+        num_points = len(points)
+        start = 0
+        while start < num_points:
+            command = 'W{mode}${address:x}'.format(mode=mode, address=address + start)
 
-        point_num = 0
-        axis_points = command_details['points']
-        while len(axis_points) > 0 and len(command + ',' + axis_points[0]) <= 255:
-            command += ',' + axis_points.pop(0)
-            point_num += 1
+            length = len(command)
+            end = start
+            while end < num_points and length + 1 + len(points[end]) <= max_length:
+                length += 1 + len(points[end])
+                end += 1
 
-        response = {'command': command, 'points': axis_points, 'num_sent': point_num}
-        return response
+            if end == start:
+                raise ValueError("Point {point} is too long to write".format(
+                    point=points[start]))
+
+            yield command + ',' + ','.join(points[start:end])
+            start = end
 
     def set_idle_buffer_fill(self, fill_level):
         """
@@ -656,3 +1535,54 @@ class PmacTestHarness(PmacEthernetInterface):
         """
 
         return PmacTestHarness.add_dechex(hexdec, 1)
+
+    @staticmethod
+    def pmac_float_to_double(pmac_float):
+        """
+        Convert a value in the custom PMAC float format, as stored in 48-bit L
+        memory, back to a double. The inverse of
+        TrajectoryScanGenerator.double_to_pmac_float, except that negative values
+        come back 1 in the last place of the mantissa larger in magnitude.
+
+        Args:
+            pmac_float(str/int): Hex string e.g. $500000000803, or word
+
+        Returns:
+            float: Decoded value
+
+        """
+
+        if isinstance(pmac_float, str):
+            pmac_float = int(pmac_float.lstrip("$"), 16)
+        word = pmac_float & 0xFFFFFFFFFFFF
+
+        # Mantissa is a 36-bit two's complement value, exponent is offset by 0x800
+        mantissa = word >> 12
+        if mantissa & 0x800000000:
+            mantissa -= 0x1000000000
+        exponent = (word & 0xFFF) - 0x800
+
+        return mantissa * 2.0**(exponent - 34)
+
+    @staticmethod
+    def pmac_floats_to_doubles(words):
+        """
+        Convert an array of PMAC float words back to doubles in one vectorised pass,
+        giving the same result as `pmac_float_to_double` for each word
+
+        Args:
+            words(numpy.ndarray): PMAC float words as unsigned integers
+
+        Returns:
+            numpy.ndarray: Decoded values
+
+        """
+
+        words = numpy.asarray(words, dtype=numpy.uint64) & numpy.uint64(0xFFFFFFFFFFFF)
+
+        # Mantissa is a 36-bit two's complement value, exponent is offset by 0x800
+        mantissas = (words >> numpy.uint64(12)).astype(numpy.int64)
+        mantissas[mantissas >= 0x800000000] -= 0x1000000000
+        exponents = (words & numpy.uint64(0xFFF)).astype(numpy.int64) - 0x800
+
+        return numpy.ldexp(mantissas.astype(numpy.float64), exponents - 34)
@@ -0,0 +1,192 @@
+from TrajectoryScanGenerator import TrajectoryScanGenerator
+
+from pkg_resources import require
+require('numpy')
+import numpy
+
+
+class PointSet(object):
+    """
+    A columnar point set for the `trajectory_scan` motion program. Time values,
+    velocity modes and subroutines are held in one numpy array each and positions in
+    one array per axis, instead of a dict per time point and lists of floats. Slices
+    are views of the same arrays, so splitting a scan into buffers copies no points.
+
+    """
+
+    axis_names = ['a', 'b', 'c', 'u', 'v', 'w', 'x', 'y', 'z']
+
+    def __init__(self, time_val, vel_mode=None, subroutine=None, **axes):
+        """
+        Args:
+            time_val(numpy.ndarray): Move time of each point in 1/4s of a ms
+            vel_mode(numpy.ndarray): Velocity mode of each point; defaults to 0
+            subroutine(numpy.ndarray): Subroutine of each point; defaults to 0
+            axes(numpy.ndarray): Positions for each axis e.g. x=[...], y=[...]
+
+        Raises:
+            ValueError: Invalid axis or columns of different lengths
+
+        """
+
+        self.time_val = numpy.asarray(time_val, dtype=numpy.uint32)
+        num_points = len(self.time_val)
+
+        if vel_mode is None:
+            vel_mode = numpy.zeros(num_points, dtype=numpy.uint8)
+        if subroutine is None:
+            subroutine = numpy.zeros(num_points, dtype=numpy.uint8)
+        self.vel_mode = numpy.asarray(vel_mode, dtype=numpy.uint8)
+        self.subroutine = numpy.asarray(subroutine, dtype=numpy.uint8)
+
+        self.axes = {}
+        for axis, positions in axes.iteritems():
+            if axis not in self.axis_names:
+                raise ValueError("Invalid axis {axis}".format(axis=axis))
+            self.axes[axis] = numpy.asarray(positions, dtype=numpy.float64)
+
+        for column in [self.vel_mode, self.subroutine] + self.axes.values():
+            if len(column) != num_points:
+                raise ValueError("Point set must have equal points in all axes")
+
+    def __len__(self):
+        return len(self.time_val)
+
+    def __getitem__(self, index):
+        """
+        Get a view of a range of points
+
+        Args:
+            index(slice): Range of points
+
+        Returns:
+            PointSet: Point set sharing the columns of this one
+
+        Raises:
+            TypeError: Index is not a slice
+
+        """
+
+        if not isinstance(index, slice):
+            raise TypeError("PointSet indices must be slices")
+
+        axes = {}
+        for axis, positions in self.axes.iteritems():
+            axes[axis] = positions[index]
+
+        return PointSet(self.time_val[index], self.vel_mode[index],
+                        self.subroutine[index], **axes)
+
+    def buffers(self, buffer_length):
+        """
+        Split the point set into views of `buffer_length` points; the last may be
+        shorter
+
+        Args:
+            buffer_length(int): Number of points in each view
+
+        Yields:
+            PointSet: View of the next buffer of points
+
+        """
+
+        for start in range(0, len(self), buffer_length):
+            yield self[start:start + buffer_length]
+
+    @classmethod
+    def concatenate(cls, point_sets):
+        """
+        Join point sets with the same axes into a new point set
+
+        Args:
+            point_sets(list(PointSet)): Point sets to join
+
+        Returns:
+            PointSet: Joined point set
+
+        """
+
+        axes = {}
+        for axis in point_sets[0].axes.iterkeys():
+            axes[axis] = numpy.concatenate([points.axes[axis] for points in point_sets])
+
+        return cls(numpy.concatenate([points.time_val for points in point_sets]),
+                   numpy.concatenate([points.vel_mode for points in point_sets]),
+                   numpy.concatenate([points.subroutine for points in point_sets]),
+                   **axes)
+
+    @classmethod
+    def from_point_set(cls, point_set):
+        """
+        Create from a point set in the readable dict format
+
+        Args:
+            point_set(dict): Readable point set
+
+        Returns:
+            PointSet: Columnar point set
+
+        """
+
+        time_points = point_set['time']
+        axes = {}
+        for axis, positions in point_set.iteritems():
+            if axis != 'time' and len(positions) > 0:
+                axes[axis] = positions
+
+        return cls([point['time_val'] for point in time_points],
+                   [point['vel_mode'] for point in time_points],
+                   [point['subroutine'] for point in time_points], **axes)
+
+    def to_point_set(self):
+        """
+        Convert to the readable dict format
+
+        Returns:
+            dict: Readable point set
+
+        """
+
+        point_set = {'time': [{'time_val': time_val, 'vel_mode': vel_mode,
+                               'subroutine': subroutine}
+                              for time_val, vel_mode, subroutine in zip(
+                                  self.time_val.tolist(), self.vel_mode.tolist(),
+                                  self.subroutine.tolist())]}
+        for axis, positions in self.axes.iteritems():
+            point_set[axis] = positions.tolist()
+
+        return point_set
+
+    def time_words(self):
+        """
+        Pack time values, velocity modes and subroutines into time words
+
+        Returns:
+            numpy.ndarray: Time words as unsigned integers
+
+        Raises:
+            ValueError: Time value, velocity mode or subroutine out of range
+
+        """
+
+        return TrajectoryScanGenerator.pack_time_words(self.time_val, self.vel_mode,
+                                                       self.subroutine)
+
+    def to_pmac_format(self):
+        """
+        Format into Pmac required format
+
+        Returns:
+            dict: Formatted point set with the time sub-buffer and each axis
+
+        Raises:
+            ValueError: Time value, velocity mode or subroutine out of range, or
+            positions not finite or too large for a PMAC float
+
+        """
+
+        formatted_points = {'time': ["$%x" % word for word in self.time_words().tolist()]}
+        for axis, positions in self.axes.iteritems():
+            formatted_points[axis] = TrajectoryScanGenerator.doubles_to_pmac_floats(positions)
+
+        return formatted_points
@@ -0,0 +1,120 @@
+class SwapScheduler(object):
+    """
+    Predicts when the pmac will reach the end of the current half-buffer from the
+    time values of its points and the observed CurrentIndex, and plans each refill of
+    the idle half-buffer against that deadline. The rate at which the pmac works
+    through move time is measured from successive observations, so the prediction
+    follows feed rate changes, and the time taken by recent writes is used to tell
+    when a refill is at risk of missing the swap.
+
+    """
+
+    def __init__(self, smoothing=0.5, safety_margin=0.0):
+        """
+        Args:
+            smoothing(float): Weight of each new measurement of consumption rate and
+            write time, between 0 and 1
+            safety_margin(float): Time in seconds a refill should finish before the
+            swap for it to not be at risk
+
+        """
+
+        self.smoothing = smoothing
+        self.safety_margin = safety_margin
+
+        self.rate = 1.0  # Seconds taken per second of move time
+        self.write_time = None  # Expected time in seconds to refill a half-buffer
+        self.swap_time = None  # Predicted time the current half-buffer ends
+        self.deadline = None  # Time the refill being planned must finish by
+        self._last_observation = None  # Time, buffer and move time consumed
+
+    def observe(self, now, current_buffer, current_index, time_vals):
+        """
+        Update the predicted end of the current half-buffer from a status poll
+
+        Args:
+            now(float): Time the status was read
+            current_buffer(int): Specifier for the current half-buffer
+            current_index(int): Index of the current point in the half-buffer
+            time_vals(list(int)): Time value of each point in the current half-buffer,
+            in 1/4s of a ms
+
+        Returns:
+            float: Predicted time the current half-buffer ends
+
+        """
+
+        # Divide by 4000 to convert time values from 1/4s of a ms to s
+        consumed = sum(time_vals[:current_index]) / 4000.0
+        remaining = sum(time_vals[current_index:]) / 4000.0
+
+        if self._last_observation is not None:
+            last_time, last_buffer, last_consumed = self._last_observation
+            if last_buffer == current_buffer and consumed > last_consumed:
+                rate = (now - last_time) / (consumed - last_consumed)
+                self.rate += self.smoothing*(rate - self.rate)
+        self._last_observation = (now, current_buffer, consumed)
+
+        self.swap_time = now + remaining*self.rate
+
+        return self.swap_time
+
+    def time_to_swap(self, now):
+        """
+        Get the predicted time left until the current half-buffer ends
+
+        Args:
+            now(float): Current time
+
+        Returns:
+            float: Time in seconds, or None if nothing has been observed
+
+        """
+
+        if self.swap_time is None:
+            return None
+
+        return max(self.swap_time - now, 0.0)
+
+    def plan_write(self, now):
+        """
+        Plan a refill of the idle half-buffer starting now, with a deadline at the
+        predicted end of the current half-buffer
+
+        Args:
+            now(float): Time the write starts
+
+        Returns:
+            dict: Deadline, expected write time and whether the write is expected
+            to finish less than `safety_margin` before the deadline
+
+        """
+
+        self.deadline = self.swap_time
+        at_risk = False
+        if self.deadline is not None and self.write_time is not None:
+            at_risk = now + self.write_time > self.deadline - self.safety_margin
+
+        return {'deadline': self.deadline, 'expected_write_time': self.write_time,
+                'at_risk': at_risk}
+
+    def record_write(self, start, end):
+        """
+        Record the time taken by a refill and check it against its deadline
+
+        Args:
+            start(float): Time the write started
+            end(float): Time the write finished
+
+        Returns:
+            bool: True if the write finished after the deadline
+
+        """
+
+        write_time = end - start
+        if self.write_time is None:
+            self.write_time = write_time
+        else:
+            self.write_time += self.smoothing*(write_time - self.write_time)
+
+        return self.deadline is not None and end > self.deadline
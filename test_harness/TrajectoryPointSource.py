@@ -0,0 +1,102 @@
+import itertools
+
+from TrajectoryScanGenerator import TrajectoryScanGenerator
+
+
+class TrajectoryPointSource(object):
+    """
+    A lazy source of points for trajectory scans of any length. Points are taken from
+    a CompoundGenerator one buffer at a time, so memory use stays constant however
+    long the scan is. The chunks can be passed straight to TrajectoryStreamer.
+
+    """
+
+    def __init__(self, generator, move_time, point_modes=None):
+        """
+        Args:
+            generator(CompoundGenerator): Generator for the scan points
+            move_time(int): Move time between points
+            point_modes(function): Called with the index and Point of each point to
+            get its velocity mode and subroutine; defaults to 0 for both
+
+        """
+
+        self.generator = generator
+        self.move_time = move_time
+        self.point_modes = point_modes
+        self.num_points = generator.num
+
+    @classmethod
+    def snake_scan(cls, trajectory):
+        """
+        Create a source for a snake trajectory scan, with the same points as
+        TrajectoryScanGenerator.generate_snake_scan
+
+        Args:
+            trajectory(dict): A dictionary containing the move_time, width & length of
+            the snake_scan area and direction (not implemented yet)
+
+        Returns:
+            TrajectoryPointSource: Source for the scan
+
+        """
+
+        gen, step, width = TrajectoryScanGenerator.snake_scan_generator(trajectory)
+
+        def point_modes(index, point):
+            return TrajectoryScanGenerator.snake_point_modes(index, point, step, width)
+
+        return cls(gen, trajectory['move_time'], point_modes)
+
+    def readable_chunks(self, buffer_length):
+        """
+        Generate point sets of `buffer_length` points in readable format; the last
+        may be shorter
+
+        Args:
+            buffer_length(int): Number of points in each chunk
+
+        Yields:
+            dict: Point set
+
+        """
+
+        points = enumerate(self.generator.iterator())
+        axes = self.generator.axes
+        while True:
+            chunk = {'time': []}
+            for axis in axes:
+                chunk[axis] = []
+
+            for index, point in itertools.islice(points, buffer_length):
+                if self.point_modes is None:
+                    vel_mode, subroutine = 0, 0
+                else:
+                    vel_mode, subroutine = self.point_modes(index, point)
+                chunk['time'].append({'time_val': self.move_time, 'vel_mode': vel_mode,
+                                      'subroutine': subroutine})
+                for axis in axes:
+                    chunk[axis].append(point.positions[axis])
+
+            if len(chunk['time']) == 0:
+                return
+            yield chunk
+
+    def chunks(self, buffer_length):
+        """
+        Generate point sets of `buffer_length` points in Pmac required format; the
+        last may be shorter
+
+        Args:
+            buffer_length(int): Number of points in each chunk
+
+        Yields:
+            dict: Formatted point set
+
+        """
+
+        for chunk in self.readable_chunks(buffer_length):
+            scan = TrajectoryScanGenerator()
+            scan.point_set = chunk
+            scan.format_point_set()
+            yield scan.point_set
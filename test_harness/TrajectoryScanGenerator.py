@@ -7,6 +7,9 @@ import numpy
 
 
 class TrajectoryScanGenerator(object):
+
+    # Values of this magnitude and over overflow the 36-bit PMAC float mantissa
+    max_pmac_float = 2.0**36
     """
     A class to generate and manipulate point sets for the PmacTestHarness to perform
     trajectory scans
@@ -42,6 +45,32 @@ class TrajectoryScanGenerator(object):
         """
 
         move_time = trajectory['move_time']
+        gen, step, width = self.snake_scan_generator(trajectory)
+
+        self.point_set = {'time': [], 'x': [], 'y': []}
+
+        for i, point in enumerate(gen.iterator()):
+            vel_mode, subroutine = self.snake_point_modes(i, point, step, width)
+            self.point_set['time'].append({'time_val': move_time, 'vel_mode': vel_mode, 'subroutine': subroutine})
+            self.point_set['x'].append(point.positions['x'])
+            self.point_set['y'].append(point.positions['y'])
+
+    @staticmethod
+    def snake_scan_generator(trajectory):
+        """
+        Create the CompoundGenerator for a snake trajectory scan
+
+        Args:
+            trajectory(dict): A dictionary containing the move_time, width & length of
+            the snake_scan area and direction (not implemented yet)
+
+        Returns:
+            CompoundGenerator: Generator for the scan points
+            int: Step between points in a row
+            int: Number of points in a row
+
+        """
+
         start = trajectory['start']
         stop = trajectory['stop']
         num = trajectory['num']
@@ -50,8 +79,6 @@ class TrajectoryScanGenerator(object):
         step = int(stop[0] - start[0]) / (num[0] - 1)
         width = (int(stop[0] - start[0]) / step) + 1
 
-        self.point_set = {'time': [], 'x': [], 'y': []}
-
         if direction == 0:
             xs = LineGenerator("x", "mm", start[0], stop[0], num[0],
                                alternate_direction=True)
@@ -60,32 +87,41 @@ class TrajectoryScanGenerator(object):
         else:
             raise NotImplementedError("Reverse not implemented")
 
-        for point in gen.iterator():
-            self.point_set['x'].append(point.positions['x'])
-        for point in gen.iterator():
-            self.point_set['y'].append(point.positions['y'])
+        return gen, step, width
 
-        trigger = 0
-        for i, point in enumerate(self.point_set['x']):
+    @staticmethod
+    def snake_point_modes(index, point, step, width):
+        """
+        Calculate the velocity mode and trigger subroutine of a snake scan point, to
+        set dynamic velocity at turnarounds and toggle the trigger along each row
 
-            if (i+1) % width == 0 and i > 0:
-                vel_mode = 1
-            elif i % width == 0 and i > 0:
-                vel_mode = 2
-            else:
-                vel_mode = 0
+        Args:
+            index(int): Index of point in scan
+            point(Point): Point from snake scan generator
+            step(int): Step between points in a row
+            width(int): Number of points in a row
 
-            if i % width == 0:
-                subroutine = 0
-            else:
-                if (point/step) % 2 == 0 or (i+1) % width == 0:
-                    subroutine = 2
-                    trigger = 0
-                else:
-                    subroutine = 1
-                    trigger = 1
+        Returns:
+            int: Velocity mode
+            int: Subroutine
 
-            self.point_set['time'].append({'time_val': move_time, 'vel_mode': vel_mode, 'subroutine': subroutine})
+        """
+
+        if (index+1) % width == 0 and index > 0:
+            vel_mode = 1
+        elif index % width == 0 and index > 0:
+            vel_mode = 2
+        else:
+            vel_mode = 0
+
+        if index % width == 0:
+            subroutine = 0
+        elif (point.positions['x']/step) % 2 == 0 or (index+1) % width == 0:
+            subroutine = 2
+        else:
+            subroutine = 1
+
+        return vel_mode, subroutine
 
     def generate_circle_points(self, move_time, num_points):
         """
@@ -189,30 +225,146 @@ class TrajectoryScanGenerator(object):
 
         """
 
-        for axis, axis_points in self.point_set.iteritems():
+        move_times, axes = self._point_set_columns(self.point_set)
+        violations = self._velocity_violations(move_times, axes, cs)
+        if violations:
+            violation = min(violations, key=lambda violation: violation['index'])
+            raise ValueError(
+                "Points set will exceed maximum velocity, {max_vel}, for axis {axis}: {vel}"
+                "".format(axis=violation['axis'], max_vel=violation['max'],
+                          vel=violation['value']))
 
-            if axis_points and axis != 'time':
+        return True
 
-                for point_num in range(1, len(axis_points)):
-                    next_point = float(axis_points[point_num])
-                    prev_point = float(axis_points[point_num - 1])
-                    # Divide by 4 to convert time values from 1/4s of a ms to ms
-                    move_time = float(self.point_set['time'][point_num]['time_val']) / 4
+    def check_limits_of_points(self, cs):
+        """
+        Check the velocity and acceleration of every axis between every point of the
+        current point set against the limits of the given coordinate system, in both
+        directions. Acceleration is only checked for axes with a maximum acceleration
+        set.
 
-                    velocity = (next_point - prev_point)/move_time
-                    if velocity > cs.max_velocities[axis]:
-                        raise ValueError(
-                            "Points set will exceed maximum velocity, {max_vel}, for axis {axis}: {vel}"
-                            "".format(axis=axis, max_vel=cs.max_velocities[axis], vel=velocity))
+        Args:
+            cs(PmacCoordinateSystem.PmacCoordinateSystem): CS instance with
+            max_velocities and max_accelerations stored
 
-        return True
+        Returns:
+            list(dict): Each violation, in order of point index, with its index, axis,
+            limit ('velocity' or 'acceleration'), value and max
+
+        """
+
+        move_times, axes = self._point_set_columns(self.point_set)
+        violations = self._velocity_violations(move_times, axes, cs) + \
+            self._acceleration_violations(move_times, axes, cs)
+
+        return sorted(violations, key=lambda violation: (violation['index'],
+                                                         violation['axis']))
+
+    @staticmethod
+    def _point_set_columns(point_set):
+        """
+        Get the move times and positions of a readable point set or PointSet as arrays
+
+        Args:
+            point_set(dict/PointSet): Point set
+
+        Returns:
+            numpy.ndarray: Move time of each point in ms
+            dict: Positions array for each axis with points
+
+        """
+
+        if isinstance(point_set, dict):
+            time_points = point_set['time']
+            time_vals = numpy.fromiter((point['time_val'] for point in time_points),
+                                       numpy.float64, len(time_points))
+            axes = {}
+            for axis, axis_points in point_set.iteritems():
+                if axis_points and axis != 'time':
+                    axes[axis] = numpy.asarray(axis_points, dtype=numpy.float64)
+        else:
+            time_vals = point_set.time_val.astype(numpy.float64)
+            axes = point_set.axes
+
+        # Divide by 4 to convert time values from 1/4s of a ms to ms
+        return time_vals / 4, axes
+
+    @staticmethod
+    def _velocity_violations(move_times, axes, cs):
+        """
+        Find moves faster than the maximum velocity of their axis
+
+        Args:
+            move_times(numpy.ndarray): Move time of each point in ms
+            axes(dict): Positions array for each axis
+            cs(PmacCoordinateSystem.PmacCoordinateSystem): CS instance with
+            max_velocities stored
+
+        Returns:
+            list(dict): Violations, indexed by the point at the end of the move
+
+        """
+
+        violations = []
+        for axis, positions in axes.iteritems():
+            max_velocity = cs.max_velocities[axis]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                velocities = numpy.diff(positions) / move_times[1:]
+
+            for index in numpy.flatnonzero(~(numpy.abs(velocities) <= max_velocity)):
+                violations.append({'index': int(index) + 1, 'axis': axis,
+                                   'limit': 'velocity', 'value': float(velocities[index]),
+                                   'max': max_velocity})
+
+        return violations
+
+    @staticmethod
+    def _acceleration_violations(move_times, axes, cs):
+        """
+        Find points where the change in velocity between the moves either side is
+        greater than the maximum acceleration of their axis allows
+
+        Args:
+            move_times(numpy.ndarray): Move time of each point in ms
+            axes(dict): Positions array for each axis
+            cs(PmacCoordinateSystem.PmacCoordinateSystem): CS instance with
+            max_accelerations stored
+
+        Returns:
+            list(dict): Violations, indexed by the point between the two moves
+
+        """
+
+        violations = []
+        for axis, positions in axes.iteritems():
+            max_acceleration = cs.max_accelerations.get(axis, 0)
+            if max_acceleration <= 0:
+                continue
+
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                velocities = numpy.diff(positions) / move_times[1:]
+                # Velocity changes over half of each of the moves either side of a point
+                accelerations = numpy.diff(velocities) / \
+                    ((move_times[1:-1] + move_times[2:]) / 2)
+
+            for index in numpy.flatnonzero(~(numpy.abs(accelerations) <= max_acceleration)):
+                violations.append({'index': int(index) + 1, 'axis': axis,
+                                   'limit': 'acceleration',
+                                   'value': float(accelerations[index]),
+                                   'max': max_acceleration})
+
+        return violations
 
     def format_point_set(self):
         """
-        Format readable point set into Pmac required format
+        Format readable point set, or a PointSet, into Pmac required format
 
         """
 
+        if not isinstance(self.point_set, dict):
+            self.point_set = self.point_set.to_pmac_format()
+            return
+
         formatted_points = {'time': [],
                             'x': [], 'y': [], 'z': [],
                             'u': [], 'v': [], 'w': [],
@@ -220,37 +372,44 @@ class TrajectoryScanGenerator(object):
 
         for axis, axis_points in self.point_set.iteritems():
             if axis == 'time':
-                for point in axis_points:
-                    time_point = "$" + hex(point['time_val'])[2:]
-
-                    if point['subroutine'] > 0:
-                        time_point = self.set_point_subroutine(time_point, point['subroutine'])
-
-                    if point['vel_mode'] > 0:
-                        time_point = self.set_point_vel_mode(time_point, point['vel_mode'])
-
-                    formatted_points['time'].append(time_point)
+                num_points = len(axis_points)
+                time_words = self.pack_time_words(
+                    numpy.fromiter((point['time_val'] for point in axis_points),
+                                   numpy.int64, num_points),
+                    numpy.fromiter((point['vel_mode'] for point in axis_points),
+                                   numpy.int64, num_points),
+                    numpy.fromiter((point['subroutine'] for point in axis_points),
+                                   numpy.int64, num_points))
+                formatted_points['time'] = ["$%x" % word for word in time_words.tolist()]
             else:
-                for point in axis_points:
-                    formatted_points[axis].append(self.double_to_pmac_float(point))
+                formatted_points[axis] = self.doubles_to_pmac_floats(axis_points)
 
         self.point_set = formatted_points
 
     def grab_buffer_of_points(self, start, length):
         """
-        Grab a buffer of points from a point set in self that is longer than the buffer
+        Grab a buffer of points from a point set in self that is longer than the buffer.
+        If the point set is a PointSet, the points are a view unless they wrap around.
 
         Args:
             start(int): Point to start in buffer
             length(int): Length of buffer to fill (number of points)
 
         Returns:
-            dict: Grabbed point set
+            dict/PointSet: Grabbed point set
             int: Last point grabbed from set
 
         """
 
         end = start + length
+        if not isinstance(self.point_set, dict):
+            num_points = len(self.point_set)
+            if end < num_points:
+                return self.point_set[start:end], end
+            end -= num_points
+            return self.point_set.concatenate([self.point_set[start:],
+                                               self.point_set[:end]]), end
+
         num_points = len(self.point_set['time'])
         points_grab = {'time': [], 'x': [], 'y': []}
 
@@ -276,11 +435,24 @@ class TrajectoryScanGenerator(object):
             length(int): Length of buffer to fill (number of points)
 
         Returns:
-            dict: Generated point set
+            dict/PointSet: Generated point set
             int: Last point grabbed from set
 
         """
 
+        if not isinstance(self.point_set, dict):
+            num_points = len(self.point_set)
+            parts = []
+            generated = 0
+            while generated + num_points < length:
+                parts.append(self.point_set[start:])
+                generated += num_points - start
+                start = 0
+
+            end = length - generated
+            parts.append(self.point_set[:end])
+            return self.point_set.concatenate(parts), end
+
         num_points = len(self.point_set['time'])
         points_gen = {}
         for axis in self.point_set.iterkeys():
@@ -315,8 +487,7 @@ class TrajectoryScanGenerator(object):
 
         for axis, axis_points in points.iteritems():
             if axis != 'time':
-                for point in axis_points:
-                    pmac_points[axis].append(self.double_to_pmac_float(point))
+                pmac_points[axis] = self.doubles_to_pmac_floats(axis_points)
 
         return pmac_points
 
@@ -330,8 +501,14 @@ class TrajectoryScanGenerator(object):
 
         Returns:
             str: PMAC hex format of `value`
+
+        Raises:
+            ValueError: Value not finite or too large for a PMAC float
         """
 
+        if not abs(value) < TrajectoryScanGenerator.max_pmac_float:
+            raise ValueError("Values must be finite and less than 2**36 in magnitude")
+
         if value == value*10:
             return '$0'
 
@@ -372,6 +549,99 @@ class TrajectoryScanGenerator(object):
         # Convert decimal representation to string of hex representation.
         return "$" + str(hex(pmac_float))[2:]
 
+    @staticmethod
+    def doubles_to_pmac_float_words(values):
+        """
+        Convert an array of values to the custom PMAC float format in one vectorised
+        pass, giving the same result as `double_to_pmac_float` for each value
+
+        Args:
+            values(numpy.ndarray): Values to convert
+
+        Returns:
+            numpy.ndarray: PMAC float words of `values` as unsigned integers
+
+        Raises:
+            ValueError: Values not finite or too large for a PMAC float
+
+        """
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if not numpy.all(numpy.isfinite(values)):
+            raise ValueError("Values must be finite")
+        if numpy.any(numpy.abs(values) >= TrajectoryScanGenerator.max_pmac_float):
+            raise ValueError("Values must be less than 2**36 in magnitude")
+
+        magnitudes = numpy.abs(values)
+        # frexp normalises between 0.5 and 1, so subtract 1 to normalise between 1 and 2
+        exponents = numpy.frexp(magnitudes)[1].astype(numpy.int64) - 1
+
+        # Bit shift mantissa to maximum precision; values of 2**35 and over are only
+        # halved, as in the scalar conversion
+        shifts = numpy.maximum(34 - exponents, -1)
+        mantissas = numpy.ldexp(magnitudes, shifts).astype(numpy.int64)
+
+        # To make value negative, subtract value from max
+        mantissas = numpy.where(values < 0.0, 0xFFFFFFFFFFF - mantissas, mantissas)
+
+        # Bit shift mantissa to correct location, then add offset exponent to end
+        words = (mantissas << 12) + (exponents + 0x800)
+        words[values == 0.0] = 0
+
+        return words.astype(numpy.uint64)
+
+    @classmethod
+    def doubles_to_pmac_floats(cls, values):
+        """
+        Convert an array of values to PMAC hex format strings with
+        `doubles_to_pmac_float_words`
+
+        Args:
+            values(numpy.ndarray): Values to convert
+
+        Returns:
+            list(str): PMAC hex format of `values`
+
+        """
+
+        return ["$%x" % word for word in cls.doubles_to_pmac_float_words(values).tolist()]
+
+    @staticmethod
+    def pack_time_words(time_vals, vel_modes, subroutines):
+        """
+        Pack arrays of time values, velocity modes and subroutines into time words in
+        one vectorised pass, giving the same result as `set_point_subroutine` and
+        `set_point_vel_mode` for each point
+
+        Args:
+            time_vals(numpy.ndarray): Move times in 1/4s of a ms
+            vel_modes(numpy.ndarray): Velocity modes; 0, 1 or 2
+            subroutines(numpy.ndarray): Subroutines; 0 for none or 1-14
+
+        Returns:
+            numpy.ndarray: Time words as unsigned integers
+
+        Raises:
+            ValueError: Time value, velocity mode or subroutine out of range
+
+        """
+
+        time_vals = numpy.asarray(time_vals, dtype=numpy.int64)
+        vel_modes = numpy.asarray(vel_modes, dtype=numpy.int64)
+        subroutines = numpy.asarray(subroutines, dtype=numpy.int64)
+
+        if numpy.any((time_vals < 0) | (time_vals > 0xFFFFFF)):
+            raise ValueError("Time value must be in range 0 - 16777215")
+        if numpy.any((vel_modes < 0) | (vel_modes > 2)):
+            raise ValueError("Velocity mode must be 0, 1 or 2")
+        if numpy.any((subroutines < 0) | (subroutines > 14)):
+            raise ValueError("Subroutine must be in range 1 - 15")
+
+        # Velocity mode is set in bits 28+ and subroutine in bits 24+
+        words = time_vals | (subroutines << 24) | (vel_modes << 28)
+
+        return words.astype(numpy.uint64)
+
     @staticmethod
     def set_point_vel_mode(coord, velocity_mode):
         """
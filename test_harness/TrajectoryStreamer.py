@@ -0,0 +1,302 @@
+import threading
+import time
+import Queue
+
+from PmacCommandCache import PmacCommandCache
+from PmacStatus import PmacStatus
+from SwapScheduler import SwapScheduler
+from TrajectoryScanGenerator import TrajectoryScanGenerator
+
+
+class TrajectoryStreamer(object):
+    """
+    A helper class for PmacTestHarness to stream a scan of any length through the
+    `trajectory_scan` half-buffers. The next chunk of points is encoded on a worker
+    thread while the PMAC scans through the current half-buffer, so it can be written
+    to the idle half-buffer as soon as CurrentBuffer flips. If the pmac caches write
+    commands, the worker also keys each chunk by its readable content, so a fill
+    with a looped point set sends the cached commands. A SwapScheduler predicts
+    when each half-buffer will run out, to time the status polls and to flag refills
+    that miss the swap.
+
+    """
+
+    def __init__(self, pmac, chunks, poll_period=0.1, swap_callback=None,
+                 min_poll_period=0.001, scheduler=None):
+        """
+        Args:
+            pmac(PmacTestHarness): Connected pmac to stream points to
+            chunks(iterable(dict)): Point sets in readable format, each no longer
+            than the buffer length
+            poll_period(float): Longest time in seconds to wait between status polls
+            swap_callback(function): Called with the report of each buffer swap
+            min_poll_period(float): Shortest time in seconds to wait between status
+            polls, used as the next buffer swap approaches
+            scheduler(SwapScheduler): Predicts buffer swaps; defaults to a new
+            SwapScheduler
+
+        """
+
+        self.pmac = pmac
+        self.chunks = iter(chunks)
+        self.poll_period = poll_period
+        self.min_poll_period = min_poll_period
+        self.scheduler = scheduler or SwapScheduler()
+        self.swap_callback = swap_callback
+
+        self.swaps = []  # Report for each buffer swap
+
+        self._queue = Queue.Queue(maxsize=1)
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._encode_chunks)
+        self._worker.daemon = True
+
+    @staticmethod
+    def encode_points(points):
+        """
+        Format a readable point set into Pmac required format
+
+        Args:
+            points(dict): Point set to format
+
+        Returns:
+            dict: Formatted point set
+
+        """
+
+        scan = TrajectoryScanGenerator()
+        scan.point_set = points
+        scan.format_point_set()
+
+        return scan.point_set
+
+    def _encode_chunks(self):
+        """
+        Encode chunks ahead of time on the worker thread and queue them for the
+        streaming loop, followed by None when the chunks run out. With a command
+        cache the key of each chunk is queued too.
+
+        """
+
+        try:
+            for chunk in self.chunks:
+                if self.pmac.command_cache is None:
+                    content_key = None
+                else:
+                    content_key = PmacCommandCache.content_key(chunk)
+                if not self._put((chunk, self.encode_points(chunk), content_key)):
+                    return
+        except Exception as error:
+            self._put(error)
+            return
+
+        self._put(None)
+
+    def _put(self, item):
+        """
+        Queue an item, giving up if the stream is stopped
+
+        Args:
+            item: Item to queue
+
+        Returns:
+            bool: True if the item was queued
+
+        """
+
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=self.poll_period)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def _next_chunk(self):
+        """
+        Get the next encoded chunk from the worker thread
+
+        Returns:
+            tuple(dict, dict, str): Readable and encoded point sets and the command
+            cache key of the chunk, or None if there are no chunks left
+
+        Raises:
+            Exception: Any error raised while generating or encoding points
+
+        """
+
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+
+        return item
+
+    def run(self, program_num, cs_number):
+        """
+        Fill the current half-buffer, run the motion program and then keep the idle
+        half-buffer filled until the chunks run out and the program finishes
+
+        Args:
+            program_num(int): Number of motion program to run
+            cs_number(int): Coordinate system to run motion program in
+
+        Returns:
+            list(dict): Report of each buffer swap
+
+        """
+
+        self._worker.start()
+        try:
+            self._stream(program_num, cs_number)
+        finally:
+            self._stop.set()
+
+        return self.swaps
+
+    def _stream(self, program_num, cs_number):
+        """
+        Carry out the streaming loop
+
+        Args:
+            program_num(int): Number of motion program to run
+            cs_number(int): Coordinate system to run motion program in
+
+        """
+
+        chunk = self._next_chunk()
+        if chunk is None:
+            return
+        buffers = {}  # Readable points stored in each half-buffer
+
+        buffers[self.pmac.current_buffer] = chunk[0]
+        self.pmac.fill_current_buffer(chunk[1], chunk[2])
+        self.pmac.set_current_buffer_fill(len(chunk[0]['time']))
+        self.pmac.prev_buffer_write = 0
+
+        self.pmac.run_motion_program(program_num, cs_number)
+        self.pmac.update_status_variables()
+
+        exhausted = False
+        while self.pmac.status == 1:
+            if not exhausted and self.pmac.current_buffer == self.pmac.prev_buffer_write:
+                write_start = time.time()
+                current_buffer = self.pmac.current_buffer
+                idle_buffer = 1 - current_buffer
+
+                chunk = self._next_chunk()
+                if chunk is None:
+                    # Let the PMAC finish the scan at the end of the current half-buffer
+                    exhausted = True
+                    self.pmac.set_idle_buffer_fill(0)
+                    continue
+
+                # The refill must finish before the current half-buffer runs out
+                self._observe(buffers.get(current_buffer))
+                plan = self.scheduler.plan_write(write_start)
+
+                buffers[idle_buffer] = chunk[0]
+                self.pmac.fill_idle_buffer(chunk[1], chunk[2])
+                self.pmac.set_idle_buffer_fill(len(chunk[0]['time']))
+                self.pmac.prev_buffer_write = idle_buffer
+
+                self.pmac.update_status_variables()
+                self._report_swap(idle_buffer, write_start, time.time(),
+                                  buffers.get(current_buffer), current_buffer, plan)
+            else:
+                time.sleep(self._poll_delay(buffers.get(self.pmac.current_buffer)))
+                self.pmac.update_status_variables()
+
+    @staticmethod
+    def _time_vals(points):
+        """
+        Get the time value of each point of a readable point set
+
+        Args:
+            points(dict): Readable point set
+
+        Returns:
+            list(int): Time values in 1/4s of a ms
+
+        """
+
+        return [point['time_val'] for point in points['time']]
+
+    def _observe(self, current_points):
+        """
+        Pass the position in the current half-buffer from the last status snapshot
+        to the scheduler, at the time the snapshot was read
+
+        Args:
+            current_points(dict): Readable points in the current half-buffer, or None
+            if unknown
+
+        """
+
+        snapshot = self.pmac.status_snapshot
+        if current_points is not None and snapshot is not None:
+            self.scheduler.observe(snapshot.timestamp, snapshot.current_buffer,
+                                   snapshot.current_index, self._time_vals(current_points))
+
+    def _poll_delay(self, current_points):
+        """
+        Get the time to wait before the next status poll, shorter the closer the
+        predicted buffer swap is
+
+        Args:
+            current_points(dict): Readable points in the current half-buffer, or None
+            if unknown
+
+        Returns:
+            float: Time in seconds
+
+        """
+
+        if current_points is None:
+            return self.poll_period
+
+        self._observe(current_points)
+
+        return PmacStatus.adaptive_delay(self.scheduler.time_to_swap(time.time()),
+                                         self.min_poll_period, self.poll_period)
+
+    def _report_swap(self, written_buffer, write_start, write_end, current_points,
+                     current_buffer, plan):
+        """
+        Record how much of the current half-buffer was left when the idle half-buffer
+        write finished, and whether the write finished before the predicted swap
+
+        Args:
+            written_buffer(int): Specifier for the half-buffer written
+            write_start(float): Time the write of the idle half-buffer started
+            write_end(float): Time the write of the idle half-buffer finished
+            current_points(dict): Readable points in the current half-buffer
+            current_buffer(int): Specifier for the half-buffer that was current when
+            the write started
+            plan(dict): Plan for the write from the scheduler
+
+        """
+
+        underrun = self.pmac.status != 1 or self.pmac.current_buffer != current_buffer
+        if underrun or current_points is None:
+            margin_points = 0
+            margin_time = 0.0
+        else:
+            margin_points = len(current_points['time'][self.pmac.current_index:])
+            margin_time = self.pmac.status_snapshot.seconds_to_swap(
+                self._time_vals(current_points))
+
+        deadline_missed = self.scheduler.record_write(write_start, write_end) or underrun
+
+        report = {'buffer': "AB"[written_buffer],
+                  'write_time': write_end - write_start,
+                  'margin_points': margin_points,
+                  'margin_time': margin_time,
+                  'underrun': underrun,
+                  'expected_write_time': plan['expected_write_time'],
+                  'at_risk': plan['at_risk'],
+                  'deadline_missed': deadline_missed}
+        self.swaps.append(report)
+
+        if self.swap_callback is not None:
+            self.swap_callback(report)
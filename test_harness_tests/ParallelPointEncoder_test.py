@@ -0,0 +1,67 @@
+from test_harness.ParallelPointEncoder import ParallelPointEncoder
+from test_harness.PointSet import PointSet
+from test_harness.TrajectoryScanGenerator import TrajectoryScanGenerator
+import unittest
+
+from pkg_resources import require
+require("mock")
+from mock import patch
+
+require('numpy')
+import numpy
+
+
+class FormatPointSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = ParallelPointEncoder(processes=2, shard_size=10)
+        self.points = PointSet(numpy.arange(1, 46), vel_mode=[1, 0, 2]*15,
+                               subroutine=[0, 14, 3]*15,
+                               x=numpy.linspace(-10.0, 10.0, 45),
+                               y=numpy.random.uniform(-1e6, 1e6, 45))
+
+    def test_given_point_set_then_match_serial_format(self):
+        formatted = self.encoder.format_point_set(self.points)
+
+        self.assertEqual(self.points.to_pmac_format(), formatted)
+
+    def test_given_readable_point_set_then_format(self):
+        point_set = self.points[:12].to_point_set()
+
+        formatted = self.encoder.format_point_set(point_set)
+
+        self.assertEqual(self.points[:12].to_pmac_format(), formatted)
+
+    def test_given_values_at_limit_then_match_scalar_conversion(self):
+        limit = numpy.nextafter(TrajectoryScanGenerator.max_pmac_float, 0)
+        self.points.axes['x'][::2] = -limit
+        self.points.axes['x'][1::2] = limit
+
+        formatted = self.encoder.format_point_set(self.points)
+
+        self.assertEqual([TrajectoryScanGenerator.double_to_pmac_float(value)
+                          for value in self.points.axes['x'].tolist()], formatted['x'])
+
+    def test_given_value_too_large_then_error(self):
+        self.points.axes['y'][30] = 1e20
+
+        with self.assertRaises(ValueError) as error:
+            self.encoder.format_point_set(self.points)
+
+        self.assertEqual("Values must be less than 2**36 in magnitude",
+                         error.exception.message)
+
+    def test_given_invalid_points_then_error(self):
+        self.points.vel_mode[30] = 3
+
+        with self.assertRaises(ValueError) as error:
+            self.encoder.format_point_set(self.points)
+
+        self.assertEqual("Velocity mode must be 0, 1 or 2", error.exception.message)
+
+    @patch('multiprocessing.Pool')
+    def test_given_small_point_set_then_format_in_process(self, pool_mock):
+        formatted = self.encoder.format_point_set(self.points[:10])
+
+        self.assertFalse(pool_mock.called)
+        self.assertEqual(self.points[:10].to_pmac_format(), formatted)
@@ -0,0 +1,70 @@
+from test_harness.PmacCommandCache import PmacCommandCache
+from test_harness.PointSet import PointSet
+import unittest
+
+
+class ContentKeyTest(unittest.TestCase):
+
+    def test_given_equal_point_sets_then_equal_keys(self):
+        points = PointSet([500, 500], vel_mode=[1, 0], x=[10.0, 10.0])
+        looped = PointSet.concatenate([points, points])
+
+        self.assertEqual(PmacCommandCache.content_key(points),
+                         PmacCommandCache.content_key(looped[2:]))
+
+    def test_given_different_point_sets_then_different_keys(self):
+        points = PointSet([500, 500], x=[10.0, 10.0])
+        moved = PointSet([500, 500], x=[10.0, 11.0])
+
+        self.assertNotEqual(PmacCommandCache.content_key(points),
+                            PmacCommandCache.content_key(moved))
+
+    def test_given_readable_points_then_keyed_by_content(self):
+        points = {'time': [{'time_val': 500, 'vel_mode': 1, 'subroutine': 0}],
+                  'x': [10.0]}
+        other_mode = {'time': [{'time_val': 500, 'vel_mode': 2, 'subroutine': 0}],
+                      'x': [10.0]}
+
+        self.assertEqual(PmacCommandCache.content_key(points),
+                         PmacCommandCache.content_key(dict(points)))
+        self.assertNotEqual(PmacCommandCache.content_key(points),
+                            PmacCommandCache.content_key(other_mode))
+
+    def test_given_formatted_points_then_keyed_by_word(self):
+        self.assertNotEqual(PmacCommandCache.content_key({'time': ['$1a']}),
+                            PmacCommandCache.content_key({'time': ['$', '1a']}))
+
+    def test_given_formatted_points_then_keyed_by_axis(self):
+        self.assertNotEqual(PmacCommandCache.content_key({'time': ['$1'], 'x': ['$2']}),
+                            PmacCommandCache.content_key({'time': ['$1'], 'y': ['$2']}))
+
+
+class GetPutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PmacCommandCache(max_entries=2)
+
+    def test_given_stored_then_get_and_count_hit(self):
+        self.cache.put(('key', 0x30000), ["WL$30000,$1"])
+
+        self.assertEqual(["WL$30000,$1"], self.cache.get(('key', 0x30000)))
+        self.assertIsNone(self.cache.get(('key', 0x30226)))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_given_full_then_drop_least_recently_used(self):
+        self.cache.put('a', ["A"])
+        self.cache.put('b', ["B"])
+        self.cache.get('a')
+        self.cache.put('c', ["C"])
+
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(["A"], self.cache.get('a'))
+
+    def test_clear(self):
+        self.cache.put('a', ["A"])
+
+        self.cache.clear()
+
+        self.assertEqual(0, len(self.cache))
@@ -0,0 +1,69 @@
+from test_harness.PmacConfiguration import PmacConfiguration
+import unittest
+
+from pkg_resources import require
+require("mock")
+from mock import MagicMock, patch
+
+
+class GetSharedTest(unittest.TestCase):
+
+    @patch.dict('test_harness.PmacConfiguration.PmacConfiguration._configurations',
+                clear=True)
+    def test_given_same_host_and_port_then_same_configuration(self):
+        configuration = PmacConfiguration.get_shared("127.0.0.1", 1025)
+
+        self.assertIs(configuration, PmacConfiguration.get_shared("127.0.0.1", 1025))
+        self.assertIsNot(configuration, PmacConfiguration.get_shared("127.0.0.1", 1026))
+
+
+class GetSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = PmacConfiguration()
+
+    def test_given_not_cached_then_read_once(self):
+        read = MagicMock(return_value=(50, 0x30000, 0x30226))
+
+        self.assertEqual((50, 0x30000, 0x30226), self.config.get('buffer_layout', read))
+        self.assertEqual((50, 0x30000, 0x30226), self.config.get('buffer_layout', read))
+        read.assert_called_once_with()
+
+    def test_given_not_cached_and_no_read_then_none(self):
+        self.assertIsNone(self.config.get('buffer_layout'))
+
+    def test_given_invalidated_while_reading_then_not_cached(self):
+        def read():
+            self.config.invalidate()
+            return ['10']*9
+
+        self.config.get('max_velocities', read)
+
+        self.assertNotIn('max_velocities', self.config)
+
+    def test_given_set_while_reading_then_keep_set_value(self):
+        def read():
+            self.config.set('max_velocities', ['20']*9)
+            return ['10']*9
+
+        self.assertEqual(['10']*9, self.config.get('max_velocities', read))
+
+        self.assertEqual(['20']*9, self.config.get('max_velocities'))
+
+
+class InvalidateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = PmacConfiguration()
+        self.config.set('max_velocities', ['10']*9)
+        self.config.set(('cs_motors', '1'), [('1', 'X', 100)])
+
+    def test_given_keys_then_remove_them(self):
+        self.config.invalidate(('cs_motors', '1'))
+
+        self.assertEqual(['max_velocities'], self.config.keys())
+
+    def test_given_no_keys_then_remove_all(self):
+        self.config.invalidate()
+
+        self.assertEqual([], self.config.keys())
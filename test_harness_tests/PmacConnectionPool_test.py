@@ -0,0 +1,94 @@
+from test_harness.PmacConnectionPool import PmacConnectionPool
+from test_harness.PmacSimulator import PmacSimulator
+from test_harness.PmacTestHarness import PmacTestHarness
+import unittest
+
+from pkg_resources import require
+require("mock")
+from mock import patch
+
+
+class PmacConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = PmacSimulator(port=0)
+        self.sim.load_trajectory_scan(buffer_length=50)
+        self.port = self.sim.start()
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def test_given_same_host_then_share_pool(self):
+        pool = PmacConnectionPool.get_pool("127.0.0.1", self.port)
+        shared_pool = PmacConnectionPool.get_pool("127.0.0.1", self.port)
+
+        self.assertIs(pool, shared_pool)
+        self.assertEqual(2, pool.references)
+
+        pool.release()
+        self.assertTrue(pool.status_lane.isConnectionOpen)
+        shared_pool.release()
+        self.assertFalse(pool.status_lane.isConnectionOpen)
+        self.assertFalse(pool.data_lanes[0].isConnectionOpen)
+
+    def test_given_connection_refused_then_error(self):
+        self.sim.stop()
+
+        with self.assertRaises(IOError):
+            PmacConnectionPool.get_pool("127.0.0.1", self.port)
+
+    def test_given_data_lanes_busy_then_status_command_still_sent(self):
+        pool = PmacConnectionPool.get_pool("127.0.0.1", self.port, data_lanes=2)
+        try:
+            busy_lanes = [pool._free_data_lanes.get(), pool._free_data_lanes.get()]
+
+            response = pool.send_command("P4004 P4002=1")
+
+            self.assertEqual("50\r\x06", response)
+            self.assertEqual(2, len(busy_lanes))
+        finally:
+            pool.release()
+
+    def test_given_commands_then_route_to_lanes(self):
+        pool = PmacConnectionPool.get_pool("127.0.0.1", self.port)
+        try:
+            with patch.object(pool.status_lane, '_sendCommand') as status_mock, \
+                    patch.object(pool.data_lanes[0], '_sendCommand') as data_mock:
+                pool.send_command("WL$30000,$1")
+                pool.send_command("RHL:$30000,10")
+                pool.send_command("P4001")
+                pool.send_command("&1A")
+
+            self.assertEqual(["WL$30000,$1", "RHL:$30000,10"],
+                             [call[0][0] for call in data_mock.call_args_list])
+            self.assertEqual(["P4001", "&1A"],
+                             [call[0][0] for call in status_mock.call_args_list])
+        finally:
+            pool.release()
+
+    def test_given_metrics_then_set_on_every_lane(self):
+        pool = PmacConnectionPool.get_pool("127.0.0.1", self.port, data_lanes=2)
+        try:
+            metrics = object()
+
+            pool.set_metrics(metrics)
+
+            self.assertIs(metrics, pool.status_lane.metrics)
+            self.assertEqual([metrics, metrics], [lane.metrics for lane in pool.data_lanes])
+        finally:
+            pool.release()
+
+    def test_given_harnesses_for_same_pmac_then_share_connections(self):
+        pmac = PmacTestHarness("127.0.0.1", port=self.port)
+        other_pmac = PmacTestHarness("127.0.0.1", port=self.port)
+        try:
+            self.assertIs(pmac.pool, other_pmac.pool)
+
+            pmac.fill_current_buffer({'time': ['$1']*50})
+            pmac.set_abort()
+
+            self.assertEqual(1, other_pmac.read_points(1)[0][0])
+            self.assertEqual("1", other_pmac.read_variable("P4002"))
+        finally:
+            pmac.disconnect()
+            other_pmac.disconnect()
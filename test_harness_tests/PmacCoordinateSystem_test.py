@@ -17,6 +17,9 @@ class InitTest(unittest.TestCase):
         self.assertEqual(self.pmacCS.max_velocities, {'x': 0, 'y': 0, 'z': 0,
                                                       'u': 0, 'v': 0, 'w': 0,
                                                       'a': 0, 'b': 0, 'c': 0})
+        self.assertEqual(self.pmacCS.max_accelerations, {'x': 0, 'y': 0, 'z': 0,
+                                                         'u': 0, 'v': 0, 'w': 0,
+                                                         'a': 0, 'b': 0, 'c': 0})
 
 
 class AddMotorAssignmentTest(unittest.TestCase):
@@ -52,3 +55,13 @@ class SetMaxVelocitiesTest(unittest.TestCase):
         self.PmacCS.set_max_velocities(velocities)
 
         self.assertEqual(expected_vel_dict, self.PmacCS.max_velocities)
+
+    def test_given_accelerations_list_then_set(self):
+        accelerations = ["10", "20", "30", "40", "50", "60", "70", "80", "90"]
+        expected_acc_dict = {'x': 0.2, 'y': 1.0, 'z': 3,
+                             'u': 0.8, 'v': 2.5, 'w': 6.0,
+                             'a': 1.4, 'b': 4.0, 'c': 9.0}
+
+        self.PmacCS.set_max_accelerations(accelerations)
+
+        self.assertEqual(expected_acc_dict, self.PmacCS.max_accelerations)
@@ -0,0 +1,160 @@
+from test_harness.PmacSimulator import PmacSimulator
+from test_harness.PmacTestHarness import PmacTestHarness
+from test_harness.PointSet import PointSet
+import unittest
+
+from pkg_resources import require
+require('numpy')
+import numpy
+
+
+class ProcessCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = PmacSimulator()
+        self.sim.load_trajectory_scan(buffer_length=50)
+
+    def test_given_variable_reads_then_respond_per_variable(self):
+        response = self.sim.process_command("P4001P4004 P4008..4009")
+
+        self.assertEqual("0\r50\r196608\r197108\r\x06", response)
+
+    def test_given_assignment_then_set_variable(self):
+        response = self.sim.process_command("P4002=1 M4007=500.5 i124=$20")
+
+        self.assertEqual("\x06", response)
+        self.assertEqual(1, self.sim.get_variable("P4002"))
+        self.assertEqual(500.5, self.sim.get_variable("M4007"))
+        self.assertEqual(0x20, self.sim.get_variable("I124"))
+
+    def test_given_write_then_store_words(self):
+        response = self.sim.process_command("WL$30000,$500000000803,$a WL$30002,$1")
+
+        self.assertEqual("\x06", response)
+        self.assertEqual({0x30000: 0x500000000803, 0x30001: 0xa, 0x30002: 0x1},
+                         self.sim.memory)
+
+    def test_given_read_hex_range_then_respond_with_words(self):
+        self.sim.process_command("WL$30000,$500000000803,$a")
+
+        response = self.sim.process_command("RHL:$30000,3")
+
+        self.assertEqual("500000000803 00000000000A 000000000000\r\x06", response)
+
+    def test_given_read_then_decode(self):
+        self.sim.process_command("WL $30000 $500000000803 WX $30001 100")
+
+        response = self.sim.process_command("RL $30000 RX $30001 RY $30001")
+
+        self.assertEqual("10\r100\r0\r\x06", response)
+
+    def test_given_motor_commands_then_track_position(self):
+        response = self.sim.process_command("&1 #1->100X #2->I #1J=20#2P#1P#1HMZ#1P")
+
+        self.assertEqual("0\r20\r0\r\x06", response)
+
+    def test_given_gather_then_list_samples_until_buffer_full(self):
+        self.sim.process_command("WL$8B,$FFFFFFFFFF9C WY$3000,$12 "
+                                 "I5001=$80008B I5002=$003000 I5050=$3 DEFINE GATHER 6 GAT")
+        for _ in range(3):
+            self.sim.gather_sample()
+
+        response = self.sim.process_command("LIST GATHER 0,6 LIST GATHER 3,3")
+
+        self.assertFalse(self.sim.gathering)
+        self.assertEqual("FFFFFFFFFF9C 000012\rFFFFFFFFFF9C 000012\r"
+                         "FFFFFFFFFF9C 000012\r\x06", response)
+
+    def test_given_connection_check_then_respond_with_version(self):
+        response = self.sim.process_command("i6=1 i3=2 ver")
+
+        self.assertEqual("1.947\r\x06", response)
+
+    def test_given_invalid_command_then_stop_with_error(self):
+        response = self.sim.process_command("P4001 nonsense P4004")
+
+        self.assertEqual("0\r\x07ERR003\r", response)
+
+    def test_given_command_too_long_then_error(self):
+        self.sim.max_command_length = 10
+
+        response = self.sim.process_command("P4001 P4002 P4003")
+
+        self.assertEqual("\x07ERR003\r", response)
+
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = PmacSimulator(port=0, max_response_length=1400)
+        self.sim.load_trajectory_scan(buffer_length=200)
+        port = self.sim.start()
+        self.pmac = PmacTestHarness("127.0.0.1", port=port)
+
+    def tearDown(self):
+        self.pmac.disconnect()
+        self.sim.stop()
+
+    def test_harness_connects_and_reads_layout(self):
+        self.assertTrue(self.pmac.isConnectionOpen)
+        self.assertEqual(200, self.pmac.buffer_length)
+        self.assertEqual(0x30000, self.pmac.buffer_address_A)
+        self.assertEqual(0x30000 + 2000, self.pmac.buffer_address_B)
+
+    def test_given_metrics_enabled_then_record_pooled_commands(self):
+        metrics = self.pmac.enableMetrics()
+
+        self.pmac.fill_current_buffer({'time': ['$1f4']*50})
+        self.pmac.update_status_variables()
+
+        snapshot = metrics.snapshot()
+        self.assertGreater(snapshot['commandTypes']['WL']['count'], 0)
+        self.assertGreater(snapshot['commandTypes']['P']['count'], 0)
+        self.assertGreater(snapshot['bytesSent'], 0)
+        self.assertGreater(snapshot['bytesReceived'], 0)
+
+        self.pmac.disableMetrics()
+        self.assertIsNone(self.pmac.pool.metrics)
+
+    def test_given_fill_then_read_back_over_several_packets(self):
+        points = {'time': ['$1f4']*200, 'x': ['$500000000803']*200}
+
+        self.pmac.fill_current_buffer(points)
+        pmac_buffer = self.pmac.read_points(200, buffer_num=0, num_axes=7)
+
+        self.assertEqual([0x1f4]*200, pmac_buffer[0].tolist())
+        self.assertEqual([0x500000000803]*200, pmac_buffer[7].tolist())
+
+    def test_given_gather_then_read_back_gathered_samples(self):
+        self.pmac.configure_gather([('position', 'D', 0x8B), ('demand', 'L', 0x30000)],
+                                   num_samples=100)
+
+        with self.pmac.gathering():
+            for position, demand in [("-100", "1.5"), ("0", "-2.0"), ("250", "10.0")]:
+                self.pmac.write_to_address("D", "8B", position)
+                self.pmac.write_to_address("L", "30000", demand)
+                self.sim.gather_sample()
+        gathered = self.pmac.read_gather(samples_per_read=2)
+
+        self.assertEqual([-100, 0, 250], gathered['position'].tolist())
+        numpy.testing.assert_allclose([1.5, -2.0, 10.0], gathered['demand'], atol=1e-9)
+
+    def test_given_short_response_packets_then_read_back_over_continuations(self):
+        self.sim.max_response_length = 500
+        self.pmac.fill_current_buffer({'time': ['$1f4']*200, 'x': ['$500000000803']*200})
+
+        pmac_buffer = self.pmac.read_points(200, buffer_num=0, num_axes=7)
+
+        self.assertEqual([0x1f4]*200, pmac_buffer[0].tolist())
+        self.assertEqual([0x500000000803]*200, pmac_buffer[7].tolist())
+
+    def test_given_point_set_then_read_back_decoded(self):
+        points = PointSet([500]*200, vel_mode=[1]*200, x=numpy.linspace(-5.0, 5.0, 200))
+        self.pmac.set_axes(['X'])
+
+        self.pmac.fill_current_buffer(points)
+        decoded = PointSet(**self.pmac.read_decoded_points(200))
+
+        self.assertEqual(points.time_val.tolist(), decoded.time_val.tolist())
+        self.assertEqual(points.vel_mode.tolist(), decoded.vel_mode.tolist())
+        numpy.testing.assert_allclose(points.axes['x'], decoded.axes['x'], atol=1e-9)
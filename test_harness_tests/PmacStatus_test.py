@@ -0,0 +1,47 @@
+from test_harness.PmacStatus import PmacStatus
+import unittest
+
+
+class InitTest(unittest.TestCase):
+
+    def test_given_values_then_set_attributes(self):
+        status = PmacStatus(["1", "0", "19", "20", "1", "50", "25", "2", "1"], 10.0)
+
+        self.assertEqual(1, status.status)
+        self.assertEqual(20, status.current_index)
+        self.assertEqual(1, status.current_buffer)
+        self.assertEqual(25, status.buffer_fill_B)
+        self.assertEqual(2, status.vel_mode)
+        self.assertEqual(1, status.trigger)
+        self.assertEqual(10.0, status.timestamp)
+
+    def test_given_wrong_number_of_values_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            PmacStatus(["1", "0"])
+
+        self.assertEqual("Expected 9 status values", error.exception.message)
+
+    def test_variable_names(self):
+        self.assertEqual(["P4001", "P4015", "P4005", "P4006", "P4007", "P4011", "P4012",
+                          "M4011", "M32"], PmacStatus.variable_names())
+
+
+class PollDelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.status = PmacStatus(["1", "0", "0", "8", "0", "10", "0", "0", "0"])
+
+    def test_seconds_to_swap(self):
+        self.assertEqual(0.2, self.status.seconds_to_swap([400]*10))
+
+    def test_given_swap_close_then_half_time_left(self):
+        self.assertEqual(0.025, self.status.poll_delay([400]*8 + [100]*2))
+
+    def test_given_swap_far_off_then_max_delay(self):
+        self.assertEqual(0.1, self.status.poll_delay([4000]*10))
+
+    def test_given_swap_due_then_min_delay(self):
+        self.assertEqual(0.001, self.status.poll_delay([400]*8))
+
+    def test_given_unknown_time_values_then_max_delay(self):
+        self.assertEqual(0.2, self.status.poll_delay(None, max_delay=0.2))
@@ -1,10 +1,16 @@
 from test_harness.PmacTestHarness import PmacTestHarness
+from test_harness.PmacConfiguration import PmacConfiguration
 from test_harness.PmacCoordinateSystem import PmacCoordinateSystem
+from test_harness.PointSet import PointSet
+from test_harness.TrajectoryScanGenerator import TrajectoryScanGenerator
 import unittest
 
 from pkg_resources import require
 require("mock")
-from mock import ANY, patch
+from mock import ANY, MagicMock, call, patch
+
+require("numpy")
+import numpy
 
 
 class TesterPmacTestHarness(PmacTestHarness):
@@ -29,37 +35,122 @@ class TesterPmacTestHarness(PmacTestHarness):
         self.total_points = 0
         self.current_index = 0
         self.current_buffer = 0
-        self.buffer_length = "50"
-        self.buffer_address_A = "30000"
-        self.buffer_address_B = "30226"
+        self.status_snapshot = None
+        self.set_buffer_layout(50, 0x30000, 0x30226)
         self.addresses = {}
+        self.pool = None
         self.coordinate_system = {'1': PmacCoordinateSystem(1)}
 
         self.prev_buffer_write = 1
+        self.active_axes = None
+        self.command_cache = None
+        self.write_shadow = None
+        self.gather_sources = []
+        self.gather_samples = 0
+        self.config = PmacConfiguration()
 
 
+@patch.dict('test_harness.PmacConfiguration.PmacConfiguration._configurations', clear=True)
+@patch('dls_pmacremote.RemotePmacInterface.setConnectionParams')
+@patch('test_harness.PmacTestHarness.PmacTestHarness.read_multiple_variables')
 class InitTest(unittest.TestCase):
 
-    @patch('dls_pmacremote.RemotePmacInterface.setConnectionParams')
-    @patch('test_harness.PmacTestHarness.PmacTestHarness.read_variable')
-    def test_default_attributes_set(self, read_variable_mock, set_params_mock):
+    status = ("1", "0", "0", "0", "0", "0", "0", "0", "0")
+    layout = ("50", "196608", "197158")
+    velocities = ("10",)*9
+
+    def test_default_attributes_set(self, read_mock, set_params_mock):
+        read_mock.side_effect = [self.status, self.layout, self.velocities]
+
         self.pmac = PmacTestHarness("test")
 
         set_params_mock.assert_called_once_with(host="test", port=1025)
 
-        self.assertEqual(read_variable_mock.call_args_list[0][0][0],
-                         self.pmac.P_variables['status'])
-        self.assertEqual(read_variable_mock.call_args_list[1][0][0],
-                         self.pmac.P_variables['error'])
-        self.assertEqual(read_variable_mock.call_args_list[2][0][0],
-                         self.pmac.P_variables['buffer_length'])
-        self.assertEqual(read_variable_mock.call_args_list[3][0][0],
-                         self.pmac.P_variables['buffer_address_A'])
-        self.assertEqual(read_variable_mock.call_args_list[4][0][0],
-                         self.pmac.P_variables['buffer_address_B'])
+        self.assertEqual(self.pmac.P_variables['status'], read_mock.call_args_list[0][0][0][0])
+        self.assertEqual([self.pmac.P_variables['buffer_length'],
+                          self.pmac.P_variables['buffer_address_A'],
+                          self.pmac.P_variables['buffer_address_B']],
+                         read_mock.call_args_list[1][0][0])
+        self.assertEqual("i116", read_mock.call_args_list[2][0][0][0])
+        self.assertEqual(1, self.pmac.status)
+        self.assertEqual(50, self.pmac.buffer_length)
+        self.assertEqual(0x30000, self.pmac.buffer_address_A)
+
+    def test_given_second_harness_then_reuse_configuration(self, read_mock, _):
+        read_mock.side_effect = [self.status, self.layout, self.velocities, self.status]
+        PmacTestHarness("test")
+
+        self.pmac = PmacTestHarness("test")
+
+        self.assertEqual(4, read_mock.call_count)
+        self.assertEqual(50, self.pmac.buffer_length)
+
+
+class ConfigurationTest(unittest.TestCase):
 
+    def setUp(self):
+        self.pmac = TesterPmacTestHarness()
 
-@patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables', return_value=("1", "0", "19", "20", "0"))
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+           return_value=('10',)*9)
+    def test_given_limits_cached_then_read_once(self, read_mock):
+        self.pmac.read_cs_max_velocities(1)
+        self.pmac.read_cs_max_velocities(1)
+
+        read_mock.assert_called_once_with(ANY)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand',
+           return_value=("", True))
+    def test_given_limit_written_then_invalidate(self, _):
+        self.pmac.config.set('max_velocities', ['10']*9)
+
+        self.pmac.set_variable("i716", "20")
+
+        self.assertNotIn('max_velocities', self.pmac.config)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand')
+    def test_given_motors_assigned_then_store_and_restore(self, _):
+        self.pmac.assign_cs_motors([(1, "X", 100), (2, "Y", 25)], 1)
+        other_pmac = TesterPmacTestHarness()
+        other_pmac.config = self.pmac.config
+        other_pmac._restore_cs_motors(1)
+
+        self.assertEqual([('1', 'X', 100), ('2', 'Y', 25)],
+                         self.pmac.config.get(('cs_motors', '1')))
+        self.assertEqual({'1': ('X', 100), '2': ('Y', 25)},
+                         other_pmac.coordinate_system['1'].motor_map)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand')
+    def test_given_motors_reassigned_then_replace(self, _):
+        self.pmac.assign_cs_motors_to_kinematics([1, 2], 1)
+
+        self.pmac.coordinate_system['1'] = PmacCoordinateSystem(1)
+        self.pmac.assign_cs_motors([(3, "X", 1)], 1)
+
+        self.assertEqual([('3', 'X', 1)], self.pmac.config.get(('cs_motors', '1')))
+
+    @patch.dict('test_harness.PmacConfiguration.PmacConfiguration._configurations',
+                clear=True)
+    @patch('test_harness.PmacTestHarness.PmacConnectionPool.get_pool')
+    def test_given_new_pool_then_invalidate_shared_configuration(self, get_pool_mock):
+        self.pmac.hostname, self.pmac.port = "test", 1025
+        self.pmac.data_lanes, self.pmac.timeout = 1, 3.0
+        self.pmac.isConnectionOpen, self.pmac.metrics = False, None
+        config = PmacConfiguration.get_shared("test", 1025)
+        self.pmac.connect()
+        config.set('max_velocities', ['10']*9)
+
+        self.pmac.disconnect()
+        self.pmac.connect()
+        self.assertIn('max_velocities', config)
+        get_pool_mock.return_value = MagicMock()
+        self.pmac.disconnect()
+        self.pmac.connect()
+        self.assertNotIn('max_velocities', config)
+
+
+@patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+       return_value=("1", "0", "19", "20", "0", "50", "0", "1", "0"))
 class UpdateStatusVariablesTest(unittest.TestCase):
 
     def setUp(self):
@@ -67,16 +158,28 @@ class UpdateStatusVariablesTest(unittest.TestCase):
 
     def test_status_variables_updated(self, read_variables_mock):
 
-        self.pmac.update_status_variables()
+        snapshot = self.pmac.update_status_variables()
         self.assertEqual(self.pmac.status, 1)
         self.assertEqual(self.pmac.error, 0)
         self.assertEqual(self.pmac.total_points, 19)
         self.assertEqual(self.pmac.current_index, 20)
         self.assertEqual(self.pmac.current_buffer, 0)
+        self.assertEqual(1, snapshot.vel_mode)
+        self.assertIs(snapshot, self.pmac.status_snapshot)
         read_variables_mock.assert_called_once_with(
             [self.pmac.P_variables['status'], self.pmac.P_variables['error'],
              self.pmac.P_variables['total_points'], self.pmac.P_variables['current_index'],
-             self.pmac.P_variables['current_buffer']])
+             self.pmac.P_variables['current_buffer'], self.pmac.P_variables['buffer_fill_A'],
+             self.pmac.P_variables['buffer_fill_B'], "M4011", "M32"])
+
+    @patch('test_harness.PmacTestHarness.time.sleep')
+    def test_poll_status_waits_half_time_to_swap(self, sleep_mock, _):
+        self.pmac.update_status_variables()
+
+        self.pmac.poll_status([400]*30, max_delay=1.0)
+
+        sleep_mock.assert_called_once_with(0.5)
+        self.assertEqual(2, _.call_count)
 
 
 class AddCSTest(unittest.TestCase):
@@ -98,52 +201,73 @@ class UpdateAddressesTest(unittest.TestCase):
         self.pmac = TesterPmacTestHarness()
 
     def test_given_buffer_A_then_update(self):
-        expected_address = {'a': '30032',
-                            'b': '30064',
-                            'c': '30096',
-                            'time': '30000',
-                            'u': '300c8',
-                            'v': '300fa',
-                            'w': '3012c',
-                            'x': '3015e',
-                            'y': '30190',
-                            'z': '301c2'}
+        expected_address = {'a': 0x30032,
+                            'b': 0x30064,
+                            'c': 0x30096,
+                            'time': 0x30000,
+                            'u': 0x300c8,
+                            'v': 0x300fa,
+                            'w': 0x3012c,
+                            'x': 0x3015e,
+                            'y': 0x30190,
+                            'z': 0x301c2}
 
         self.pmac.update_address_dict(self.pmac.buffer_address_A)
 
         self.assertEqual(expected_address, self.pmac.addresses)
 
     def test_given_buffer_B_then_update(self):
-        expected_address = {'a': '30258',
-                            'b': '3028a',
-                            'c': '302bc',
-                            'time': '30226',
-                            'u': '302ee',
-                            'v': '30320',
-                            'w': '30352',
-                            'x': '30384',
-                            'y': '303b6',
-                            'z': '303e8'}
+        expected_address = {'a': 0x30258,
+                            'b': 0x3028a,
+                            'c': 0x302bc,
+                            'time': 0x30226,
+                            'u': 0x302ee,
+                            'v': 0x30320,
+                            'w': 0x30352,
+                            'x': 0x30384,
+                            'y': 0x303b6,
+                            'z': 0x303e8}
 
         self.pmac.update_address_dict(self.pmac.buffer_address_B)
 
         self.assertEqual(expected_address, self.pmac.addresses)
 
+    def test_given_new_layout_then_update_offsets(self):
+        self.pmac.set_buffer_layout(1000, 0x30000, 0x32710)
+
+        self.pmac.update_address_dict(self.pmac.buffer_address_B)
+
+        self.assertEqual(0x32710, self.pmac.addresses['time'])
+        self.assertEqual(0x32710 + 9000, self.pmac.addresses['z'])
+
 
 class UpdateVelocitiesTest(unittest.TestCase):
 
     def setUp(self):
         self.pmac = TesterPmacTestHarness()
 
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_variable',
-           side_effect=['10', '20', '30', '40', '50', '60', '70', '80', '90'])
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+           return_value=('10', '20', '30', '40', '50', '60', '70', '80', '90'))
     @patch('test_harness.PmacCoordinateSystem.PmacCoordinateSystem.set_max_velocities')
-    def test_update_velocities(self, set_max_vel_mock, _):
+    def test_update_velocities(self, set_max_vel_mock, read_mock):
         expected_call = ['10', '20', '30', '40', '50', '60', '70', '80', '90']
 
         self.pmac.read_cs_max_velocities(1)
 
         set_max_vel_mock.assert_called_once_with(expected_call)
+        read_mock.assert_called_once_with(
+            ["i116", "i216", "i316", "i416", "i516", "i616", "i716", "i816", "i916"])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+           return_value=('10', '20', '30', '40', '50', '60', '70', '80', '90'))
+    @patch('test_harness.PmacCoordinateSystem.PmacCoordinateSystem.set_max_accelerations')
+    def test_update_accelerations(self, set_max_acc_mock, read_mock):
+        expected_call = ['10', '20', '30', '40', '50', '60', '70', '80', '90']
+
+        self.pmac.read_cs_max_accelerations(1)
+
+        set_max_acc_mock.assert_called_once_with(expected_call)
+        self.assertEqual("i117", read_mock.call_args[0][0][0])
 
 
 @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand')
@@ -245,33 +369,149 @@ class SetCurrentCoordinatesTest(unittest.TestCase):
     def setUp(self):
         self.pmac = TesterPmacTestHarness()
 
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_motor_position',
-           side_effect=["10", "20"])
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.set_variable')
-    def test_set_initial_coordinates_makes_correct_calls(self, set_variable_mock, _):
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+           return_value=("10", "20"))
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("", True)]*4)
+    def test_set_initial_coordinates_makes_correct_calls(self, send_mock, read_mock):
         self.pmac.coordinate_system['1'].motor_map = {"1": ("X", 50), "2": ("Y", 20)}
-
         self.pmac.set_cs_initial_coordinates(1)
 
-        call_list = [call[0] for call in set_variable_mock.call_args_list]
-        self.assertIn(("P4117", "500.0"), call_list)
-        self.assertIn(("P4118", "400.0"), call_list)
-        self.assertIn(("M4007", "500.0"), call_list)
-        self.assertIn(("M4008", "400.0"), call_list)
+        read_mock.assert_called_once_with(ANY)
+        self.assertItemsEqual(["#7P", "#8P"], read_mock.call_args[0][0])
+        self.assertItemsEqual(["P4117=500.0", "P4118=400.0", "M4007=500.0", "M4008=400.0"],
+                              send_mock.call_args[0][0])
 
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_motor_position',
-           side_effect=["10.0", "20.0"])
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.set_variable')
-    def test_set_initial_kinematic_coordinates_makes_correct_calls(self, set_variable_mock, _):
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+           return_value=("10.0", "20.0"))
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("", True)]*4)
+    def test_set_initial_kinematic_coordinates_makes_correct_calls(self, send_mock, _):
         self.pmac.coordinate_system['1'].axis_map = {"I": (1, 2)}
 
         self.pmac.set_cs_initial_kinematic_coordinates(1)
 
-        call_list = [call[0] for call in set_variable_mock.call_args_list]
-        self.assertIn(("P4111", "10.0"), call_list)
-        self.assertIn(("P4112", "20.0"), call_list)
-        self.assertIn(("M4001", "10.0"), call_list)
-        self.assertIn(("M4002", "20.0"), call_list)
+        self.assertEqual(["P4111=10.0", "M4001=10.0", "P4112=20.0", "M4002=20.0"],
+                         send_mock.call_args[0][0])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables',
+           return_value=("10",))
+    def test_given_missing_position_then_error(self, _):
+        self.pmac.coordinate_system['1'].motor_map = {"1": ("X", 50), "2": ("Y", 20)}
+
+        with self.assertRaises(IOError) as error:
+            self.pmac.set_cs_initial_coordinates(1)
+
+        self.assertEqual("Read failed", error.exception.message)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.read_multiple_variables')
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("", True)]*2)
+    def test_setup_cs_for_scan_reads_and_writes_once(self, send_mock, read_mock):
+        self.pmac.coordinate_system['1'].add_motor_assignment(7, "X", 10)
+        read_mock.return_value = tuple(str(10*i) for i in range(1, 19)) + ("5",)
+
+        self.pmac.setup_cs_for_scan(1)
+
+        variables = read_mock.call_args[0][0]
+        self.assertEqual(19, len(variables))
+        self.assertEqual(["i116", "i117", "#7P"], [variables[0], variables[9], variables[18]])
+        self.assertEqual(7.0, self.pmac.coordinate_system['1'].max_velocities['x'])
+        self.assertEqual(16.0, self.pmac.coordinate_system['1'].max_accelerations['x'])
+        send_mock.assert_called_once_with(["P4117=50.0", "M4007=50.0"])
+
+
+class GatherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = TesterPmacTestHarness()
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("", True)]*9)
+    def test_configure_gather(self, send_mock):
+        sources = PmacTestHarness.motor_gather_sources(1) + [('status', 'Y', 0x3000)]
+
+        self.pmac.configure_gather(sources, period=2, num_samples=100)
+
+        send_mock.assert_called_once_with(
+            ["ENDG", "DELETE GATHER", "I5000=0", "I5049=2", "I5001=$800088",
+             "I5002=$80008b", "I5003=$003000", "I5050=$7", "I5051=$0",
+             "DEFINE GATHER 500"], [0]*10)
+        self.assertEqual(sources, self.pmac.gather_sources)
+        self.assertEqual(100, self.pmac.gather_samples)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("Y:$004FA1,0,24\r\x06", True)])
+    def test_variable_gather_sources(self, send_mock):
+        sources = self.pmac.variable_gather_sources(["P4101", "M4001", "Q11"])
+
+        send_mock.assert_called_once_with(["M4001->"])
+        self.assertEqual([('P4101', 'L', 0x6000 + 4101), ('M4001', 'Y', 0x4FA1),
+                          ('Q11', 'L', 0x8000 + 11)], sources)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("*\r\x06", True)])
+    def test_given_undefined_m_variable_then_error(self, _):
+        with self.assertRaises(ValueError) as error:
+            self.pmac.variable_gather_sources(["M4001"])
+
+        self.assertEqual("Cannot gather M4001->*", error.exception.message)
+
+    def test_given_invalid_mode_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            self.pmac.configure_gather([('status', 'P', 4001)])
+
+        self.assertEqual("Invalid gather mode P", error.exception.message)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand',
+           return_value=("\x06", True))
+    def test_gathering_starts_and_stops(self, send_mock):
+        with self.assertRaises(RuntimeError):
+            with self.pmac.gathering():
+                raise RuntimeError()
+
+        self.assertEqual(["GAT", "ENDG"],
+                         [call[0][0] for call in send_mock.call_args_list])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand')
+    def test_read_gather(self, send_mock):
+        self.pmac.gather_sources = [('position', 'D', 0x8B), ('error', 'Y', 0x3000),
+                                    ('value', 'L', 0x30000)]
+        self.pmac.gather_samples = 3
+        send_mock.side_effect = [
+            ("000000000064 FFFFFF 500000000803\r000000000065 000001 500000000803\r\x06",
+             True),
+            ("FFFFFFFFFF9C 000002 A00000000802\r\x06", True)]
+
+        gathered = self.pmac.read_gather(samples_per_read=2)
+
+        self.assertEqual(["LIST GATHER 0,10", "LIST GATHER 10,5"],
+                         [call[0][0] for call in send_mock.call_args_list])
+        self.assertEqual([100, 101, -100], gathered['position'].tolist())
+        self.assertEqual([-1, 1, 2], gathered['error'].tolist())
+        self.assertEqual([10.0, 10.0, -6.0], gathered['value'].tolist())
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand',
+           return_value=("000000000064 FFFFFF\r\x06", True))
+    def test_given_fewer_samples_gathered_then_read_them(self, send_mock):
+        self.pmac.gather_sources = [('position', 'D', 0x8B), ('error', 'Y', 0x3000)]
+        self.pmac.gather_samples = 100
+
+        gathered = self.pmac.read_gather(samples_per_read=10)
+
+        send_mock.assert_called_once_with("LIST GATHER 0,30")
+        self.assertEqual([100], gathered['position'].tolist())
+        self.assertEqual([-1], gathered['error'].tolist())
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand',
+           return_value=("000000000064\r\x06", True))
+    def test_given_partial_sample_then_error(self, _):
+        self.pmac.gather_sources = [('position', 'D', 0x8B), ('error', 'Y', 0x3000)]
+
+        with self.assertRaises(IOError) as error:
+            self.pmac.read_gather(num_samples=2)
+
+        self.assertEqual("Read failed", error.exception.message)
 
 
 class CheckProgramExistsTest(unittest.TestCase):
@@ -296,6 +536,25 @@ class CheckProgramExistsTest(unittest.TestCase):
         self.assertFalse(exists)
 
 
+class SendCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = TesterPmacTestHarness()
+
+    def test_given_pool_then_send_through_pool(self):
+        self.pmac.pool = MagicMock()
+        self.pmac.pool.send_command.return_value = "1\r\x06"
+
+        response = self.pmac._sendCommand("P4001")
+
+        self.pmac.pool.send_command.assert_called_once_with("P4001", double_timeout=False)
+        self.assertEqual("1\r\x06", response)
+
+    def test_given_not_connected_then_error(self):
+        with self.assertRaises(IOError):
+            self.pmac._sendCommand("P4001")
+
+
 class SetAxesTest(unittest.TestCase):
 
     def setUp(self):
@@ -306,6 +565,17 @@ class SetAxesTest(unittest.TestCase):
         self.pmac.set_axes(['X', 'Y'])
 
         set_variable_mock.assert_called_once_with(self.pmac.P_variables['axes'], "192")
+        self.assertEqual({'x', 'y'}, self.pmac.active_axes)
+
+    def test_given_axes_not_set_then_all_active(self):
+        self.assertTrue(self.pmac.is_axis_active('z'))
+
+    def test_given_axes_set_then_only_time_and_axes_active(self):
+        self.pmac.active_axes = {'x'}
+
+        self.assertTrue(self.pmac.is_axis_active('time'))
+        self.assertTrue(self.pmac.is_axis_active('x'))
+        self.assertFalse(self.pmac.is_axis_active('y'))
 
 
 class SetAbortTest(unittest.TestCase):
@@ -374,6 +644,22 @@ class ReadWriteTest(unittest.TestCase):
         send_command_mock.assert_called_once_with("P10000")
         self.assertEqual(error.exception.message, "Read failed")
 
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("00000000000A 00001F400000 FFAFFFFFFFF8\r\x06", True)])
+    def test_read_address_range_given_valid_args_return_words(self, send_mock, _):
+        words = self.pmac.read_address_range("L", 0x30000, 3)
+
+        send_mock.assert_called_once_with(["RHL:$30000,3"])
+        self.assertEqual([0xa, 0x1f400000, 0xffaffffffff8], words.tolist())
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("ERR003\r\x06", False)])
+    def test_read_address_range_given_error_then_raise_error(self, _, __):
+        with self.assertRaises(IOError) as error:
+            self.pmac.read_address_range("L", 0x30000, 3)
+
+        self.assertEqual(error.exception.message, "Read failed")
+
     def test_read_multiple_variables_given_valid_args_return_value(self, send_command_mock):
         send_command_mock.return_value = ("1\r0\r192\r", True)
         values = self.pmac.read_multiple_variables(["P4001", "P4002", "P4003"])
@@ -431,28 +717,60 @@ class ResetBuffersTest(unittest.TestCase):
         current_mock.assert_called_once_with(expected_call)
         idle_mock.assert_called_once_with(expected_call)
 
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.fill_current_buffer')
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.fill_idle_buffer')
+    def test_given_active_axes_then_only_reset_those(self, idle_mock, current_mock):
+        self.pmac.active_axes = {'x', 'y'}
+
+        self.pmac.reset_buffers()
+
+        expected_call = {'time': ['$0', '$0', '$0', '$0', '$0'],
+                         'x': ['$0', '$0', '$0', '$0', '$0'],
+                         'y': ['$0', '$0', '$0', '$0', '$0']}
+        current_mock.assert_called_once_with(expected_call)
+        idle_mock.assert_called_once_with(expected_call)
+
 
 class ConstructWriteCommandTest(unittest.TestCase):
 
     def setUp(self):
         self.pmac = TesterPmacTestHarness()
 
-    def test_given_points_then_construct_message(self):
-        command_details = {'points': ['$f']*98,
-                           'mode': 'L', 'address': '30386'}
-        expected_response = {'points': ['$f']*16,
-                             'command': 'WL$30386,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
-                                        '$f', 'num_sent': 82}
+    def test_given_points_then_construct_messages(self):
+        points = ['$f']*98
+        expected_commands = ['WL$30386,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f',
+                             'WL$303d8,$f,$f,$f,$f,$f,$f,$f,$f,$f,'
+                             '$f,$f,$f,$f,$f,$f,$f']
+
+        commands = list(self.pmac._construct_write_commands('L', 0x30386, points))
+
+        self.assertEqual(expected_commands, commands)
+        self.assertTrue(all(len(command) <= 255 for command in commands))
+
+    def test_given_points_then_points_not_modified(self):
+        points = ['$f']*98
+
+        list(self.pmac._construct_write_commands('L', 0x30386, points))
+
+        self.assertEqual(['$f']*98, points)
 
-        response = self.pmac._construct_write_command_and_remove_used_points(command_details)
+    def test_given_no_points_then_no_messages(self):
+        commands = list(self.pmac._construct_write_commands('L', 0x30386, []))
 
-        self.assertEqual(expected_response, response)
+        self.assertEqual([], commands)
+
+    def test_given_point_too_long_then_error(self):
+        points = ['$' + 'f'*255]
+
+        with self.assertRaises(ValueError):
+            list(self.pmac._construct_write_commands('L', 0x30386, points))
 
 
 @patch('PmacTestHarness_test.TesterPmacTestHarness._fill_buffer')
@@ -470,7 +788,7 @@ class FillIdleBufferTest(unittest.TestCase):
         self.pmac.fill_idle_buffer(self.points)
 
         update_mock.assert_called_once_with(self.pmac.buffer_address_B)
-        fill_mock.assert_called_once_with(self.points)
+        fill_mock.assert_called_once_with(self.points, None)
 
     def test_given_b_then_update_a_and_fill_buffer(self, update_mock, fill_mock):
         self.pmac.current_buffer = 1
@@ -478,7 +796,7 @@ class FillIdleBufferTest(unittest.TestCase):
         self.pmac.fill_idle_buffer(self.points)
 
         update_mock.assert_called_once_with(self.pmac.buffer_address_A)
-        fill_mock.assert_called_once_with(self.points)
+        fill_mock.assert_called_once_with(self.points, None)
 
 
 @patch('PmacTestHarness_test.TesterPmacTestHarness._fill_buffer')
@@ -496,7 +814,7 @@ class FillCurrentBufferTest(unittest.TestCase):
         self.pmac.fill_current_buffer(self.points)
 
         update_mock.assert_called_once_with(self.pmac.buffer_address_A)
-        fill_mock.assert_called_once_with(self.points)
+        fill_mock.assert_called_once_with(self.points, None)
 
     def test_given_b_then_update_b_and_fill_buffer(self, update_mock, fill_mock):
         self.pmac.current_buffer = 1
@@ -504,7 +822,7 @@ class FillCurrentBufferTest(unittest.TestCase):
         self.pmac.fill_current_buffer(self.points)
 
         update_mock.assert_called_once_with(self.pmac.buffer_address_B)
-        fill_mock.assert_called_once_with(self.points)
+        fill_mock.assert_called_once_with(self.points, None)
 
 
 class FillBufferTest(unittest.TestCase):
@@ -532,65 +850,292 @@ class FillBufferTest(unittest.TestCase):
 
         self.assertEqual(expected_error_message, error.exception.message)
 
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.'
-           '_construct_write_command_and_remove_used_points')
-    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommand')
+    @patch('PmacTestHarness_test.TesterPmacTestHarness._construct_write_commands')
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True), ("\x06", True)])
     def test_given_valid_points_then_fill_buffer(self, send_mock, construct_mock):
-        self.pmac.addresses = {'time': '30000', 'x': '30032'}
+        self.pmac.addresses = {'time': 0x30000, 'x': 0x30032}
         points = {'time': ['10']*50, 'x': ['20']*50}
-        time_construct_call = {'mode': 'L', 'address': '30000', 'points': points['time']}
-        x_construct_call = {'mode': 'L', 'address': '30032', 'points': points['x']}
+        time_construct_call = ('L', 0x30000, points['time'])
+        x_construct_call = ('L', 0x30032, points['x'])
         time_cmd = 'WL$30000,10,10,10,10,10,10,10,10,10,10,10,10,10,10,' \
                    '10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,' \
                    '10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,10,10'
         x_cmd = 'WL$30032,20,20,20,20,20,20,20,20,20,20,20,20,20,20,' \
                 '20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,' \
                 '20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,20,20'
-        construct_mock.side_effect = [{'command': time_cmd, 'points': [], 'num_sent': 0},
-                                      {'command': x_cmd, 'points': [], 'num_sent': 0}]
+        construct_mock.side_effect = lambda mode, address, axis_points: \
+            [time_cmd] if address == 0x30000 else [x_cmd]
 
         self.pmac._fill_buffer(points)
 
-        construct_calls = [call[0][0] for call in construct_mock.call_args_list]
-        send_calls = [call[0][0] for call in send_mock.call_args_list]
+        construct_calls = [call[0] for call in construct_mock.call_args_list]
+        send_calls = send_mock.call_args[0][0]
 
         self.assertIn(x_construct_call, construct_calls)
         self.assertIn(time_construct_call, construct_calls)
+        send_mock.assert_called_once_with(ANY)
+        self.assertEqual(2, len(send_calls))
         self.assertIn(x_cmd, send_calls)
         self.assertIn(time_cmd, send_calls)
 
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_point_set_then_format_and_fill(self, send_mock):
+        self.pmac.update_address_dict(0x30000)
+        points = PointSet([500, 500], vel_mode=[1, 0], x=[10.0, 10.0])
+
+        self.pmac._fill_buffer(points)
+
+        self.assertItemsEqual(["WL$30000,$100001f4,$1f4",
+                               "WL$3015e,$500000000803,$500000000803"],
+                              send_mock.call_args[0][0])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_inactive_axes_then_skip(self, send_mock):
+        self.pmac.update_address_dict(0x30000)
+        self.pmac.active_axes = {'x'}
+        points = {'time': ['$1']*2, 'a': ['$0']*2, 'x': ['$2']*2, 'y': ['$0']*2}
+
+        self.pmac._fill_buffer(points)
+
+        self.assertItemsEqual(["WL$30000,$1,$1", "WL$3015e,$2,$2"],
+                              send_mock.call_args[0][0])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("I/O error during comm with PMAC", False)])
+    def test_given_write_fails_then_error(self, _):
+        self.pmac.addresses = {'time': 0x30000}
+        points = {'time': ['10']*5}
+        expected_error_message = "Write failed"
+
+        with self.assertRaises(IOError) as error:
+            self.pmac._fill_buffer(points)
+
+        self.assertEqual(expected_error_message, error.exception.message)
+
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_cache_and_repeated_points_then_send_cached_commands(self, send_mock):
+        self.pmac.enable_command_cache()
+        self.pmac.update_address_dict(0x30000)
+        points = PointSet([500, 500], vel_mode=[1, 0], x=[10.0, 10.0])
+
+        self.pmac._fill_buffer(points)
+        with patch.object(self.pmac, '_buffer_write_commands') as construct_mock:
+            self.pmac._fill_buffer(PointSet([500, 500], vel_mode=[1, 0], x=[10.0, 10.0]))
+
+        construct_mock.assert_not_called()
+        self.assertEqual(send_mock.call_args_list[0], send_mock.call_args_list[1])
+        self.assertEqual(1, self.pmac.command_cache.hits)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_cache_and_content_key_then_key_by_it(self, send_mock):
+        self.pmac.enable_command_cache()
+        self.pmac.update_address_dict(0x30000)
+
+        self.pmac._fill_buffer({'time': ['$1f4']*2}, "readable")
+        with patch.object(self.pmac, '_buffer_write_commands') as construct_mock:
+            self.pmac._fill_buffer({'time': ['$1f4']*2}, "readable")
+
+        construct_mock.assert_not_called()
+        self.assertEqual([["WL$30000,$1f4,$1f4"]]*2,
+                         [call[0][0] for call in send_mock.call_args_list])
+        self.assertEqual(1, self.pmac.command_cache.hits)
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_cache_and_other_half_buffer_then_construct(self, send_mock):
+        self.pmac.enable_command_cache()
+        points = {'time': ['$1']*2}
+
+        self.pmac.update_address_dict(0x30000)
+        self.pmac._fill_buffer(points)
+        self.pmac.update_address_dict(0x30226)
+        self.pmac._fill_buffer(points)
+
+        self.assertEqual(["WL$30000,$1,$1"], send_mock.call_args_list[0][0][0])
+        self.assertEqual(["WL$30226,$1,$1"], send_mock.call_args_list[1][0][0])
+        self.assertEqual(0, self.pmac.command_cache.hits)
+
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_delta_writes_then_write_changed_words(self, send_mock):
+        self.pmac.enable_delta_writes()
+        self.pmac.update_address_dict(0x30000)
+
+        self.pmac._fill_buffer({'time': ['$1f4']*6, 'x': ['$1', '$2', '$3', '$4', '$5', '$6']})
+        self.pmac._fill_buffer({'time': ['$1f4']*6, 'x': ['$1', '$7', '$3', '$8', '$5', '$6']})
+
+        self.assertEqual(["WL$3015f,$7,$3,$8"], send_mock.call_args[0][0])
+        self.assertEqual('$8', self.pmac.write_shadow[0x30161])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("\x06", True)])
+    def test_given_delta_writes_and_other_half_buffer_then_write_all(self, send_mock):
+        self.pmac.enable_delta_writes()
+        points = {'time': ['$1']*2}
 
-@patch('PmacTestHarness_test.TesterPmacTestHarness.read_address')
+        self.pmac.update_address_dict(0x30000)
+        self.pmac._fill_buffer(points)
+        self.pmac.update_address_dict(0x30226)
+        self.pmac._fill_buffer(points)
+
+        self.assertEqual(["WL$30226,$1,$1"], send_mock.call_args[0][0])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("I/O error during comm with PMAC", False)])
+    def test_given_delta_write_fails_then_forget_words(self, _):
+        self.pmac.enable_delta_writes()
+        self.pmac.write_shadow[0x30000] = '$0'
+        self.pmac.update_address_dict(0x30000)
+
+        with self.assertRaises(IOError):
+            self.pmac._fill_buffer({'time': ['$1']*2})
+
+        self.assertEqual({}, self.pmac.write_shadow)
+
+
+class ChangedRunsTest(unittest.TestCase):
+
+    def test_given_no_previous_words_then_one_run(self):
+        self.assertEqual([(0, 3)], PmacTestHarness._changed_runs(
+            [None]*3, ['$1', '$2', '$3']))
+
+    def test_given_no_changes_then_no_runs(self):
+        self.assertEqual([], PmacTestHarness._changed_runs(['$1', '$2'], ['$1', '$2']))
+
+    def test_given_short_gap_then_join_runs(self):
+        self.assertEqual([(0, 4)], PmacTestHarness._changed_runs(
+            ['$0', '$1', '$1', '$0'], ['$2', '$1', '$1', '$2']))
+
+    def test_given_long_gap_then_separate_runs(self):
+        previous = ['$0'] + ['$500000000803']*2 + ['$0']
+        words = ['$2'] + ['$500000000803']*2 + ['$2']
+
+        self.assertEqual([(0, 1), (3, 4)], PmacTestHarness._changed_runs(previous, words))
+
+
+@patch('PmacTestHarness_test.TesterPmacTestHarness.read_address_ranges')
 class ReadPointsTest(unittest.TestCase):
 
     def setUp(self):
         self.pmac = TesterPmacTestHarness()
+        self.words = [numpy.array([100]*3, dtype=numpy.uint64),
+                      numpy.array([200]*3, dtype=numpy.uint64),
+                      numpy.array([300]*3, dtype=numpy.uint64)]
+
+    def test_given_buffer_A_then_read(self, read_ranges_mock):
+        read_ranges_mock.return_value = self.words
 
-    def test_given_buffer_A_then_read(self, read_address_mock):
-        read_address_mock.side_effect = [100, 100, 100, 200, 200, 200,
-                                         300, 300, 300, 0, 0, 0, 0, 0,
-                                         0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                                         0, 0, 0, 0, 0, 0]
         pmac_buffer = self.pmac.read_points(3, buffer_num=0, num_axes=2)
 
-        points = [100, 100, 100,
-                  200, 200, 200,
-                  300, 300, 300]
+        read_ranges_mock.assert_called_once_with(
+            "L", [(0x30000, 3), (0x30032, 3), (0x30064, 3)])
+        self.assertEqual(3, len(pmac_buffer))
+        self.assertEqual([100]*3, pmac_buffer[0].tolist())
+        self.assertEqual([200]*3, pmac_buffer[1].tolist())
+        self.assertEqual([300]*3, pmac_buffer[2].tolist())
+
+    def test_given_buffer_B_then_read(self, read_ranges_mock):
+        read_ranges_mock.return_value = self.words
+
+        self.pmac.read_points(3, buffer_num=1, num_axes=2)
+
+        read_ranges_mock.assert_called_once_with(
+            "L", [(0x30226, 3), (0x30258, 3), (0x3028a, 3)])
+
+
+class ReadAddressRangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = TesterPmacTestHarness()
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands')
+    def test_given_full_buffer_then_one_command_per_range(self, send_mock):
+        send_mock.return_value = [(" ".join(["%012X" % axis_num]*1000) + "\r\x06", True)
+                                  for axis_num in range(10)]
+        ranges = [(0x30000 + axis_num*1000, 1000) for axis_num in range(10)]
+
+        words = self.pmac.read_address_ranges("L", ranges)
+
+        send_mock.assert_called_once_with(
+            ["RHL:${address:x},1000".format(address=address) for address, _ in ranges])
+        self.assertEqual([[axis_num]*1000 for axis_num in range(10)],
+                         [range_words.tolist() for range_words in words])
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[(" ".join(["000000000001"]*1000) + "\r\x06", True)])
+    def test_given_long_range_then_read_with_one_command(self, send_mock):
+        words = self.pmac.read_address_range("L", 0x30000, 1000)
+
+        send_mock.assert_called_once_with(["RHL:$30000,1000"])
+        self.assertEqual([1]*1000, words.tolist())
+
+    @patch('PmacTestHarness_test.TesterPmacTestHarness.sendCommands',
+           return_value=[("1\r\x06", True), ("ERR003\r\x06", False)])
+    def test_given_failed_read_then_error(self, _):
+        with self.assertRaises(IOError) as error:
+            self.pmac.read_address_ranges("L", [(0x30000, 1), (0x30032, 1)])
+
+        self.assertEqual("Read failed", error.exception.message)
+
+
+@patch('PmacTestHarness_test.TesterPmacTestHarness.read_points')
+class ReadDecodedPointsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = TesterPmacTestHarness()
+        self.pmac_buffer = [numpy.array([0x100001f4, 0x20001f4], dtype=numpy.uint64)] + \
+            [numpy.array([0x500000000803, 0xffaffffffff803], dtype=numpy.uint64)]*8
+
+    def test_given_active_axes_then_decode_them(self, read_points_mock):
+        read_points_mock.return_value = self.pmac_buffer
+        self.pmac.active_axes = {'x', 'a'}
+
+        points = self.pmac.read_decoded_points(2, buffer_num=1)
+
+        read_points_mock.assert_called_once_with(2, 1, 7)
+        self.assertEqual(['a', 'subroutine', 'time_val', 'vel_mode', 'x'], sorted(points))
+        self.assertEqual([500, 500], points['time_val'].tolist())
+        self.assertEqual([1, 0], points['vel_mode'].tolist())
+        self.assertEqual([0, 2], points['subroutine'].tolist())
+        self.assertEqual(10.0, points['x'][0])
+        self.assertAlmostEqual(-10.0, points['x'][1], places=9)
+
+    def test_given_axes_then_read_only_up_to_last(self, read_points_mock):
+        read_points_mock.return_value = self.pmac_buffer[:2]
+
+        points = self.pmac.read_decoded_points(2, axes=['A'])
+
+        read_points_mock.assert_called_once_with(2, 0, 1)
+        self.assertEqual([10.0, points['a'][1]], points['a'].tolist())
+
+
+class PmacFloatToDoubleTest(unittest.TestCase):
 
-        self.assertEqual(pmac_buffer[:9], points)
+    def test_given_words_then_decode(self):
+        self.assertEqual(0.0, PmacTestHarness.pmac_float_to_double("$0"))
+        self.assertEqual(10.0, PmacTestHarness.pmac_float_to_double("$500000000803"))
+        self.assertEqual(10.0, PmacTestHarness.pmac_float_to_double(0x500000000803))
+        # Negative values are stored as the 1's complement of the mantissa
+        self.assertEqual(-10.0 - 2.0**-31,
+                         PmacTestHarness.pmac_float_to_double("$ffaffffffff803"))
 
-    def test_given_buffer_B_then_read(self, read_address_mock):
-        read_address_mock.side_effect = [100, 100, 100, 200, 200, 200,
-                                         300, 300, 300, 0, 0, 0, 0, 0,
-                                         0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                                         0, 0, 0, 0, 0, 0]
-        pmac_buffer = self.pmac.read_points(3, buffer_num=1, num_axes=2)
+    def test_vectorised_matches_scalar_and_round_trips(self):
+        values = numpy.concatenate([[0.0, 1.0, -1.0, 0.5, 1e-9, -1e9],
+                                    numpy.random.uniform(-1000.0, 1000.0, 100)])
+        words = TrajectoryScanGenerator.doubles_to_pmac_float_words(values)
 
-        points = [100, 100, 100,
-                  200, 200, 200,
-                  300, 300, 300]
+        decoded = PmacTestHarness.pmac_floats_to_doubles(words)
 
-        self.assertEqual(pmac_buffer[:9], points)
+        self.assertEqual([PmacTestHarness.pmac_float_to_double(word)
+                          for word in words.tolist()], decoded.tolist())
+        numpy.testing.assert_allclose(values, decoded, rtol=1e-10)
 
 
 @patch('PmacTestHarness_test.TesterPmacTestHarness.set_variable')
@@ -0,0 +1,89 @@
+from test_harness.PointSet import PointSet
+import unittest
+
+from pkg_resources import require
+require('numpy')
+import numpy
+
+
+class InitTest(unittest.TestCase):
+
+    def test_given_time_only_then_default_modes(self):
+        points = PointSet([500, 500])
+
+        self.assertEqual(2, len(points))
+        self.assertEqual([0, 0], points.vel_mode.tolist())
+        self.assertEqual([0, 0], points.subroutine.tolist())
+        self.assertEqual({}, points.axes)
+
+    def test_given_different_lengths_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            PointSet([500, 500], x=[1.0])
+
+        self.assertEqual("Point set must have equal points in all axes",
+                         error.exception.message)
+
+    def test_given_invalid_axis_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            PointSet([500], q=[1.0])
+
+        self.assertEqual("Invalid axis q", error.exception.message)
+
+
+class SliceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.points = PointSet(numpy.arange(10), x=numpy.arange(10.0))
+
+    def test_given_slice_then_return_view(self):
+        view = self.points[2:5]
+
+        self.assertEqual([2, 3, 4], view.time_val.tolist())
+        self.assertTrue(numpy.may_share_memory(view.axes['x'], self.points.axes['x']))
+        self.assertTrue(numpy.may_share_memory(view.time_val, self.points.time_val))
+
+    def test_given_index_then_error(self):
+        with self.assertRaises(TypeError):
+            self.points[2]
+
+    def test_buffers(self):
+        buffers = list(self.points.buffers(4))
+
+        self.assertEqual([4, 4, 2], [len(points) for points in buffers])
+        self.assertEqual([8.0, 9.0], buffers[2].axes['x'].tolist())
+
+    def test_concatenate(self):
+        points = PointSet.concatenate([self.points[8:], self.points[:1]])
+
+        self.assertEqual([8, 9, 0], points.time_val.tolist())
+        self.assertEqual([8.0, 9.0, 0.0], points.axes['x'].tolist())
+
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.point_set = {'time': [{'time_val': 500, 'vel_mode': 1, 'subroutine': 0},
+                                   {'time_val': 500, 'vel_mode': 0, 'subroutine': 2}],
+                          'x': [10.0, -10.0], 'y': []}
+
+    def test_round_trip(self):
+        points = PointSet.from_point_set(self.point_set)
+
+        del self.point_set['y']
+        self.assertEqual(self.point_set, points.to_point_set())
+
+    def test_to_pmac_format(self):
+        points = PointSet.from_point_set(self.point_set)
+
+        formatted = points.to_pmac_format()
+
+        self.assertEqual({'time': ['$100001f4', '$20001f4'],
+                          'x': ['$500000000803', '$ffaffffffff803']}, formatted)
+
+    def test_given_invalid_vel_mode_then_error(self):
+        points = PointSet([500], vel_mode=[3])
+
+        with self.assertRaises(ValueError) as error:
+            points.to_pmac_format()
+
+        self.assertEqual("Velocity mode must be 0, 1 or 2", error.exception.message)
@@ -0,0 +1,56 @@
+from test_harness.SwapScheduler import SwapScheduler
+import unittest
+
+
+class ObserveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = SwapScheduler(smoothing=1.0)
+
+    def test_given_first_observation_then_predict_from_time_values(self):
+        swap_time = self.scheduler.observe(10.0, 0, 2, [400]*10)
+
+        self.assertAlmostEqual(10.8, swap_time)
+        self.assertAlmostEqual(0.3, self.scheduler.time_to_swap(10.5))
+
+    def test_given_slow_consumption_then_scale_prediction(self):
+        self.scheduler.observe(10.0, 0, 2, [400]*10)
+        swap_time = self.scheduler.observe(10.4, 0, 4, [400]*10)
+
+        self.assertAlmostEqual(2.0, self.scheduler.rate)
+        self.assertAlmostEqual(11.6, swap_time)
+
+    def test_given_new_buffer_then_keep_rate(self):
+        self.scheduler.observe(10.0, 0, 2, [400]*10)
+        self.scheduler.observe(10.1, 1, 0, [400]*10)
+
+        self.assertEqual(1.0, self.scheduler.rate)
+
+    def test_given_no_observations_then_no_time_to_swap(self):
+        self.assertIsNone(self.scheduler.time_to_swap(10.0))
+
+
+class PlanWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = SwapScheduler(smoothing=1.0, safety_margin=0.05)
+        self.scheduler.observe(10.0, 0, 0, [400]*10)
+
+    def test_given_no_write_time_then_not_at_risk(self):
+        plan = self.scheduler.plan_write(10.0)
+
+        self.assertAlmostEqual(11.0, plan['deadline'])
+        self.assertFalse(plan['at_risk'])
+
+    def test_given_slow_writes_then_at_risk(self):
+        self.scheduler.record_write(0.0, 0.98)
+
+        self.assertTrue(self.scheduler.plan_write(10.0)['at_risk'])
+        self.assertFalse(self.scheduler.plan_write(9.9)['at_risk'])
+
+    def test_record_write_checks_deadline(self):
+        self.scheduler.plan_write(10.0)
+
+        self.assertFalse(self.scheduler.record_write(10.0, 10.5))
+        self.assertTrue(self.scheduler.record_write(10.0, 11.5))
+        self.assertAlmostEqual(1.5, self.scheduler.write_time)
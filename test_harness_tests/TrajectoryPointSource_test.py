@@ -0,0 +1,46 @@
+from test_harness.TrajectoryPointSource import TrajectoryPointSource
+from test_harness.TrajectoryScanGenerator import TrajectoryScanGenerator
+import unittest
+
+from scanpointgenerator import CompoundGenerator, LineGenerator
+
+
+class SnakeScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trajectory = {'move_time': 100, 'start': [0.0, 0.0], 'stop': [20.0, 20.0],
+                           'num': [3, 3], 'direction': 0}
+        self.source = TrajectoryPointSource.snake_scan(self.trajectory)
+
+    def test_given_snake_scan_then_chunks_match_generate_snake_scan(self):
+        scan = TrajectoryScanGenerator()
+        scan.generate_snake_scan(self.trajectory)
+
+        chunks = list(self.source.readable_chunks(4))
+
+        self.assertEqual(9, self.source.num_points)
+        self.assertEqual([4, 4, 1], [len(chunk['time']) for chunk in chunks])
+        for axis in ['time', 'x', 'y']:
+            self.assertEqual(scan.point_set[axis],
+                             sum([chunk[axis] for chunk in chunks], []))
+
+    def test_given_snake_scan_then_encode_chunks(self):
+        chunks = list(self.source.chunks(5))
+
+        self.assertEqual(2, len(chunks))
+        self.assertEqual(['$0', '$500000000803', '$500000000804', '$500000000804',
+                          '$500000000803'], chunks[0]['x'])
+        self.assertEqual(['$64', '$1000064', '$12000064', '$20000064',
+                          '$1000064'], chunks[0]['time'])
+
+
+class PointSourceTest(unittest.TestCase):
+
+    def test_given_no_point_modes_then_default_to_zero(self):
+        gen = CompoundGenerator([LineGenerator("x", "mm", 0.0, 1.0, 2)], [], [])
+        source = TrajectoryPointSource(gen, 400)
+
+        chunks = list(source.readable_chunks(10))
+
+        self.assertEqual([{'time': [{'time_val': 400, 'vel_mode': 0, 'subroutine': 0}]*2,
+                           'x': [0.0, 1.0]}], chunks)
@@ -1,10 +1,16 @@
 from test_harness.TrajectoryScanGenerator import TrajectoryScanGenerator
+from test_harness.PointSet import PointSet
+from test_harness.PmacCoordinateSystem import PmacCoordinateSystem
+from test_harness.PmacTestHarness import PmacTestHarness
 import unittest
 
 from pkg_resources import require
 require("mock")
 from mock import ANY, patch, MagicMock
 
+require("numpy")
+import numpy
+
 
 class DoubleToPmacFloatTest(unittest.TestCase):
 
@@ -44,21 +50,77 @@ class DoubleToPmacFloatTest(unittest.TestCase):
         self.assertEqual(pmac_float, value)
 
 
+class DoublesToPmacFloatsTest(unittest.TestCase):
+
+    def test_given_values_then_match_scalar_conversion(self):
+        numpy.random.seed(0)
+        values = numpy.concatenate([
+            [0.0, 10.0, -10.0, 1.0, -1.0, 2.0, 0.5, 0.295599839124, 1.2955998341],
+            numpy.random.uniform(-1.0, 1.0, 1000),
+            numpy.random.uniform(-10000000.0, 10000000.0, 1000),
+            numpy.random.uniform(-6.8e10, 6.8e10, 100),
+            numpy.round(numpy.random.uniform(-1000.0, 1000.0, 1000), 3)])
+        expected = [TrajectoryScanGenerator.double_to_pmac_float(value)
+                    for value in values.tolist()]
+
+        pmac_floats = TrajectoryScanGenerator.doubles_to_pmac_floats(values)
+
+        self.assertEqual(expected, pmac_floats)
+
+    def test_given_values_then_return_words(self):
+        words = TrajectoryScanGenerator.doubles_to_pmac_float_words([0, 10, -10])
+
+        self.assertEqual(numpy.uint64, words.dtype)
+        self.assertEqual([0, 0x500000000803, 0xffaffffffff803], words.tolist())
+
+    def test_given_no_values_then_return_empty(self):
+        pmac_floats = TrajectoryScanGenerator.doubles_to_pmac_floats([])
+
+        self.assertEqual([], pmac_floats)
+
+    def test_given_infinite_value_then_error(self):
+        expected_error = "Values must be finite"
+
+        with self.assertRaises(ValueError) as error:
+            TrajectoryScanGenerator.doubles_to_pmac_float_words([1.0, numpy.inf])
+
+        self.assertEqual(expected_error, error.exception.message)
+
+
+    def test_given_values_at_limit_then_match_scalar_conversion(self):
+        values = [numpy.nextafter(2.0**36, 0), -numpy.nextafter(2.0**36, 0)]
+
+        pmac_floats = TrajectoryScanGenerator.doubles_to_pmac_floats(values)
+
+        self.assertEqual([TrajectoryScanGenerator.double_to_pmac_float(value)
+                          for value in values], pmac_floats)
+        numpy.testing.assert_allclose(values, PmacTestHarness.pmac_floats_to_doubles(
+            [int(pmac_float[1:], 16) for pmac_float in pmac_floats]), rtol=1e-10)
+
+    def test_given_value_too_large_then_error(self):
+        for value in [2.0**36, -1e20]:
+            with self.assertRaises(ValueError) as error:
+                TrajectoryScanGenerator.doubles_to_pmac_float_words([1.0, value])
+            self.assertEqual("Values must be less than 2**36 in magnitude",
+                             error.exception.message)
+
+            with self.assertRaises(ValueError):
+                TrajectoryScanGenerator.double_to_pmac_float(value)
+
+
 class ConvertPointsToPmacFloat(unittest.TestCase):
 
     def setUp(self):
         self.ScanGen = TrajectoryScanGenerator()
 
-    @patch('test_harness.TrajectoryScanGenerator.TrajectoryScanGenerator.double_to_pmac_float')
+    @patch('test_harness.TrajectoryScanGenerator.TrajectoryScanGenerator.doubles_to_pmac_floats')
     def test_given_points_call_convert_function(self, converter_mock):
         points = {'time': [10, 10, 10, 10],
                   'x': [0.0, 0.099861063292, 0.198723793760, 0.295599839129]}
 
         self.ScanGen.convert_points_to_pmac_float(points)
 
-        self.assertEqual(4, converter_mock.call_count)
-        call_list = [call[0][0] for call in converter_mock.call_args_list]
-        self.assertEqual(call_list, points['x'])
+        converter_mock.assert_called_once_with(points['x'])
 
 
 class SetPointSpecifiersTest(unittest.TestCase):
@@ -105,6 +167,36 @@ class SetPointSpecifiersTest(unittest.TestCase):
         self.assertEqual(expected_error, error.exception.message)
 
 
+class PackTimeWordsTest(unittest.TestCase):
+
+    def test_given_modes_then_match_scalar_functions(self):
+        expected = [TrajectoryScanGenerator.set_point_vel_mode(
+            TrajectoryScanGenerator.set_point_subroutine("$1f4", 14), 2), "$1f4"]
+
+        words = TrajectoryScanGenerator.pack_time_words([500, 500], [2, 0], [14, 0])
+
+        self.assertEqual(expected, ["$%x" % word for word in words.tolist()])
+        self.assertEqual(numpy.uint64, words.dtype)
+
+    def test_given_invalid_vel_mode_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            TrajectoryScanGenerator.pack_time_words([500, 500], [0, -1], [0, 0])
+
+        self.assertEqual("Velocity mode must be 0, 1 or 2", error.exception.message)
+
+    def test_given_invalid_subroutine_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            TrajectoryScanGenerator.pack_time_words([500], [0], [15])
+
+        self.assertEqual("Subroutine must be in range 1 - 15", error.exception.message)
+
+    def test_given_time_too_long_then_error(self):
+        with self.assertRaises(ValueError) as error:
+            TrajectoryScanGenerator.pack_time_words([0x1000000], [0], [0])
+
+        self.assertEqual("Time value must be in range 0 - 16777215", error.exception.message)
+
+
 class GetBufferOfPointsTest(unittest.TestCase):
 
     def setUp(self):
@@ -141,6 +233,40 @@ class GetBufferOfPointsTest(unittest.TestCase):
         self.assertEqual(expected_points, points)
 
 
+class GetBufferOfPointSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.PointGen = TrajectoryScanGenerator()
+        self.PointGen.point_set = PointSet([500]*5, x=[0.0, 0.10, 0.19, 0.29, 0.38])
+
+    def test_given_no_overflow_then_return_view(self):
+        points, end = self.PointGen.grab_buffer_of_points(0, 4)
+
+        self.assertEqual(4, end)
+        self.assertEqual([0.0, 0.10, 0.19, 0.29], points.axes['x'].tolist())
+        self.assertTrue(numpy.may_share_memory(points.axes['x'],
+                                               self.PointGen.point_set.axes['x']))
+
+    def test_given_overflow_then_wrap_around(self):
+        points, end = self.PointGen.grab_buffer_of_points(3, 4)
+
+        self.assertEqual(2, end)
+        self.assertEqual([0.29, 0.38, 0.0, 0.10], points.axes['x'].tolist())
+
+    def test_generate_buffer_points(self):
+        points, end = self.PointGen.generate_buffer_of_points(3, 12)
+
+        self.assertEqual(5, end)
+        self.assertEqual([0.29, 0.38, 0.0, 0.10, 0.19, 0.29, 0.38, 0.0, 0.10, 0.19,
+                          0.29, 0.38], points.axes['x'].tolist())
+
+    def test_format_point_set(self):
+        self.PointGen.format_point_set()
+
+        self.assertEqual(['$1f4']*5, self.PointGen.point_set['time'])
+        self.assertEqual(5, len(self.PointGen.point_set['x']))
+
+
 class CheckMaxVelocityTest(unittest.TestCase):
 
     def setUp(self):
@@ -171,6 +297,45 @@ class CheckMaxVelocityTest(unittest.TestCase):
 
         self.assertEqual(expected_error_message, error.exception.message)
 
+    def test_given_negative_overspeed_then_error(self):
+        self.ScanGen.point_set = {'time': [{'time_val': 1, 'subroutine': 0, 'vel_mode': 0}]*3,
+                                  'x': [3, 3, 2]}
+
+        expected_error_message = "Points set will exceed maximum velocity, 1, for axis x: -4.0"
+
+        with self.assertRaises(ValueError) as error:
+            self.ScanGen.check_max_velocity_of_points(self.PmacCS)
+
+        self.assertEqual(expected_error_message, error.exception.message)
+
+
+class CheckLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ScanGen = TrajectoryScanGenerator()
+        self.PmacCS = PmacCoordinateSystem(1)
+        self.PmacCS.max_velocities.update({'x': 1.0, 'y': 1.0})
+        self.PmacCS.max_accelerations['x'] = 0.05
+
+    def test_given_valid_points_then_no_violations(self):
+        self.ScanGen.point_set = PointSet([40]*4, x=[0.0, 1.0, 2.0, 3.0],
+                                          y=[0.0, -1.0, -2.0, -3.0])
+
+        self.assertEqual([], self.ScanGen.check_limits_of_points(self.PmacCS))
+
+    def test_given_invalid_points_then_report_each_violation(self):
+        self.ScanGen.point_set = {'time': [{'time_val': 40, 'subroutine': 0, 'vel_mode': 0}]*4,
+                                  'x': [0.0, 0.0, 10.0, 10.0],
+                                  'y': [0.0, -20.0, -20.0, -20.0]}
+
+        violations = self.ScanGen.check_limits_of_points(self.PmacCS)
+
+        self.assertEqual([
+            {'index': 1, 'axis': 'x', 'limit': 'acceleration', 'value': 0.1, 'max': 0.05},
+            {'index': 1, 'axis': 'y', 'limit': 'velocity', 'value': -2.0, 'max': 1.0},
+            {'index': 2, 'axis': 'x', 'limit': 'acceleration', 'value': -0.1, 'max': 0.05}],
+            violations)
+
 
 class FormatPointsTest(unittest.TestCase):
 
@@ -181,13 +346,9 @@ class FormatPointsTest(unittest.TestCase):
                                   'time': [{'time_val': 500, 'subroutine': 10, 'vel_mode': 0},
                                            {'time_val': 500, 'subroutine': 0, 'vel_mode': 1}]}
 
-    @patch('test_harness.TrajectoryScanGenerator.TrajectoryScanGenerator.double_to_pmac_float',
-           side_effect=['$0', '$1', '$2', '$3'])
-    @patch('test_harness.TrajectoryScanGenerator.TrajectoryScanGenerator.set_point_subroutine',
-           return_value='$a0001f4')
-    @patch('test_harness.TrajectoryScanGenerator.TrajectoryScanGenerator.set_point_vel_mode',
-           return_value='$100001f4')
-    def test_given_point_set_then_correct_calls_made(self, set_vel_mock, set_sub_mock, d_to_pf_mock):
+    @patch('test_harness.TrajectoryScanGenerator.TrajectoryScanGenerator.doubles_to_pmac_floats',
+           side_effect=[['$0', '$1'], ['$2', '$3']])
+    def test_given_point_set_then_correct_calls_made(self, d_to_pf_mock):
         expected_point_set = {'time': ['$a0001f4', '$100001f4'],
                               'x': ['$2', '$3'], 'y': ['$0', '$1'], 'u': [],
                               'v': [], 'w': [], 'a': [], 'b': [], 'c': [], 'z': []}
@@ -195,9 +356,7 @@ class FormatPointsTest(unittest.TestCase):
         self.ScanGen.format_point_set()
 
         call_list = [call[0][0] for call in d_to_pf_mock.call_args_list]
-        self.assertEqual([1.0, 0.99, 0.0, 0.1], call_list)
-        set_sub_mock.assert_called_once_with('$1f4', 10)
-        set_vel_mock.assert_called_once_with('$1f4', 1)
+        self.assertEqual([[1.0, 0.99], [0.0, 0.1]], call_list)
         self.assertEqual(expected_point_set, self.ScanGen.point_set)
 
 
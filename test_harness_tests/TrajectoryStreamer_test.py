@@ -0,0 +1,173 @@
+from test_harness.PmacCommandCache import PmacCommandCache
+from test_harness.PmacStatus import PmacStatus
+from test_harness.TrajectoryStreamer import TrajectoryStreamer
+import time
+import unittest
+
+from pkg_resources import require
+require("mock")
+from mock import MagicMock, patch
+
+
+def make_chunk(num_points, time_val=400):
+    return {'time': [{'time_val': time_val, 'subroutine': 0, 'vel_mode': 0}]*num_points,
+            'x': [float(i) for i in range(num_points)]}
+
+
+class FakePmac(MagicMock):
+    """
+    A MagicMock pmac whose status variables step through `states` on each
+    update_status_variables call
+
+    """
+
+    def set_states(self, states):
+        self.states = list(states)
+        self.status = 1
+        self.current_buffer = 0
+        self.current_index = 0
+        self.prev_buffer_write = 1
+        self.command_cache = None
+        self.update_status_variables.side_effect = self._next_state
+        self.take_snapshot()
+
+    def take_snapshot(self):
+        self.status_snapshot = PmacStatus(
+            [self.status, 0, 0, self.current_index, self.current_buffer, 0, 0, 0, 0],
+            time.time())
+        return self.status_snapshot
+
+    def _next_state(self):
+        if len(self.states) > 0:
+            self.status, self.current_buffer, self.current_index = self.states.pop(0)
+        return self.take_snapshot()
+
+
+@patch('test_harness.TrajectoryStreamer.TrajectoryStreamer.encode_points',
+       side_effect=lambda points: {'time': ['$190']*len(points['time'])})
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = FakePmac()
+
+    def test_given_no_chunks_then_do_nothing(self, _):
+        self.pmac.set_states([])
+        streamer = TrajectoryStreamer(self.pmac, [], poll_period=0)
+
+        swaps = streamer.run(1, 1)
+
+        self.assertEqual([], swaps)
+        self.assertFalse(self.pmac.run_motion_program.called)
+
+    def test_given_chunks_then_fill_alternate_buffers(self, encode_mock):
+        chunks = [make_chunk(5), make_chunk(5), make_chunk(5), make_chunk(3)]
+        # After start, after B write, poll, poll (swap to B), after A write,
+        # poll (swap to A), after B write, poll (swap to B), poll (finished)
+        self.pmac.set_states([(1, 0, 1), (1, 0, 2), (1, 0, 4), (1, 1, 1), (1, 1, 2),
+                              (1, 0, 1), (1, 0, 2), (1, 1, 0), (2, 1, 3)])
+        streamer = TrajectoryStreamer(self.pmac, chunks, poll_period=0)
+
+        swaps = streamer.run(1, 1)
+
+        self.assertEqual(4, encode_mock.call_count)
+        self.pmac.fill_current_buffer.assert_called_once_with({'time': ['$190']*5}, None)
+        self.pmac.set_current_buffer_fill.assert_called_once_with(5)
+        self.pmac.run_motion_program.assert_called_once_with(1, 1)
+        self.assertEqual(3, self.pmac.fill_idle_buffer.call_count)
+        idle_fills = [call[0][0] for call in self.pmac.set_idle_buffer_fill.call_args_list]
+        self.assertEqual([5, 5, 3, 0], idle_fills)
+
+        self.assertEqual(['B', 'A', 'B'], [swap['buffer'] for swap in swaps])
+        self.assertEqual([3, 3, 3], [swap['margin_points'] for swap in swaps])
+        self.assertEqual([0.3, 0.3, 0.3], [swap['margin_time'] for swap in swaps])
+        self.assertEqual([False, False, False], [swap['underrun'] for swap in swaps])
+        self.assertEqual([False, False, False],
+                         [swap['deadline_missed'] for swap in swaps])
+
+    def test_given_command_cache_then_key_chunks_by_readable_content(self, encode_mock):
+        chunks = [make_chunk(5), make_chunk(5)]
+        self.pmac.set_states([(1, 0, 1), (1, 0, 2), (2, 1, 5)])
+        self.pmac.command_cache = MagicMock()
+        streamer = TrajectoryStreamer(self.pmac, chunks, poll_period=0)
+
+        streamer.run(1, 1)
+
+        content_key = PmacCommandCache.content_key(make_chunk(5))
+        self.assertEqual(2, encode_mock.call_count)
+        self.pmac.fill_current_buffer.assert_called_once_with(
+            {'time': ['$190']*5}, content_key)
+        self.pmac.fill_idle_buffer.assert_called_once_with(
+            {'time': ['$190']*5}, content_key)
+
+    def test_given_write_finishes_after_swap_then_report_underrun(self, _):
+        chunks = [make_chunk(5), make_chunk(5), make_chunk(5)]
+        self.pmac.set_states([(1, 0, 1), (1, 0, 2), (1, 1, 4), (1, 0, 1), (2, 0, 5)])
+        callback = MagicMock()
+        streamer = TrajectoryStreamer(self.pmac, chunks, poll_period=0,
+                                      swap_callback=callback)
+
+        swaps = streamer.run(1, 1)
+
+        self.assertEqual([False, True], [swap['underrun'] for swap in swaps])
+        self.assertEqual([False, True], [swap['deadline_missed'] for swap in swaps])
+        self.assertEqual(0, swaps[1]['margin_points'])
+        self.assertEqual(2, callback.call_count)
+
+    def test_given_encoding_error_then_raise(self, encode_mock):
+        encode_mock.side_effect = ValueError("Velocity mode must be 0, 1 or 2")
+        self.pmac.set_states([])
+        streamer = TrajectoryStreamer(self.pmac, [make_chunk(5)], poll_period=0)
+
+        with self.assertRaises(ValueError):
+            streamer.run(1, 1)
+
+
+class PollDelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = FakePmac()
+        self.pmac.set_states([])
+        self.streamer = TrajectoryStreamer(self.pmac, [], poll_period=0.1,
+                                           min_poll_period=0.001)
+
+    def test_given_swap_far_off_then_max_period(self):
+        self.assertEqual(0.1, self.streamer._poll_delay(make_chunk(5, time_val=4000)))
+
+    def test_given_swap_close_then_half_time_left(self):
+        self.pmac.current_index = 3
+        self.pmac.take_snapshot()
+
+        self.assertAlmostEqual(0.01, self.streamer._poll_delay(make_chunk(5, time_val=40)),
+                               places=3)
+
+    def test_given_swap_due_then_min_period(self):
+        self.pmac.current_index = 5
+        self.pmac.take_snapshot()
+
+        self.assertEqual(0.001, self.streamer._poll_delay(make_chunk(5)))
+
+    def test_given_unknown_points_then_max_period(self):
+        self.assertEqual(0.1, self.streamer._poll_delay(None))
+
+    def test_observe_at_time_of_snapshot(self):
+        self.pmac.current_index = 3
+        snapshot = self.pmac.take_snapshot()
+        self.streamer.scheduler = MagicMock()
+        self.streamer.scheduler.time_to_swap.return_value = 0.0
+
+        self.streamer._poll_delay(make_chunk(5, time_val=40))
+
+        self.streamer.scheduler.observe.assert_called_once_with(
+            snapshot.timestamp, 0, 3, [40]*5)
+
+
+class EncodePointsTest(unittest.TestCase):
+
+    def test_given_readable_points_then_format(self):
+        points = {'time': [{'time_val': 500, 'subroutine': 0, 'vel_mode': 1}],
+                  'x': [10.0]}
+
+        encoded = TrajectoryStreamer.encode_points(points)
+
+        self.assertEqual(['$100001f4'], encoded['time'])
+        self.assertEqual(['$500000000803'], encoded['x'])
@@ -0,0 +1,262 @@
+from dls_pmacremote import PmacEthernetInterface, PmacMetrics, PmacEventLoop, IOPmacErrorResponse
+from test_harness.PmacSimulator import PmacSimulator
+import unittest
+
+from pkg_resources import require
+require("mock")
+from mock import MagicMock, patch
+
+
+@patch('dls_pmacremote.PmacEthernetInterface._sendCommand')
+class SendCommandsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pmac = PmacEthernetInterface()
+
+    def test_given_short_commands_then_pack_into_one_packet(self, send_mock):
+        send_mock.return_value = "\x06"
+        commands = ["WL$30000,$0", "WL$30001,$0", "P4002=1"]
+
+        responses = self.pmac.sendCommands(commands)
+
+        send_mock.assert_called_once_with("WL$30000,$0 WL$30001,$0 P4002=1",
+                                          shouldWait=True, doubleTimeout=False)
+        self.assertEqual([("\x06", True)]*3, responses)
+
+    def test_given_commands_over_limit_then_split_packets(self, send_mock):
+        send_mock.return_value = "\x06"
+        command = "WL$30000," + "1"*491
+        commands = [command]*3
+
+        responses = self.pmac.sendCommands(commands)
+
+        send_calls = [call[0][0] for call in send_mock.call_args_list]
+        self.assertEqual([command + " " + command, command], send_calls)
+        self.assertEqual(3, len(responses))
+
+    def test_given_command_too_long_then_error(self, _):
+        commands = ["WL$30000," + "1"*1400]
+
+        with self.assertRaises(ValueError):
+            self.pmac.sendCommands(commands)
+
+    def test_given_queries_then_demultiplex_responses(self, send_mock):
+        send_mock.return_value = "1\r2\r3\r4\r\x06"
+        commands = ["P4001", "P4002=1", "P4003..4005"]
+
+        responses = self.pmac.sendCommands(commands, responseLines=[1, 0, 3])
+
+        send_mock.assert_called_once_with("P4001 P4002=1 P4003..4005",
+                                          shouldWait=True, doubleTimeout=False)
+        self.assertEqual([("1\r\x06", True), ("\x06", True), ("2\r3\r4\r\x06", True)],
+                         responses)
+
+    def test_given_error_then_fail_remaining_commands(self, send_mock):
+        send_mock.side_effect = IOPmacErrorResponse("PMAC communication error", "1\r\x07ERR003\r")
+        commands = ["P4001", "WLnonsense", "P4003"]
+
+        responses = self.pmac.sendCommands(commands)
+
+        self.assertEqual(("1\r\x06", True), responses[0])
+        self.assertEqual(("ERR003\r\x06", False), responses[1])
+        self.assertFalse(responses[2][1])
+
+    def test_given_unexpected_lines_then_fail_all_commands(self, send_mock):
+        send_mock.return_value = "1\r2\r\x06"
+        commands = ["P4001", "P4002=1"]
+
+        responses = self.pmac.sendCommands(commands)
+
+        self.assertEqual([False, False], [success for _, success in responses])
+
+    def test_given_io_error_then_fail_all_commands(self, send_mock):
+        send_mock.side_effect = IOError("Socket communication error")
+        commands = ["P4001", "P4002"]
+
+        responses = self.pmac.sendCommands(commands)
+
+        self.assertEqual([False, False], [success for _, success in responses])
+
+
+class PmacMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = PmacMetrics()
+
+    def test_command_type(self):
+        self.assertEqual("WL", PmacMetrics.commandType(" wl$30000,$0"))
+        self.assertEqual("P", PmacMetrics.commandType("P4001"))
+        self.assertEqual("#", PmacMetrics.commandType("#1P"))
+        self.assertEqual("?", PmacMetrics.commandType(""))
+
+    def test_given_commands_then_snapshot_totals_and_histogram(self):
+        self.metrics.recordCommand("P4001", 0.0015, 13, 5, 0, True)
+        self.metrics.recordCommand("P4002", 0.0025, 13, 9, 0, True)
+        self.metrics.recordCommand("RHL:$30000,500", 10.0, 23, 3000, 2, False)
+        self.metrics.recordSemaphoreWait(0.5)
+
+        snapshot = self.metrics.snapshot()
+
+        self.assertEqual(49, snapshot['bytesSent'])
+        self.assertEqual(3014, snapshot['bytesReceived'])
+        self.assertEqual(2, snapshot['continuations'])
+        self.assertEqual(1, snapshot['errors'])
+        self.assertEqual(1, snapshot['semaphoreWaits'])
+        self.assertEqual(0.5, snapshot['semaphoreWaitTime'])
+        p_stats = snapshot['commandTypes']['P']
+        self.assertEqual(2, p_stats['count'])
+        self.assertAlmostEqual(0.002, p_stats['meanLatency'])
+        self.assertEqual(1, p_stats['histogram'][2])
+        self.assertEqual(1, p_stats['histogram'][3])
+        self.assertEqual(1, snapshot['commandTypes']['RHL']['histogram'][-1])
+        self.assertEqual(1, snapshot['commandTypes']['RHL']['errors'])
+
+    def test_log_line(self):
+        self.metrics.recordCommand("P4001", 0.002, 13, 5, 0, True)
+
+        line = self.metrics.logLine()
+
+        self.assertIn("sent=13B received=5B", line)
+        self.assertIn("P=1/2.0ms", line)
+
+
+class MetricsConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = PmacSimulator(port=0, max_response_length=1400)
+        port = self.sim.start()
+        self.pmac = PmacEthernetInterface()
+        self.pmac.setConnectionParams("127.0.0.1", port)
+        self.pmac.connect()
+
+    def tearDown(self):
+        self.pmac.disconnect()
+        self.sim.stop()
+
+    def test_given_metrics_enabled_then_count_wire_traffic(self):
+        metrics = self.pmac.enableMetrics()
+
+        self.pmac.sendCommand("RHL:$30000,200")
+        self.pmac.sendCommand("nonsense")
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(1, snapshot['continuations'])
+        self.assertEqual(16 + len("RHL:$30000,200") + len("nonsense") + 8,
+                         snapshot['bytesSent'])
+        self.assertEqual(200*13 + 1 + len("\x07ERR003\r"), snapshot['bytesReceived'])
+        self.assertEqual(1, snapshot['commandTypes']['RHL']['count'])
+        self.assertEqual(1, snapshot['commandTypes']['NONSENSE']['errors'])
+        self.assertEqual(2, snapshot['semaphoreWaits'])
+
+    def test_given_full_packet_ending_in_line_end_then_continue(self):
+        # 9 + 107*13 bytes fill the first 1400 byte packet up to the end of a line
+        self.sim.set_variable("P4001", 12345678)
+
+        response, success = self.pmac.sendCommand("P4001 RHL:$30000,107 P4002")
+
+        self.assertTrue(success)
+        self.assertEqual(1400 + len("0\r\x06"), len(response))
+        self.assertTrue(response.endswith("000000000000\r0\r\x06"))
+
+    def test_given_error_in_packed_line_then_report_failing_command(self):
+        self.sim.set_variable("P4001", 5)
+
+        responses = self.pmac.sendCommands(["P4001", "nonsense", "P4003"])
+
+        self.assertEqual(("5\r\x06", True), responses[0])
+        self.assertEqual(("ERR003\r\x06", False), responses[1])
+        self.assertEqual(("Not executed due to previous error", False), responses[2])
+
+    def test_given_error_then_send_command_fails(self):
+        response, success = self.pmac.sendCommand("nonsense")
+
+        self.assertFalse(success)
+        self.assertEqual("I/O error during comm with PMAC: PMAC communication error", response)
+
+    def test_given_metrics_disabled_then_nothing_recorded(self):
+        self.pmac.enableMetrics()
+        self.pmac.disableMetrics()
+
+        self.pmac.sendCommand("P4001")
+
+        self.assertIsNone(self.pmac.metrics)
+
+
+class PmacEventLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sims = [PmacSimulator(port=0, max_response_length=1400) for _ in range(2)]
+        self.ports = [sim.start() for sim in self.sims]
+        self.loop = PmacEventLoop()
+
+    def tearDown(self):
+        self.loop.close()
+        for sim in self.sims:
+            sim.stop()
+
+    def test_given_two_pmacs_then_drive_both_from_one_loop(self):
+        self.sims[0].set_variable("P4001", 1)
+        self.sims[1].set_variable("P4001", 2)
+        connections = [self.loop.connect("127.0.0.1", port) for port in self.ports]
+
+        requests = [connection.sendCommand("P4001") for connection in connections]
+        self.assertTrue(self.loop.runUntilDone(requests, timeout=5))
+
+        self.assertEqual([("1\r\x06", True), ("2\r\x06", True)],
+                         [request.result() for request in requests])
+
+    def test_given_long_response_then_continue_with_getbuffer(self):
+        connection = self.loop.connect("127.0.0.1", self.ports[0])
+        connection.sendCommand("WL$30000,$1,$2")
+
+        request = connection.sendCommand("RHL:$30000,200")
+        self.loop.runUntilDone([request], timeout=5)
+
+        response, success = request.result()
+        self.assertTrue(success)
+        self.assertEqual(200*13 + 1, len(response))
+        self.assertTrue(response.startswith("000000000001 000000000002 "))
+
+    def test_given_full_packet_ending_in_line_end_then_continue(self):
+        self.sims[0].set_variable("P4001", 12345678)
+        connection = self.loop.connect("127.0.0.1", self.ports[0])
+
+        request = connection.sendCommand("P4001 RHL:$30000,107 P4002")
+        self.loop.runUntilDone([request], timeout=5)
+
+        response, success = request.result()
+        self.assertTrue(success)
+        self.assertTrue(response.endswith("000000000000\r0\r\x06"))
+
+    def test_given_error_then_fail_request_and_continue(self):
+        connection = self.loop.connect("127.0.0.1", self.ports[0])
+        callback = MagicMock()
+
+        failed = connection.sendCommand("nonsense", callback)
+        request = connection.sendCommand("P4001")
+        self.loop.runUntilDone([failed, request], timeout=5)
+
+        callback.assert_called_once_with(failed)
+        self.assertEqual(("I/O error during comm with PMAC: PMAC communication error",
+                          False), failed.result())
+        self.assertEqual(("0\r\x06", True), request.result())
+
+    def test_given_no_response_then_time_out(self):
+        self.sims[0].latency = 0.5
+        connection = self.loop.connect("127.0.0.1", self.ports[0], timeout=0.1)
+
+        request = connection.sendCommand("P4001")
+        self.loop.runUntilDone([request], timeout=5)
+
+        self.assertEqual(("I/O error during comm with PMAC: Socket communication error",
+                          False), request.result())
+        self.assertFalse(connection.isConnectionOpen)
+
+    def test_given_connection_refused_then_fail(self):
+        self.sims[0].stop()
+        connection = self.loop.connect("127.0.0.1", self.ports[0])
+
+        request = connection.sendCommand("P4001")
+        self.loop.runUntilDone([request], timeout=5)
+
+        self.assertFalse(request.result()[1])